@@ -43,7 +43,7 @@ export default function HomeScreen() {
             }
 
             // Load Recent Scans
-            const scansData = await getScans(mobileNumber);
+            const scansData = await getScans(mobileNumber, 3);
             if (scansData) {
                 setRecentScans(scansData.slice(0, 3)); // Top 3 most recent
             }
@@ -4,7 +4,7 @@ import { useRouter, useFocusEffect } from 'expo-router';
 import { SafeAreaView } from 'react-native-safe-area-context';
 import { Ionicons } from '@expo/vector-icons';
 import { MaterialCommunityIcons } from '@expo/vector-icons';
-import { getScans, DEV_BACKEND_URL } from '../../services/api';
+import { getScansPage, DEV_BACKEND_URL } from '../../services/api';
 
 const FILTERS = [
     { id: 'All', label: 'All' },
@@ -17,6 +17,9 @@ export default function RecordsScreen() {
     const [activeFilter, setActiveFilter] = useState('All');
     const [records, setRecords] = useState<any[]>([]);
     const [loading, setLoading] = useState(true);
+    // History is paginated: the cursor of the next (older) page, null when everything is loaded
+    const [nextCursor, setNextCursor] = useState<string | null>(null);
+    const [loadingMore, setLoadingMore] = useState(false);
     const mobileNumber = "1234567890";
 
     useFocusEffect(
@@ -28,8 +31,9 @@ export default function RecordsScreen() {
     const loadRecords = async () => {
         setLoading(true);
         try {
-            const data = await getScans(mobileNumber);
-            setRecords(data);
+            const page = await getScansPage(mobileNumber);
+            setRecords(page.scans);
+            setNextCursor(page.nextCursor);
         } catch (error) {
             console.log("Failed to load records");
         } finally {
@@ -37,6 +41,20 @@ export default function RecordsScreen() {
         }
     };
 
+    const loadMoreRecords = async () => {
+        if (!nextCursor || loadingMore || loading) return;
+        setLoadingMore(true);
+        try {
+            const page = await getScansPage(mobileNumber, nextCursor);
+            setRecords(prev => [...prev, ...page.scans]);
+            setNextCursor(page.nextCursor);
+        } catch (error) {
+            console.log("Failed to load more records");
+        } finally {
+            setLoadingMore(false);
+        }
+    };
+
     const filtered = records.filter((item: any) =>
         item.breed.toLowerCase().includes(search.toLowerCase()) ||
         item.location.toLowerCase().includes(search.toLowerCase()) ||
@@ -158,9 +176,12 @@ export default function RecordsScreen() {
                 <FlatList
                     data={filtered}
                     renderItem={renderItem}
-                    keyExtractor={item => item.id}
+                    keyExtractor={item => String(item.id)}
                     contentContainerStyle={styles.listContent}
                     showsVerticalScrollIndicator={false}
+                    onEndReached={loadMoreRecords}
+                    onEndReachedThreshold={0.5}
+                    ListFooterComponent={loadingMore ? <ActivityIndicator style={{ marginVertical: 16 }} color="#1B4332" /> : null}
                 />
 
             </SafeAreaView>
@@ -30,16 +30,31 @@ export interface Prediction {
     confidence: number;
 }
 
-export const getScans = async (mobile: string): Promise<any[]> => {
+export interface ScanPage {
+    scans: any[];
+    nextCursor: string | null; // null on the last page
+}
+
+// One page of history, newest first. Pass the previous page's nextCursor to continue.
+export const getScansPage = async (mobile: string, cursor?: string | null, limit?: number): Promise<ScanPage> => {
     try {
-        const response = await api.get(`/scans/${mobile}`);
-        return response.data;
+        const params: Record<string, string | number> = {};
+        if (cursor) params.cursor = cursor;
+        if (limit) params.limit = limit;
+        const response = await api.get(`/scans/${mobile}`, { params });
+        return { scans: response.data, nextCursor: response.headers['x-next-cursor'] ?? null };
     } catch (error) {
         console.error('Get Scans Error:', error);
         throw error;
     }
 };
 
+// Newest scans only (first page)
+export const getScans = async (mobile: string, limit?: number): Promise<any[]> => {
+    const page = await getScansPage(mobile, null, limit);
+    return page.scans;
+};
+
 import { uploadAsync, FileSystemUploadType } from 'expo-file-system/legacy';
 
 // ... (existing imports)
@@ -0,0 +1,162 @@
+import asyncio
+import os
+import time
+from collections import Counter, deque
+
+# Tunables - bigger batches raise throughput, longer waits raise p99 latency
+BATCH_MAX_SIZE = int(os.environ.get("BATCH_MAX_SIZE", "16"))
+BATCH_MAX_WAIT_MS = float(os.environ.get("BATCH_MAX_WAIT_MS", "10"))
+
+
+class MicroBatcher:
+    """Collects concurrent calls into one batched call (forward pass, DB commit, ...).
+
+    `batch_fn` takes a list of inputs and returns one result per input. A plain
+    function is run in a thread so the event loop keeps serving other requests
+    meanwhile; a coroutine function is awaited directly. Up to `concurrency`
+    batches are in flight at once (one per inference worker).
+    """
+
+    def __init__(self, batch_fn, max_batch_size=BATCH_MAX_SIZE, max_wait_ms=BATCH_MAX_WAIT_MS, concurrency=1):
+        self.batch_fn = batch_fn
+        self._is_async = asyncio.iscoroutinefunction(batch_fn)
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait_ms / 1000.0
+        self.concurrency = max(1, concurrency)
+        self.queue = None
+        self._worker = None
+        self._slots = None
+        self._in_flight = set()
+        self._collecting = []
+
+        # Metrics
+        self.batch_sizes = Counter()
+        self.queue_waits = deque(maxlen=1000)  # seconds, most recent requests
+        self.total_requests = 0
+        self.total_batches = 0
+
+    def start(self):
+        if self._worker is None:
+            self.queue = asyncio.Queue()
+            self._slots = asyncio.Semaphore(self.concurrency)
+            self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+        # Finish everything that was already accepted (matters for DB writes)
+        if self._in_flight:
+            await asyncio.gather(*self._in_flight, return_exceptions=True)
+        leftover = self._collecting
+        self._collecting = []
+        while self.queue is not None and not self.queue.empty():
+            leftover.append(self.queue.get_nowait())
+        for start in range(0, len(leftover), self.max_batch_size):
+            await self._slots.acquire()
+            await self._dispatch(leftover[start:start + self.max_batch_size])
+
+    async def submit(self, item):
+        self.start()
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((item, future, time.perf_counter()))
+        return await future
+
+    async def _collect(self):
+        # Block for the first request, then take whatever else arrives before the deadline.
+        # The partial batch lives on self so stop() can still flush it
+        self._collecting = batch = [await self.queue.get()]
+        deadline = time.perf_counter() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.perf_counter()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+        # Drain anything already queued without waiting further
+        while len(batch) < self.max_batch_size and not self.queue.empty():
+            batch.append(self.queue.get_nowait())
+        self._collecting = []
+        return batch
+
+    async def _run(self):
+        while True:
+            # Wait for a free slot first, so requests keep piling into the next
+            # batch while every worker is busy
+            await self._slots.acquire()
+            try:
+                batch = await self._collect()
+            except BaseException:
+                # Cancelled by stop() mid-collect: its leftover flush needs this slot
+                self._slots.release()
+                raise
+            started = time.perf_counter()
+            for _, _, enqueued in batch:
+                self.queue_waits.append(started - enqueued)
+            self.batch_sizes[len(batch)] += 1
+            self.total_batches += 1
+            self.total_requests += len(batch)
+
+            task = asyncio.create_task(self._dispatch(batch))
+            self._in_flight.add(task)
+            task.add_done_callback(self._in_flight.discard)
+
+    async def _dispatch(self, batch):
+        loop = asyncio.get_running_loop()
+        items = [item for item, _, _ in batch]
+        try:
+            if self._is_async:
+                results = await self.batch_fn(items)
+            else:
+                results = await loop.run_in_executor(None, self.batch_fn, items)
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self._slots.release()
+
+        if len(results) != len(batch):
+            # A short result list would otherwise leave the unmatched callers waiting forever
+            error = RuntimeError(f"batch_fn returned {len(results)} results for {len(batch)} items")
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(error)
+            return
+
+        for (_, future, _), result in zip(batch, results):
+            # Caller may have disconnected and cancelled its future
+            if future.done():
+                continue
+            # batch_fn reports per-item failures (e.g. undecodable images) as exceptions
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def stats(self):
+        waits = sorted(self.queue_waits)
+
+        def pct(p):
+            if not waits:
+                return 0.0
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))] * 1000, 2)
+
+        return {
+            "queue_depth": self.queue.qsize() if self.queue else 0,
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait * 1000,
+            "in_flight_batches": len(self._in_flight),
+            "total_requests": self.total_requests,
+            "total_batches": self.total_batches,
+            "batch_size_histogram": {str(k): v for k, v in sorted(self.batch_sizes.items())},
+            "queue_wait_ms": {"p50": pct(0.50), "p95": pct(0.95), "p99": pct(0.99)},
+        }
@@ -0,0 +1,476 @@
+"""Load test and benchmark for the API hot paths.
+
+    python benchmark.py                      # in-process app, real model if trained
+    python benchmark.py --mock               # classifier in mock mode
+    python benchmark.py --url http://host:8000 --only predict history --database-url postgresql://...
+                                             # (history is seeded into that server's database)
+    python benchmark.py --save-baseline      # store this run as the baseline
+    python benchmark.py --only embeddings    # k-NN index over --vectors synthetic embeddings
+
+Reports /predict throughput and p50/p95/p99 latency per concurrency level,
+/scans and /stats latency on a synthetic history of --scans rows, and
+per-stage timings (decode, preprocess, forward, postprocess, DB write),
+and optionally embedding-index search latency and recall.
+Results go to --out as JSON. If a baseline exists, every latency/throughput
+metric is compared against it and the exit status is 1 on a regression.
+"""
+import os
+import sys
+import io
+import json
+import time
+import random
+import asyncio
+import argparse
+import platform
+import tempfile
+import contextlib
+from collections import Counter
+from datetime import datetime, timedelta
+
+import numpy as np
+from PIL import Image
+
+BACKEND_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_PATH = os.path.join(BACKEND_DIR, "benchmark_baseline.json")
+DEFAULT_CONCURRENCY = [1, 4, 16, 64]
+PREDICT_MOBILE = "bench-predict"
+HISTORY_MOBILE = "bench-history"
+WRITE_MOBILE = "bench-writes"
+SEED_CHUNK = 50000
+# Metric name suffix -> which direction is better
+METRIC_DIRECTIONS = {"_ms": "lower", "throughput_rps": "higher", "recall_at_10": "higher"}
+
+
+def summarize(samples_ms):
+    if not samples_ms:
+        return {"count": 0}
+    a = np.asarray(samples_ms)
+    return {
+        "count": len(a),
+        "mean_ms": round(float(a.mean()), 3),
+        "p50_ms": round(float(np.percentile(a, 50)), 3),
+        "p95_ms": round(float(np.percentile(a, 95)), 3),
+        "p99_ms": round(float(np.percentile(a, 99)), 3),
+    }
+
+
+def synthetic_photo(width, height, seed=0):
+    # Smooth gradients plus mild noise: compresses and decodes like a real photo, not like static
+    rng = np.random.default_rng(seed)
+    y, x = np.mgrid[0:height, 0:width].astype(np.float32)
+    base = np.stack([x / width, y / height, (x + y) / (width + height)], axis=-1) * 200
+    pixels = np.clip(base + rng.normal(0, 12, (height, width, 3)), 0, 255).astype(np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(pixels).save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+
+def unique_upload(photo):
+    # Trailing bytes after the JPEG end marker are ignored by decoders but change the
+    # hash, so every request misses the prediction cache and stores a new blob
+    return photo + os.urandom(16)
+
+
+# --- /predict under load ---
+
+async def run_predict_level(client, photo, concurrency, total):
+    latencies, errors = [], Counter()
+    remaining = total
+
+    async def user():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            files = {"file": ("bench.jpg", unique_upload(photo), "image/jpeg")}
+            started = time.perf_counter()
+            try:
+                r = await client.post("/predict", files=files, data={"mobile": PREDICT_MOBILE})
+                if r.status_code != 200 or not r.json().get("predictions"):
+                    errors[str(r.status_code)] += 1
+                    continue
+            except Exception as e:
+                errors[type(e).__name__] += 1
+                continue
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(user() for _ in range(concurrency)))
+    wall = time.perf_counter() - started
+    result = {"concurrency": concurrency, "requests": total, "errors": dict(errors),
+              "throughput_rps": round(len(latencies) / wall, 2)}
+    result.update(summarize(latencies))
+    return result
+
+
+async def bench_predict(client, photo, levels, requests_per_level):
+    # A few requests first so connection setup and lazy imports aren't measured
+    await run_predict_level(client, photo, 2, 4)
+    results = {}
+    for level in levels:
+        total = max(requests_per_level, level * 4)
+        result = await run_predict_level(client, photo, level, total)
+        try:
+            result["server_batching"] = (await client.get("/batching/stats")).json().get("batch_size_histogram")
+        except Exception:
+            pass
+        results[f"c{level}"] = result
+        print(f"/predict c={level:<3} {result['throughput_rps']:>8.1f} req/s  "
+              f"p50 {result.get('p50_ms', 0):>8.1f} ms  p95 {result.get('p95_ms', 0):>8.1f} ms  "
+              f"p99 {result.get('p99_ms', 0):>8.1f} ms  errors {sum(result['errors'].values())}")
+    return results
+
+
+# --- /scans and /stats on a large history ---
+
+def seed_history(num_scans, breeds):
+    """Inserts num_scans synthetic scans (and their scan_counts) for HISTORY_MOBILE.
+
+    Skipped when the database already holds exactly that many, so repeated
+    runs against the same --workdir don't pay the seeding cost again.
+    """
+    from sqlalchemy import func, delete
+    from database import Base, SessionLocal, engine, Scan, ScanCount, scan_count_keys, scan_count_rows, _stat_upsert
+
+    Base.metadata.create_all(bind=engine)
+    with SessionLocal() as db:
+        existing = db.query(func.count(Scan.id)).filter(Scan.user_mobile == HISTORY_MOBILE).scalar()
+    if existing == num_scans:
+        print(f"History already seeded with {num_scans} scans")
+        return 0.0
+
+    started = time.perf_counter()
+    rng = random.Random(0)
+    now = datetime.utcnow()
+    span = 2 * 365 * 24 * 3600  # two years of history
+    stats = Counter()
+    with engine.begin() as conn:
+        conn.execute(delete(Scan).where(Scan.user_mobile == HISTORY_MOBILE))
+        conn.execute(delete(ScanCount).where(ScanCount.user_mobile == HISTORY_MOBILE))
+    for start in range(0, num_scans, SEED_CHUNK):
+        rows = []
+        for i in range(start, min(start + SEED_CHUNK, num_scans)):
+            ts = now - timedelta(seconds=rng.random() * span)
+            breed = rng.choice(breeds)
+            confidence = f"{rng.random():.2f}"
+            rows.append({"user_mobile": HISTORY_MOBILE, "timestamp": ts, "breed": breed,
+                         "confidence": confidence, "image_url": f"/blobs/{i:064x}.jpg"})
+            stats.update(scan_count_keys(HISTORY_MOBILE, ts, breed, confidence))
+        with engine.begin() as conn:
+            conn.execute(Scan.__table__.insert(), rows)
+        print(f"Seeded {min(start + SEED_CHUNK, num_scans)}/{num_scans} scans", end="\r")
+    with engine.begin() as conn:
+        conn.execute(_stat_upsert(), scan_count_rows(stats))
+    seconds = time.perf_counter() - started
+    print(f"\nSeeded {num_scans} scans in {seconds:.1f}s")
+    return round(seconds, 1)
+
+
+async def timed_get(client, path, repeats, params=None):
+    samples = []
+    response = None
+    for _ in range(repeats):
+        started = time.perf_counter()
+        response = await client.get(path, params=params)
+        samples.append((time.perf_counter() - started) * 1000)
+        response.raise_for_status()
+    return summarize(samples), response
+
+
+async def bench_history(client, breeds, repeats, deep_pages):
+    results = {}
+    scans_path = f"/scans/{HISTORY_MOBILE}"
+    results["scans_first_page"], _ = await timed_get(client, scans_path, repeats)
+    results["scans_breed_filter"], _ = await timed_get(client, scans_path, repeats, {"breed": breeds[0]})
+    results["stats"], _ = await timed_get(client, f"/stats/{HISTORY_MOBILE}", repeats)
+
+    # Follow the cursor deep into the history: every page should cost the same
+    samples, cursor = [], None
+    for _ in range(deep_pages):
+        started = time.perf_counter()
+        r = await client.get(scans_path, params={"cursor": cursor} if cursor else None)
+        samples.append((time.perf_counter() - started) * 1000)
+        r.raise_for_status()
+        cursor = r.headers.get("x-next-cursor")
+        if not cursor:
+            break
+    results["scans_cursor_walk"] = summarize(samples)
+
+    for name, result in results.items():
+        print(f"{name:<20} p50 {result.get('p50_ms', 0):>8.2f} ms  p95 {result.get('p95_ms', 0):>8.2f} ms  "
+              f"p99 {result.get('p99_ms', 0):>8.2f} ms")
+    return results
+
+
+# --- Per-stage timings, measured in-process ---
+
+def time_calls(fn, repeats):
+    samples = []
+    for _ in range(repeats):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    return summarize(samples)
+
+
+async def bench_stages(classifier, photo, repeats, batch_sizes):
+    from breed_classifier import IMG_SIZE
+    from database import Scan, commit_scans
+
+    def decode():
+        img = Image.open(io.BytesIO(photo))
+        img.draft("RGB", IMG_SIZE)
+        img.load()
+        return img
+
+    decoded = np.asarray(decode().convert("RGB"))
+    results = {"decode": time_calls(decode, repeats)}
+    num_classes = max(len(getattr(classifier, "int_to_class", {})), 1)
+
+    for n in batch_sizes:
+        # Resize + normalise into the shared input tensor, from already decoded pixels
+        results[f"preprocess_b{n}"] = time_calls(lambda: classifier.preprocess_batch([decoded] * n), repeats)
+        batch, _ = classifier.preprocess_batch([decoded] * n)
+        if getattr(classifier, "model", None) is not None:
+            classifier.predict_probs(batch)  # warm this batch shape
+            results[f"forward_b{n}"] = time_calls(lambda: classifier.predict_probs(batch), repeats)
+        else:
+            results[f"forward_b{n}"] = None  # mock mode: no forward pass to time
+        probs = np.random.default_rng(n).dirichlet(np.ones(num_classes), size=n).astype(np.float32)
+        results[f"postprocess_b{n}"] = time_calls(lambda: classifier.postprocessor.format(probs), repeats)
+
+        samples = []
+        for _ in range(repeats):
+            rows = [Scan(user_mobile=WRITE_MOBILE, breed="Gir", confidence="0.9", image_url="") for _ in range(n)]
+            started = time.perf_counter()
+            await commit_scans(rows)
+            samples.append((time.perf_counter() - started) * 1000)
+        results[f"db_write_b{n}"] = summarize(samples)
+
+    for name, result in results.items():
+        if result is None:
+            print(f"{name:<20} (mock mode)")
+        else:
+            print(f"{name:<20} p50 {result['p50_ms']:>8.2f} ms  p95 {result['p95_ms']:>8.2f} ms")
+    return results
+
+
+# --- Embedding index, on synthetic vectors ---
+
+def synthetic_embeddings(n, rng, centers, basis):
+    # Clustered points on a low-dimensional subspace, ReLU'd like pooled CNN features
+    latent = centers[rng.integers(0, len(centers), n)] + rng.standard_normal((n, basis.shape[0]), dtype=np.float32)
+    noise = 0.3 * rng.standard_normal((n, basis.shape[1]), dtype=np.float32)
+    return np.maximum(latent @ basis + noise, 0)
+
+
+def bench_embeddings(directory, num_vectors, repeats, k=10):
+    """Fills an EmbeddingIndex with num_vectors synthetic embeddings and times add / search.
+
+    Recall@k is measured against an exact scan. The index in directory is
+    reused when it already holds at least num_vectors rows.
+    """
+    from embedding_index import EmbeddingIndex, EMBEDDING_DIM, _normalize
+
+    rng = np.random.default_rng(0)
+    basis = rng.standard_normal((48, EMBEDDING_DIM), dtype=np.float32)
+    centers = 2 * rng.standard_normal((500, 48), dtype=np.float32)
+    index = EmbeddingIndex(directory)
+    seed_seconds = 0.0
+    if index.count < num_vectors:
+        index.close()
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        index = EmbeddingIndex(directory)
+        started = time.perf_counter()
+        for start in range(0, num_vectors, SEED_CHUNK):
+            for vector in synthetic_embeddings(min(SEED_CHUNK, num_vectors - start), rng, centers, basis):
+                index.link(index.add(vector), index.count)
+        seed_seconds = round(time.perf_counter() - started, 1)
+    while index._training is not None:
+        time.sleep(0.5)
+
+    queries = synthetic_embeddings(repeats, rng, centers, basis)
+    results = {"vectors": index.count, "lists": index.stats()["lists"], "seed_seconds": seed_seconds}
+    samples, recalls = [], []
+    for i, query in enumerate(queries):
+        started = time.perf_counter()
+        found = index.search(query, k)
+        samples.append((time.perf_counter() - started) * 1000)
+        if i < 20:
+            q = _normalize(query)
+            exact = np.concatenate([np.asarray(index.vectors[s:s + SEED_CHUNK], dtype=np.float32) @ q
+                                    for s in range(0, index.count, SEED_CHUNK)])
+            truth = set((np.argpartition(-exact, k)[:k] + 1).tolist())
+            recalls.append(len(truth & {scan_id for scan_id, _ in found}) / k)
+    results["search"] = summarize(samples)
+    results[f"recall_at_{k}"] = round(float(np.mean(recalls)), 4)
+    results["add"] = time_calls(lambda: index.link(index.add(queries[0]), index.count), repeats)
+    index.close()
+
+    print(f"{'search':<20} p50 {results['search']['p50_ms']:>8.2f} ms  p95 {results['search']['p95_ms']:>8.2f} ms  "
+          f"recall@{k} {results[f'recall_at_{k}']:.3f}  ({results['vectors']} vectors, {results['lists']} lists)")
+    print(f"{'add':<20} p50 {results['add']['p50_ms']:>8.2f} ms  p95 {results['add']['p95_ms']:>8.2f} ms")
+    return results
+
+
+# --- Baseline comparison ---
+
+def flatten_metrics(results, prefix=""):
+    metrics = {}
+    for key, value in results.items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict):
+            metrics.update(flatten_metrics(value, path + "."))
+        elif isinstance(value, (int, float)) and any(path.endswith(s) for s in METRIC_DIRECTIONS):
+            metrics[path] = value
+    return metrics
+
+
+def compare(current, baseline, tolerance, min_delta_ms=1.0):
+    """Per-metric change vs. the baseline; a regression is worse by more than tolerance.
+
+    Latencies that moved by less than min_delta_ms never count: sub-millisecond
+    stages are too noisy for a relative threshold alone.
+    """
+    sections = ("predict", "history", "stages", "embeddings")
+    base = flatten_metrics({k: baseline.get(k, {}) for k in sections})
+    rows = []
+    for path, value in flatten_metrics({k: current.get(k, {}) for k in sections}).items():
+        if path not in base or not base[path]:
+            continue
+        direction = next(d for s, d in METRIC_DIRECTIONS.items() if path.endswith(s))
+        change = (value - base[path]) / base[path]
+        worse = change if direction == "lower" else -change
+        noise = path.endswith("_ms") and abs(value - base[path]) < min_delta_ms
+        rows.append({"metric": path, "baseline": base[path], "current": value,
+                     "change": round(change, 4), "regression": worse > tolerance and not noise})
+    return {"tolerance": tolerance, "min_delta_ms": min_delta_ms, "metrics": rows,
+            "regressions": [r["metric"] for r in rows if r["regression"]]}
+
+
+# --- Runner ---
+
+def prepare_workdir(workdir, mock, database_url=None):
+    # The in-process app writes its DB, blobs and OTP store under workdir, never the real ones.
+    # An exported DATABASE_URL is overridden too; only --database-url points elsewhere
+    os.makedirs(workdir, exist_ok=True)
+    os.environ["DATABASE_URL"] = database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}"
+    os.environ["BLOB_DIR"] = os.path.join(workdir, "uploads", "blobs")
+    os.environ["OTP_DB_PATH"] = os.path.join(workdir, "otp.db")
+    os.environ["EMBEDDING_DIR"] = os.path.join(workdir, "embeddings")
+    os.environ["PREDICTION_CACHE_DB"] = ""
+    os.environ["SMS_PROVIDER"] = "stub"
+    if mock:
+        # An empty model directory -> BreedClassifier serves mock predictions
+        os.environ["INFERENCE_BACKEND"] = "keras"
+        os.environ["MODEL_DIR"] = os.path.join(workdir, "mock-model")
+    sys.path.insert(0, BACKEND_DIR)
+    os.chdir(workdir)
+
+
+async def run(args):
+    import httpx
+    import main as api
+
+    classifier = api.model.classifier
+    breeds = list(classifier.int_to_class.values()) or getattr(classifier, "mock_classes", ["Gir"])
+    photo = synthetic_photo(*args.image_size)
+
+    results = {"meta": {
+        "timestamp": datetime.utcnow().isoformat(timespec="seconds"),
+        "target": args.url or "in-process",
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "image_bytes": len(photo),
+        "image_size": args.image_size,
+    }}
+
+    async with contextlib.AsyncExitStack() as stack:
+        # The local app (and its model) is only needed when it is the target or for the stage timings
+        if not args.url or "stages" in args.only:
+            await stack.enter_async_context(api.lifespan(api.app))
+            if not api.model.wait(args.model_timeout):
+                sys.exit(f"Model not ready after {args.model_timeout}s")
+            results["meta"]["model"] = api.model.stats()
+
+        if args.url:
+            client = httpx.AsyncClient(base_url=args.url, timeout=120)
+        else:
+            client = httpx.AsyncClient(transport=httpx.ASGITransport(app=api.app),
+                                       base_url="http://bench", timeout=120)
+        async with client:
+            if "predict" in args.only:
+                results["predict"] = await bench_predict(client, photo, args.concurrency, args.requests)
+            if "history" in args.only:
+                seed_seconds = await asyncio.to_thread(seed_history, args.scans, breeds)
+                results["history"] = await bench_history(client, breeds, args.repeats, args.deep_pages)
+                results["history"]["scans"] = args.scans
+                results["history"]["seed_seconds"] = seed_seconds
+            if "stages" in args.only:
+                results["stages"] = await bench_stages(api.model.classifier, photo, args.repeats, args.batch_sizes)
+    if "embeddings" in args.only:
+        results["embeddings"] = await asyncio.to_thread(
+            bench_embeddings, os.path.join(args.workdir, "embeddings-bench"), args.vectors, args.repeats)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark /predict, /scans, /stats and the inference stages.")
+    parser.add_argument("--url", default=None, help="benchmark a running server instead of the in-process app")
+    parser.add_argument("--mock", action="store_true", help="use the mock classifier even if a model is trained")
+    parser.add_argument("--only", nargs="+", choices=["predict", "history", "stages", "embeddings"],
+                        default=["predict", "history", "stages"])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=DEFAULT_CONCURRENCY)
+    parser.add_argument("--requests", type=int, default=200, help="/predict requests per concurrency level")
+    parser.add_argument("--image-size", type=int, nargs=2, default=[1280, 960], metavar=("W", "H"))
+    parser.add_argument("--scans", type=int, default=1_000_000, help="synthetic history size")
+    parser.add_argument("--repeats", type=int, default=50, help="samples per history query / stage")
+    parser.add_argument("--deep-pages", type=int, default=200, help="/scans pages to walk by cursor")
+    parser.add_argument("--vectors", type=int, default=1_000_000, help="synthetic embeddings for --only embeddings")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--model-timeout", type=float, default=300)
+    parser.add_argument("--database-url", default=None,
+                        help="seed/write benchmark rows into this database instead of one under --workdir "
+                             "(needed for history against --url)")
+    parser.add_argument("--workdir", default=os.path.join(tempfile.gettempdir(), "cattlesense-bench"),
+                        help="DB, blobs and seeded history for the in-process app (reused between runs)")
+    parser.add_argument("--out", default="benchmark_results.json")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="compare against this results file if it exists")
+    parser.add_argument("--save-baseline", action="store_true", help="write this run to --baseline")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed slowdown before a metric regresses")
+    parser.add_argument("--min-delta-ms", type=float, default=1.0, help="ignore latency changes smaller than this")
+    args = parser.parse_args()
+    if args.url and "history" in args.only and not args.database_url:
+        parser.error("history against --url seeds that server's database: pass it as --database-url")
+
+    args.out = os.path.abspath(args.out)
+    args.baseline = os.path.abspath(args.baseline)
+    args.workdir = os.path.abspath(args.workdir)
+    prepare_workdir(args.workdir, args.mock, args.database_url)
+    results = asyncio.run(run(args))
+
+    exit_code = 0
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline written to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            results["comparison"] = compare(results, json.load(f), args.tolerance, args.min_delta_ms)
+        for row in results["comparison"]["metrics"]:
+            flag = "REGRESSION" if row["regression"] else ""
+            print(f"{row['metric']:<45} {row['baseline']:>10} -> {row['current']:>10} ({row['change']:+.1%}) {flag}")
+        if results["comparison"]["regressions"]:
+            print(f"{len(results['comparison']['regressions'])} metrics regressed by more than {args.tolerance:.0%}")
+            exit_code = 1
+
+    with open(args.out, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {args.out}")
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,372 @@
+import os
+import sys
+import json
+import time
+import threading
+from array import array
+from collections import OrderedDict
+
+import numpy as np
+
+from observability import get_logger
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'ml_pipeline', 'src', 'models')))
+from inference_backends import EMBEDDING_DIM
+
+log = get_logger("embeddings")
+
+# One index per model version under EMBEDDING_DIR/<version>/ (empty = off)
+EMBEDDING_DIR = os.environ.get("EMBEDDING_DIR", "embeddings")
+# Below ANN_TRAIN_SIZE vectors every query is an exact scan
+ANN_TRAIN_SIZE = int(os.environ.get("ANN_TRAIN_SIZE", "4096"))
+ANN_NPROBE = int(os.environ.get("ANN_NPROBE", "16"))  # inverted lists scanned per query
+ANN_RERANK = int(os.environ.get("ANN_RERANK", "64"))  # candidates re-scored on the full vectors
+ANN_DIM = 64  # PCA dimensions the lists are built and scanned in
+ANN_MAX_LISTS = 1024
+ANN_RETRAIN_GROWTH = 4  # re-cluster once the index has grown this many times since the last clustering
+KMEANS_ITERATIONS = 10
+KMEANS_SAMPLE_PER_LIST = 32
+PCA_SAMPLE = 16384
+# Cosine similarity from which a scan counts as the same animal / photo
+DUPLICATE_SIMILARITY = float(os.environ.get("DUPLICATE_SIMILARITY", "0.95"))
+INITIAL_CAPACITY = 4096
+CHUNK_ROWS = 16384  # float16 rows converted to float32 at a time
+DIGEST_CACHE_SIZE = 10000
+META_SAVE_EVERY = 100
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def _project(vectors, mean, projection):
+    # PCA coordinates of float16 rows, chunked to bound the float32 copy
+    out = np.empty((len(vectors), projection.shape[1]), dtype=np.float32)
+    for start in range(0, len(vectors), CHUNK_ROWS):
+        chunk = np.asarray(vectors[start:start + CHUNK_ROWS], dtype=np.float32)
+        out[start:start + len(chunk)] = (chunk - mean) @ projection
+    return out
+
+
+def _nearest(x, centroids):
+    # Index of the closest (L2) centroid for each row of x
+    half_norms = 0.5 * (centroids ** 2).sum(axis=1)
+    out = np.empty(len(x), dtype=np.int32)
+    for start in range(0, len(x), CHUNK_ROWS):
+        out[start:start + CHUNK_ROWS] = np.argmax(x[start:start + CHUNK_ROWS] @ centroids.T - half_norms, axis=1)
+    return out
+
+
+def fit_pca(sample, dims=ANN_DIM):
+    """(mean, (dim, dims) projection) onto the top principal components of sample."""
+    mean = sample.mean(axis=0)
+    centered = sample - mean
+    _, eigenvectors = np.linalg.eigh(centered.T @ centered)
+    return mean, np.ascontiguousarray(eigenvectors[:, ::-1][:, :dims], dtype=np.float32)
+
+
+def kmeans(sample, num_lists, iterations=KMEANS_ITERATIONS, seed=0):
+    rng = np.random.default_rng(seed)
+    centroids = sample[rng.choice(len(sample), num_lists, replace=False)].copy()
+    for _ in range(iterations):
+        labels = _nearest(sample, centroids)
+        order = np.argsort(labels, kind="stable")
+        lists, starts, counts = np.unique(labels[order], return_index=True, return_counts=True)
+        centroids[lists] = np.add.reduceat(sample[order], starts, axis=0) / counts[:, None]
+        # An empty list restarts from a random sample rather than staying dead
+        empty = np.setdiff1d(np.arange(num_lists), lists)
+        centroids[empty] = sample[rng.choice(len(sample), len(empty))]
+    return centroids
+
+
+def _build_lists(assignments, num_lists):
+    # Inverted lists (rows per centroid) from the per-row assignments
+    order = np.argsort(assignments, kind="stable").astype(np.int64)
+    bounds = np.searchsorted(assignments[order], np.arange(num_lists + 1))
+    return [array("q", order[bounds[i]:bounds[i + 1]].tobytes()) for i in range(num_lists)]
+
+
+class EmbeddingIndex:
+    """Scan embeddings in memory-mapped files, with an incremental IVF index over them.
+
+    Row i of vectors.f16 is one scan's L2-normalised embedding in float16
+    (Scan.embedding_row), and scan_ids.i64 maps it back to the scan. Until
+    train_size vectors exist a query compares against all of them. After that
+    the vectors are reduced to ANN_DIM PCA dimensions (reduced.f32) and
+    clustered with k-means; each new vector joins its nearest list as it
+    arrives. A query scans the nprobe closest lists in the reduced space and
+    re-scores the best ANN_RERANK of those on the full vectors. Re-clustering
+    runs on a background thread as the index grows, and queries keep using
+    the old lists until it finishes.
+    """
+
+    def __init__(self, directory, dim=EMBEDDING_DIM, train_size=ANN_TRAIN_SIZE, nprobe=ANN_NPROBE,
+                 rerank=ANN_RERANK):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.dim = dim
+        self.train_size = train_size
+        self.nprobe = nprobe
+        self.rerank = rerank
+        self._lock = threading.Lock()
+        self._meta_path = os.path.join(directory, "meta.json")
+        self._ann_path = os.path.join(directory, "ann.npz")
+
+        meta = {"count": 0, "trained_count": 0}
+        if os.path.exists(self._meta_path):
+            with open(self._meta_path) as f:
+                meta.update(json.load(f))
+        self.count = meta["count"]
+        self.trained_count = meta["trained_count"]
+        vectors_path = os.path.join(directory, "vectors.f16")
+        existing = os.path.getsize(vectors_path) // (dim * 2) if os.path.exists(vectors_path) else 0
+        self._map(max(INITIAL_CAPACITY, existing))
+        # Rows linked to a scan after the last meta.json save still count
+        while self.count < self.capacity and self.scan_ids[self.count] != 0:
+            self.count += 1
+
+        # (mean, projection, centroids) once clustered
+        self._ann = None
+        self._lists = None
+        if os.path.exists(self._ann_path):
+            with np.load(self._ann_path) as ann:
+                self._ann = (ann["mean"], ann["projection"], ann["centroids"])
+            self._lists = _build_lists(self.assignments[:self.count], len(self._ann[2]))
+        self._digests = OrderedDict()
+        self._training = None
+        self._unsaved = 0
+
+        # Metrics
+        self.searches = 0
+        self.search_seconds = 0.0
+
+    def _open(self, name, dtype, shape):
+        path = os.path.join(self.directory, name)
+        size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        with open(path, "ab") as f:
+            if f.tell() < size:
+                f.truncate(size)
+        return np.memmap(path, dtype=dtype, mode="r+", shape=shape)
+
+    def _map(self, capacity):
+        # (Re)opens the row-aligned files at capacity rows; growing only extends them
+        self.capacity = capacity
+        self.vectors = self._open("vectors.f16", np.float16, (capacity, self.dim))
+        self.scan_ids = self._open("scan_ids.i64", np.int64, (capacity,))  # 0 = not committed
+        self.reduced = self._open("reduced.f32", np.float32, (capacity, ANN_DIM))
+        self.assignments = self._open("lists.i32", np.int32, (capacity,))
+
+    def add(self, vector, digest=None):
+        """Stores one embedding and returns its row; link() it to the scan once committed."""
+        vector = _normalize(vector).reshape(-1)
+        with self._lock:
+            row = self.count
+            if row >= self.capacity:
+                for mapped in (self.vectors, self.scan_ids, self.reduced, self.assignments):
+                    mapped.flush()
+                self._map(self.capacity * 2)
+            self.vectors[row] = vector
+            if self._ann is not None:
+                mean, projection, centroids = self._ann
+                reduced = (vector - mean) @ projection
+                nearest = int(np.argmin(((centroids - reduced) ** 2).sum(axis=1)))
+                self.reduced[row] = reduced
+                self.assignments[row] = nearest
+                self._lists[nearest].append(row)
+            self.count += 1
+            if digest is not None:
+                self._digests[digest] = row
+                while len(self._digests) > DIGEST_CACHE_SIZE:
+                    self._digests.popitem(last=False)
+            self._unsaved += 1
+            if self._unsaved >= META_SAVE_EVERY:
+                self._save_meta()
+            if self._training is None and self._needs_training():
+                self._training = threading.Thread(target=self._train, name="embedding-kmeans", daemon=True)
+                self._training.start()
+        return row
+
+    def link(self, row, scan_id):
+        self.scan_ids[row] = scan_id
+
+    def vector(self, row):
+        return np.asarray(self.vectors[row], dtype=np.float32)
+
+    def row_for_digest(self, digest):
+        # Recent uploads only: a prediction-cache hit never reaches the model, so
+        # the repeat upload reuses the embedding of the one that filled the cache
+        with self._lock:
+            return self._digests.get(digest)
+
+    def search(self, vector, k=10, exclude_scan=None, rows=None):
+        """[(scan_id, cosine similarity)] of the k nearest committed scans, best first.
+
+        rows restricts the search to those rows (e.g. one user's scans). Up to
+        train_size of them are compared exactly; a larger set is intersected
+        with the probed lists before re-ranking (probing more lists until k of
+        them are found), so every candidate that gets re-scored is one the
+        caller can use.
+        """
+        started = time.perf_counter()
+        query = _normalize(vector).reshape(-1)
+        with self._lock:
+            count, vectors, reduced, ann = self.count, self.vectors, self.reduced, self._ann
+            if rows is not None:
+                rows = np.unique(np.asarray(rows, dtype=np.int64))
+                rows = rows[(rows >= 0) & (rows < count)]
+                if len(rows) <= self.train_size:
+                    ann = None
+            if ann is not None:
+                mean, projection, centroids = ann
+                query_reduced = (query - mean) @ projection
+                distances = ((centroids - query_reduced) ** 2).sum(axis=1)
+                order = np.argsort(distances)
+                nprobe = self.nprobe
+                while True:
+                    probed = np.sort(np.concatenate([np.frombuffer(self._lists[c], dtype=np.int64)
+                                                     for c in order[:nprobe]]))
+                    if rows is None:
+                        break
+                    # Keep widening the probe until enough of the allowed rows turn up
+                    probed = np.intersect1d(probed, rows, assume_unique=True)
+                    if len(probed) >= min(k, len(rows)) or nprobe >= len(order):
+                        break
+                    nprobe *= 2
+                rows = probed
+
+        if ann is None and rows is None:
+            # Exact: every row, a chunk at a time
+            rows = np.arange(count)
+            scores = np.empty(count, dtype=np.float32)
+            for start in range(0, count, CHUNK_ROWS):
+                end = min(start + CHUNK_ROWS, count)
+                scores[start:end] = np.asarray(vectors[start:end], dtype=np.float32) @ query
+        elif ann is None:
+            # Exact over the given rows
+            scores = np.empty(len(rows), dtype=np.float32)
+            for start in range(0, len(rows), CHUNK_ROWS):
+                chunk = rows[start:start + CHUNK_ROWS]
+                scores[start:start + len(chunk)] = np.asarray(vectors[chunk], dtype=np.float32) @ query
+        else:
+            if len(rows) > self.rerank:
+                distances = ((np.asarray(reduced[rows]) - query_reduced) ** 2).sum(axis=1)
+                rows = np.sort(rows[np.argpartition(distances, self.rerank - 1)[:self.rerank]])
+            scores = np.asarray(vectors[rows], dtype=np.float32) @ query
+
+        # A few extra candidates for uncommitted rows and the excluded scan
+        wanted = min(len(rows), k + 8)
+        best = np.argpartition(-scores, wanted - 1)[:wanted] if wanted else []
+        results = []
+        for i in sorted(best, key=lambda i: -scores[i]):
+            scan_id = int(self.scan_ids[rows[i]])
+            if scan_id != 0 and scan_id != exclude_scan:
+                results.append((scan_id, float(scores[i])))
+        self.searches += 1
+        self.search_seconds += time.perf_counter() - started
+        return results[:k]
+
+    def _needs_training(self):
+        if self.trained_count == 0:
+            return self.count >= self.train_size
+        return self.count >= self.trained_count * ANN_RETRAIN_GROWTH
+
+    def _train(self):
+        try:
+            started = time.perf_counter()
+            count, vectors = self.count, self.vectors
+            num_lists = min(ANN_MAX_LISTS, max(16, int(4 * np.sqrt(count))))
+            rng = np.random.default_rng(count)
+            sample_size = min(count, max(PCA_SAMPLE, num_lists * KMEANS_SAMPLE_PER_LIST))
+            sample = vectors[np.sort(rng.choice(count, sample_size, replace=False))]
+            mean, projection = fit_pca(np.asarray(sample[:PCA_SAMPLE], dtype=np.float32))
+            centroids = kmeans(_project(sample, mean, projection), num_lists, seed=count)
+
+            # Re-project everything into a new file; queries use the old one meanwhile
+            reduced = self._open("reduced.f32.new", np.float32, (self.capacity, ANN_DIM))
+            reduced[:count] = _project(vectors[:count], mean, projection)
+            assignments = _nearest(reduced[:count], centroids)
+            with self._lock:
+                if self.capacity > len(reduced):
+                    reduced = self._open("reduced.f32.new", np.float32, (self.capacity, ANN_DIM))
+                # Rows added while clustering
+                tail = slice(count, self.count)
+                reduced[tail] = _project(self.vectors[tail], mean, projection)
+                self.assignments[:count] = assignments
+                self.assignments[tail] = _nearest(reduced[tail], centroids)
+                reduced.flush()
+                self.assignments.flush()
+                os.replace(os.path.join(self.directory, "reduced.f32.new"), os.path.join(self.directory, "reduced.f32"))
+                self.reduced = reduced
+                self._lists = _build_lists(self.assignments[:self.count], num_lists)
+                self._ann = (mean, projection, centroids)
+                self.trained_count = self.count
+                tmp_path = self._ann_path + ".tmp.npz"
+                np.savez(tmp_path, mean=mean, projection=projection, centroids=centroids)
+                os.replace(tmp_path, self._ann_path)
+                self._save_meta()
+            log.info("Embedding index clustered", extra={
+                "directory": self.directory, "vectors": count, "lists": num_lists,
+                "seconds": round(time.perf_counter() - started, 1),
+            })
+        except Exception:
+            log.exception("Embedding index clustering failed", extra={"directory": self.directory})
+        finally:
+            self._training = None
+
+    def _save_meta(self):
+        tmp_path = f"{self._meta_path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"count": self.count, "trained_count": self.trained_count, "dim": self.dim}, f)
+        os.replace(tmp_path, self._meta_path)
+        self._unsaved = 0
+
+    def close(self):
+        with self._lock:
+            for mapped in (self.vectors, self.scan_ids, self.reduced, self.assignments):
+                mapped.flush()
+            self._save_meta()
+
+    def stats(self):
+        return {
+            "vectors": self.count,
+            "capacity": self.capacity,
+            "lists": len(self._ann[2]) if self._ann is not None else 0,
+            "clustered_at": self.trained_count,
+            "clustering": self._training is not None,
+            "searches": self.searches,
+            "avg_search_ms": round(self.search_seconds / self.searches * 1000, 2) if self.searches else None,
+            "disk_mb": round(self.capacity * (self.dim * 2 + ANN_DIM * 4 + 12) / 1e6, 1),
+        }
+
+
+class EmbeddingIndexes:
+    """One EmbeddingIndex per model version: embeddings from different models aren't comparable."""
+
+    def __init__(self, root=EMBEDDING_DIR):
+        self.root = root
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.root)
+
+    def get(self, version):
+        # None when disabled
+        if not self.enabled or not version:
+            return None
+        with self._lock:
+            index = self._indexes.get(version)
+            if index is None:
+                index = EmbeddingIndex(os.path.join(self.root, os.path.basename(version)))
+                self._indexes[version] = index
+            return index
+
+    def close(self):
+        for index in list(self._indexes.values()):
+            index.close()
+
+    def stats(self):
+        return {"enabled": self.enabled, "versions": {v: index.stats() for v, index in self._indexes.items()}}
@@ -1,27 +1,110 @@
-from fastapi import FastAPI, UploadFile, File, Form
-from fastapi.staticfiles import StaticFiles
+from fastapi import FastAPI, UploadFile, File, Form, Response
+from fastapi.responses import JSONResponse, FileResponse
+from fastapi import Request
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel
-from typing import List
-import sys
+from typing import List, Optional
+from contextlib import asynccontextmanager
+import asyncio
+import base64
+import mimetypes
+import time
 import os
 
-# Add ml_pipeline to path
-sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'ml_pipeline', 'src', 'models')))
-
-# Try importing, mock if fails (for dev robustness)
-try:
-    from breed_classifier import BreedClassifier
-except ImportError:
-    class BreedClassifier:
-        def predict(self, _): return [{"breed": "Mock", "confidence": 1.0}]
-
-app = FastAPI()
-
-# Mount static files for images
-os.makedirs("uploads", exist_ok=True)
-app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
-
-classifier = BreedClassifier()
+from observability import (
+    setup_logging, get_logger, log_sampled, metrics_response_body, SlowRequestProfiler, ClassifierMetrics,
+    REQUEST_SECONDS, SLOW_REQUESTS,
+)
+from batching import MicroBatcher
+from uploads import store_upload, read_upload, UploadWriter, MAX_UPLOAD_BYTES, MULTIPART_OVERHEAD
+from storage import blob_store, blob_key, blob_url, is_valid_key
+from prediction_cache import PredictionCache, image_digest
+from model_loader import ModelLoader
+from embedding_index import EmbeddingIndexes, DUPLICATE_SIMILARITY
+from otp import get_otp_store, RateLimited
+from sms import SMSQueue
+from thumbnails import (
+    ThumbnailWorker, generate_thumbnails, thumbnail_urls, thumbnail_path, source_name, UPLOADS_DIR,
+    THUMBNAIL_MAX_AGE,
+)
+
+@asynccontextmanager
+async def lifespan(app):
+    # Only cheap work here so auth/profile/scans are up right away;
+    # the model loads and warms up on a background thread
+    Base.metadata.create_all(bind=engine)
+    migrate_db()
+    model.start()
+    batcher.start()
+    scan_writer.start()
+    thumbnail_worker.start()
+    upload_writer.start()
+    sms_queue.start()
+    yield
+    await sms_queue.stop()
+    await batcher.stop()
+    await scan_writer.stop()
+    upload_writer.stop()  # before the thumbnail worker: it queues thumbnails
+    thumbnail_worker.stop()
+    model.stop()
+    embedding_indexes.close()
+    await async_engine.dispose()
+
+app = FastAPI(lifespan=lifespan)
+
+setup_logging()
+log = get_logger("api")
+slow_profiler = SlowRequestProfiler()
+
+@app.middleware("http")
+async def instrument_requests(request, call_next):
+    # Latency histogram per route template (not per raw path, which would explode the labels)
+    profiler = slow_profiler.start()
+    started = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        return response
+    finally:
+        seconds = time.perf_counter() - started
+        route = request.scope.get("route")
+        route = route.path if route is not None else "unmatched"
+        REQUEST_SECONDS.labels(request.method, route, str(status)).observe(seconds)
+        if slow_profiler.enabled and seconds >= slow_profiler.threshold:
+            SLOW_REQUESTS.labels(route).inc()
+        if profiler is not None:
+            slow_profiler.finish(profiler, seconds, route)
+
+@app.middleware("http")
+async def reject_oversized_uploads(request, call_next):
+    # Refuse by Content-Length before the multipart body is read at all;
+    # store_upload() still enforces the per-file limit for chunked requests
+    limit = UPLOAD_BODY_LIMITS.get(request.url.path)
+    length = request.headers.get("content-length")
+    if limit is not None and length and length.isdigit() and int(length) > limit:
+        return JSONResponse({"detail": "Upload too large"}, status_code=413)
+    return await call_next(request)
+
+os.makedirs(UPLOADS_DIR, exist_ok=True)
+
+model = ModelLoader(metrics=ClassifierMetrics())
+# Concurrent /predict calls share one forward pass (see batching.py for tunables)
+batcher = MicroBatcher(model.predict_batch, concurrency=model.concurrency)
+
+# Retried uploads of the same photo skip inference entirely
+prediction_cache = PredictionCache(model.model_files)
+inflight_predictions = {}
+
+# Scan embeddings for "similar past scans" and repeat-scan detection
+embedding_indexes = EmbeddingIndexes()
+SIMILAR_MAX_K = 50
+
+# History screens fetch small derivatives instead of the full-resolution uploads
+thumbnail_worker = ThumbnailWorker()
+# /predict classifies from memory (up to UPLOAD_MEMORY_MB); the original reaches the
+# blob store from this thread
+upload_writer = UploadWriter(on_stored=thumbnail_worker.submit)
 
 class Prediction(BaseModel):
     breed: str
@@ -29,61 +112,41 @@ class Prediction(BaseModel):
 
 class PredictionResponse(BaseModel):
     predictions: List[Prediction]
-
-# --- Database Setup (SQLite + SQLAlchemy) ---
-from sqlalchemy import create_engine, Column, Integer, String, DateTime, ForeignKey, func
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker, Session
+    model_version: Optional[str] = None
+    scan_id: Optional[int] = None
+    # With check_duplicate: an earlier scan by the same user that looks like the same photo/animal
+    duplicate_of: Optional[int] = None
+
+class BatchItemResult(BaseModel):
+    index: int
+    filename: Optional[str] = None
+    predictions: List[Prediction]
+    model_version: Optional[str] = None
+    scan_id: Optional[int] = None
+    error: Optional[str] = None
+
+class BatchPredictionResponse(BaseModel):
+    results: List[BatchItemResult]
+
+PREDICT_BATCH_MAX_FILES = int(os.environ.get("PREDICT_BATCH_MAX_FILES", "100"))
+UPLOAD_BODY_LIMITS = {
+    "/predict": MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD,
+    "/profile/upload": MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD,
+    "/predict/batch": PREDICT_BATCH_MAX_FILES * (MAX_UPLOAD_BYTES + MULTIPART_OVERHEAD),
+}
+
+from sqlalchemy import select, tuple_
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import Depends, HTTPException, Form
 from datetime import datetime
 
-SQLALCHEMY_DATABASE_URL = "sqlite:///./cattle_sense.db"
-
-engine = create_engine(SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
-
-class User(Base):
-    __tablename__ = "users"
-    id = Column(Integer, primary_key=True, index=True)
-    mobile = Column(String, unique=True, index=True)
-    full_name = Column(String, default="Cattle Officer")
-    email = Column(String, default="")
-    location = Column(String, default="")
-    role = Column(String, default="Veterinarian")
-    profile_picture = Column(String, default="") # New column
-
-class Scan(Base):
-    __tablename__ = "scans"
-    id = Column(Integer, primary_key=True, index=True)
-    user_mobile = Column(String, index=True)
-    timestamp = Column(DateTime, default=datetime.utcnow)
-    breed = Column(String, default="Unknown")
-    confidence = Column(String, default="0.0")
-    image_url = Column(String, default="")
-
-Base.metadata.create_all(bind=engine)
-
-# --- Migration Helper (Safe for Dev) ---
-def migrate_db():
-    from sqlalchemy import text
-    with engine.connect() as conn:
-        try:
-            conn.execute(text("ALTER TABLE users ADD COLUMN profile_picture VARCHAR DEFAULT ''"))
-            print("Migrated DB: Added profile_picture column")
-        except Exception as e:
-            # Column likely exists
-            pass
-
-migrate_db()
+from database import (
+    Base, engine, async_engine, AsyncSessionLocal, User, Scan, ScanCount, migrate_db, get_db, get_async_db,
+    commit_scans, SCAN_WRITE_BATCH, SCAN_WRITE_WAIT_MS,
+)
 
-# Dependency
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+scan_writer = MicroBatcher(commit_scans, max_batch_size=SCAN_WRITE_BATCH, max_wait_ms=SCAN_WRITE_WAIT_MS)
 
 # --- Auth Models ---
 class LoginRequest(BaseModel):
@@ -105,93 +168,57 @@ class AuthResponse(BaseModel):
     token: str = None
     user: dict = None
 
-# Mock DB for OTPs
-otp_store = {}
-
-# --- Twilio Setup ---
-try:
-    from twilio.rest import Client
-except ImportError:
-    Client = None
-
-# Twilio credentials - Set these as environment variables before running
-# Example: set TWILIO_ACCOUNT_SID=your_sid
-TWILIO_ACCOUNT_SID = os.environ.get("TWILIO_ACCOUNT_SID", "") 
-TWILIO_AUTH_TOKEN = os.environ.get("TWILIO_AUTH_TOKEN", "") 
-TWILIO_PHONE_NUMBER = os.environ.get("TWILIO_PHONE_NUMBER", "") 
-
-def send_sms(to_number: str, otp: str):
-    if not Client or not TWILIO_ACCOUNT_SID or not TWILIO_AUTH_TOKEN:
-        print("Twilio not configured. Skipping SMS.")
-        return False
-    
-    try:
-        client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-        message = client.messages.create(
-            body=f"Your Cattle Sense OTP is: {otp}",
-            from_=TWILIO_PHONE_NUMBER,
-            to=to_number
-        )
-        print(f"SMS sent: {message.sid}")
-        return True
-    except Exception as e:
-        print(f"Failed to send SMS: {e}")
-        return False
+# OTPs live in a shared TTL store so any worker process can verify them
+otp_store = get_otp_store()
+# SMS go out in the background, login never waits on the gateway
+sms_queue = SMSQueue()
 
 @app.post("/auth/login", response_model=AuthResponse)
-def login(request: LoginRequest, db: Session = Depends(get_db)):
-    print(f"Login request for: {request.mobile}")
-    
-    # Generate random 4-digit OTP
-    import random
-    mock_otp = str(random.randint(1000, 9999))
-    # mock_otp = "1234"
-    
-    otp_store[request.mobile] = mock_otp
-    print(f"Generated OTP for {request.mobile}: {mock_otp}")
-    
+async def login(request: LoginRequest, db: AsyncSession = Depends(get_async_db)):
+    log_sampled(log, "login", mobile=request.mobile)
+
+    try:
+        otp = await run_in_threadpool(otp_store.issue, request.mobile)
+    except RateLimited as e:
+        raise HTTPException(status_code=429, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
     # Check if user exists, if not create placeholder
-    user = db.query(User).filter(User.mobile == request.mobile).first()
+    user = (await db.execute(select(User).where(User.mobile == request.mobile))).scalars().first()
     if not user:
-        new_user = User(mobile=request.mobile)
-        db.add(new_user)
-        db.commit()
-        db.refresh(new_user)
-        print(f"Created new user for mobile: {request.mobile}")
-    
-    # Attempt to send Real SMS
+        db.add(User(mobile=request.mobile))
+        await db.commit()
+        log.info("Created user", extra={"mobile": request.mobile})
+
     # Format number to E.164 if needed (assuming input is 10 digits IN)
     ph = request.mobile
     if not ph.startswith("+"):
         ph = "+91" + ph # Default to India for this project
-        
-    sms_sent = send_sms(ph, mock_otp)
-    # sms_sent = False # Disabled to save credits
-    
-    msg = "OTP sent successfully"
-    if not sms_sent:
-        msg += " (Failed to send SMS, check console)"
-        print(f"DEBUG: OTP was {mock_otp}") # Fallback for dev if SMS fails
-        
-    return {"success": True, "message": msg}
+
+    if not sms_queue.submit(ph, f"Your Cattle Sense OTP is: {otp}"):
+        log.warning("SMS queue full, OTP not sent", extra={"mobile": request.mobile})
+        return {"success": False, "message": "Could not send OTP right now, please try again."}
+    return {"success": True, "message": "OTP sent successfully"}
 
 @app.post("/auth/verify", response_model=AuthResponse)
-def verify(request: VerifyRequest):
-    print(f"Verify request for: {request.mobile} with OTP: {request.otp}")
-    stored_otp = otp_store.get(request.mobile)
-    
-    if stored_otp and stored_otp == request.otp:
+async def verify(request: VerifyRequest):
+    ok = await run_in_threadpool(otp_store.verify, request.mobile, request.otp)
+    log_sampled(log, "verify", mobile=request.mobile, success=ok)
+    if ok:
         # OTP matches
         return {"success": True, "message": "Login successful", "token": "mock-jwt-token-123"}
-    
+
     return {"success": False, "message": "Invalid OTP. Please try again."}
 
+@app.get("/auth/sms/stats")
+def sms_stats():
+    return sms_queue.stats()
+
 @app.get("/profile/{mobile}")
 def get_profile(mobile: str, db: Session = Depends(get_db)):
     user = db.query(User).filter(User.mobile == mobile).first()
     if not user:
         # Auto-create user for dev/demo purposes if not found
-        print(f"User {mobile} not found, auto-creating...")
+        log.info("User not found, auto-creating", extra={"mobile": mobile})
         user = User(mobile=mobile)
         db.add(user)
         db.commit()
@@ -203,7 +230,8 @@ def get_profile(mobile: str, db: Session = Depends(get_db)):
         "email": user.email,
         "location": user.location,
         "role": user.role,
-        "profile_picture": user.profile_picture if user.profile_picture else ""
+        "profile_picture": user.profile_picture if user.profile_picture else "",
+        "profile_thumbnails": thumbnail_urls(user.profile_picture),
     }
 
 @app.put("/profile/{mobile}")
@@ -225,69 +253,172 @@ def update_profile(mobile: str, profile: ProfileUpdate, db: Session = Depends(ge
 async def upload_profile_picture(
     file: UploadFile = File(...),
     mobile: str = Form(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    print(f"Uploading profile pic for {mobile}")
-    
-    user = db.query(User).filter(User.mobile == mobile).first()
+    log_sampled(log, "profile_upload", mobile=mobile)
+
+    user = (await db.execute(select(User).where(User.mobile == mobile))).scalars().first()
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    uploads_dir = "uploads"
-    os.makedirs(uploads_dir, exist_ok=True)
-    
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"pfp_{mobile}_{timestamp}_{file.filename}"
-    file_path = os.path.join(uploads_dir, filename)
-    
     try:
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
-            
+        key, _, local_path = await store_upload(file)
+        thumbnail_worker.submit(local_path, key)
+
         # Update DB
-        image_url_db = f"/uploads/{filename}"
+        image_url_db = blob_url(key)
         user.profile_picture = image_url_db
-        db.commit()
-        db.refresh(user)
+        await db.commit()
         
-        return {"success": True, "profile_picture": image_url_db}
+        return {"success": True, "profile_picture": image_url_db, "profile_thumbnails": thumbnail_urls(image_url_db)}
+    except HTTPException:
+        raise
     except Exception as e:
-        print(f"Profile upload failed: {e}")
+        log.exception("Profile upload failed", extra={"mobile": mobile})
         raise HTTPException(status_code=500, detail="Upload failed")
 
 @app.get("/stats/{mobile}")
 def get_stats(mobile: str, db: Session = Depends(get_db)):
-    # Total Scans
-    total_scans = db.query(Scan).filter(Scan.user_mobile == mobile).count()
-    
-    # This Month Scans
-    now = datetime.utcnow()
-    this_month_scans = db.query(Scan).filter(
-        Scan.user_mobile == mobile,
-        func.strftime('%Y-%m', Scan.timestamp) == now.strftime('%Y-%m')
-    ).count()
-    
+    # Served from the scan_counts counters: one total, one row per breed and
+    # confidence bucket, and only the current month's row
+    current_month = datetime.utcnow().strftime('%Y-%m')
+    rows = db.execute(
+        select(ScanCount.kind, ScanCount.key, ScanCount.count)
+        .where(ScanCount.user_mobile == mobile)
+        .where((ScanCount.kind != "month") | (ScanCount.key == current_month))
+    ).all()
+
+    total_scans = 0
+    this_month_scans = 0
+    by_breed = {}
+    confidence = [0] * 10
+    for row in rows:
+        if row.kind == "total":
+            total_scans = row.count
+        elif row.kind == "month":
+            this_month_scans = row.count
+        elif row.kind == "breed":
+            by_breed[row.key] = row.count
+        elif row.kind == "confidence":
+            confidence[int(row.key)] = row.count
+
     return {
         "total_scans": total_scans,
-        "this_month": this_month_scans
+        "this_month": this_month_scans,
+        "by_breed": dict(sorted(by_breed.items(), key=lambda kv: -kv[1])),
+        "confidence_distribution": {f"{i / 10:.1f}-{(i + 1) / 10:.1f}": n for i, n in enumerate(confidence)},
     }
 
+SCANS_PAGE_SIZE = 50
+SCANS_MAX_PAGE_SIZE = 200
+
+def encode_scan_cursor(timestamp, scan_id):
+    raw = f"{timestamp.isoformat()}|{scan_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_scan_cursor(cursor):
+    try:
+        ts, scan_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(ts), int(scan_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 @app.get("/scans/{mobile}")
-def get_scans(mobile: str, db: Session = Depends(get_db)):
-    scans = db.query(Scan).filter(Scan.user_mobile == mobile).order_by(Scan.timestamp.desc()).all()
-    
-    results = []
-    for scan in scans:
-        results.append({
-            "id": scan.id,
-            "breed": scan.breed,
-            "confidence": float(scan.confidence),
-            "date": scan.timestamp.strftime("%Y-%m-%d %H:%M"),
-            "location": "India", # Placeholder
-            "image": scan.image_url if scan.image_url else "https://via.placeholder.com/150"
-        })
-    return results
+def get_scans(
+    mobile: str,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = SCANS_PAGE_SIZE,
+    breed: Optional[str] = None,
+    date_from: Optional[datetime] = None,
+    date_to: Optional[datetime] = None,
+    db: Session = Depends(get_db)
+):
+    # Keyset pagination on (timestamp, id) DESC - every page is an index range
+    # scan, however long the history. The body stays a plain list; the next
+    # page's cursor is returned in the X-Next-Cursor header.
+    limit = max(1, min(limit, SCANS_MAX_PAGE_SIZE))
+    query = (
+        select(Scan.id, Scan.breed, Scan.confidence, Scan.timestamp, Scan.image_url)
+        .where(Scan.user_mobile == mobile)
+        .order_by(Scan.timestamp.desc(), Scan.id.desc())
+        .limit(limit + 1)
+    )
+    if cursor:
+        ts, scan_id = decode_scan_cursor(cursor)
+        query = query.where(tuple_(Scan.timestamp, Scan.id) < tuple_(ts, scan_id))
+    if breed:
+        query = query.where(Scan.breed == breed)
+    if date_from:
+        query = query.where(Scan.timestamp >= date_from)
+    if date_to:
+        query = query.where(Scan.timestamp < date_to)
+
+    rows = db.execute(query).all()
+    if len(rows) > limit:
+        rows = rows[:limit]
+        response.headers["X-Next-Cursor"] = encode_scan_cursor(rows[-1].timestamp, rows[-1].id)
+
+    return [scan_summary(row) for row in rows]
+
+def scan_summary(row):
+    # History-list item for a row with id, breed, confidence, timestamp and image_url
+    return {
+        "id": row.id,
+        "breed": row.breed,
+        "confidence": float(row.confidence),
+        "date": row.timestamp.strftime("%Y-%m-%d %H:%M"),
+        "location": "India", # Placeholder
+        "image": row.image_url if row.image_url else "https://via.placeholder.com/150",
+        "thumbnails": thumbnail_urls(row.image_url),
+    }
+
+async def similar_scans(db, version, vector, k, mobile=None, exclude_scan=None):
+    # Nearest scans to vector in the version's embedding index (optionally only
+    # mobile's), as history items with their cosine similarity
+    index = embedding_indexes.get(version)
+    if index is None:
+        return []
+    rows = None
+    if mobile:
+        # Only the user's own rows are candidates, so other users' scans can't crowd them out
+        rows = (await db.execute(
+            select(Scan.embedding_row)
+            .where(Scan.user_mobile == mobile, Scan.model_version == version, Scan.embedding_row.is_not(None))
+        )).scalars().all()
+        if not rows:
+            return []
+    hits = await run_in_threadpool(index.search, vector, k, exclude_scan, rows)
+    if not hits:
+        return []
+    query = (
+        select(Scan.id, Scan.breed, Scan.confidence, Scan.timestamp, Scan.image_url)
+        .where(Scan.id.in_([scan_id for scan_id, _ in hits]))
+    )
+    if mobile:
+        query = query.where(Scan.user_mobile == mobile)
+    rows = {row.id: row for row in (await db.execute(query)).all()}
+    similar = []
+    for scan_id, similarity in hits:
+        row = rows.get(scan_id)
+        if row is not None:
+            similar.append(dict(scan_summary(row), similarity=round(similarity, 4),
+                                duplicate=similarity >= DUPLICATE_SIMILARITY))
+    return similar[:k]
+
+@app.get("/scans/{mobile}/{scan_id}/similar")
+async def get_similar_scans(mobile: str, scan_id: int, k: int = 10, db: AsyncSession = Depends(get_async_db)):
+    # Visually similar scans from the same user's history, nearest first;
+    # "duplicate" marks the ones close enough to be the same animal or photo
+    scan = await db.get(Scan, scan_id)
+    if scan is None or scan.user_mobile != mobile:
+        raise HTTPException(status_code=404, detail="Scan not found")
+    index = embedding_indexes.get(scan.model_version)
+    if index is None or scan.embedding_row is None:
+        return []  # scanned before embeddings were kept, or in mock mode
+    vector = index.vector(scan.embedding_row)
+    return await similar_scans(db, scan.model_version, vector, max(1, min(k, SIMILAR_MAX_K)),
+                               mobile=mobile, exclude_scan=scan_id)
 
 @app.get("/")
 def read_root():
@@ -297,41 +428,182 @@ def read_root():
 def health_check():
     return {"status": "healthy"}
 
+@app.get("/ready")
+def readiness_check():
+    # /health says the process is up; /ready says it can serve predictions
+    stats = model.stats()
+    return JSONResponse(stats, status_code=200 if model.ready else 503)
+
+@app.get("/batching/stats")
+def batching_stats():
+    stats = batcher.stats()
+    stats["model"] = model.stats()
+    return stats
+
+@app.get("/cache/stats")
+def cache_stats():
+    return prediction_cache.stats()
+
+@app.get("/embeddings/stats")
+def embedding_stats():
+    return embedding_indexes.stats()
+
+@app.get("/thumbnails/stats")
+def thumbnail_stats():
+    return thumbnail_worker.stats()
+
+def immutable_file_response(path, request, etag=None):
+    # Blobs and thumbnails never change once written: cached for a year, revalidated by ETag.
+    # Content-addressed files pass their name as the ETag - re-uploads touch their mtime
+    st = os.stat(path)
+    etag = f'"{etag}"' if etag else f'"{st.st_mtime_ns:x}-{st.st_size:x}"'
+    headers = {"ETag": etag, "Cache-Control": f"public, max-age={THUMBNAIL_MAX_AGE}, immutable"}
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path, headers=headers, stat_result=st)
+
+def source_path_for(source):
+    # Blob key -> local copy from the store; otherwise a not yet migrated /uploads/ file
+    if is_valid_key(source):
+        return blob_store.local_path(source) if blob_store.exists(source) else None
+    path = os.path.join(UPLOADS_DIR, source)
+    return path if os.path.isfile(path) else None
+
+@app.get("/blobs/stats")
+def blob_stats():
+    return upload_writer.stats()
+
+@app.get("/blobs/{key}")
+async def get_blob(key: str, request: Request):
+    if not is_valid_key(key):
+        raise HTTPException(status_code=404, detail="Not found")
+    content = upload_writer.pending.get(key)
+    if content is not None:
+        # Returned by /predict moments ago, not written yet
+        media_type = mimetypes.guess_type(key)[0] or "application/octet-stream"
+        return Response(content, media_type=media_type, headers={"Cache-Control": "no-cache"})
+    path = await run_in_threadpool(source_path_for, key)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Not found")
+    return immutable_file_response(path, request, etag=key)
+
+@app.get("/uploads/{name}")
+async def get_legacy_upload(name: str, request: Request):
+    # Flat files from before the blob store (manage.py migrate-uploads) only - blobs,
+    # their temp files and thumbnails live in subdirectories and are never served from here
+    if "/" in name or "\\" in name or name.startswith("."):
+        raise HTTPException(status_code=404, detail="Not found")
+    path = os.path.join(UPLOADS_DIR, name)
+    if not await run_in_threadpool(os.path.isfile, path):
+        raise HTTPException(status_code=404, detail="Not found")
+    return immutable_file_response(path, request)
+
+@app.get("/thumbs/{name}")
+async def get_thumbnail(name: str, request: Request):
+    source = source_name(name)
+    if source is None or "/" in name or "\\" in name or name.startswith("."):
+        raise HTTPException(status_code=404, detail="Not found")
+    path = thumbnail_path(name)
+    if not os.path.exists(path):
+        # Older upload, or the worker hasn't got to it yet - make it now
+        source_path = await run_in_threadpool(source_path_for, source)
+        if source_path is None:
+            raise HTTPException(status_code=404, detail="Not found")
+        try:
+            await run_in_threadpool(generate_thumbnails, source_path, source)
+        except Exception as e:
+            log.warning("Thumbnail generation failed", extra={"source": source_path, "error": str(e)})
+            raise HTTPException(status_code=404, detail="Not found")
+    return immutable_file_response(path, request, etag=name if is_valid_key(source) else None)
+
+@app.get("/metrics")
+def metrics():
+    # Prometheus scrape endpoint
+    body, content_type = metrics_response_body()
+    return Response(body, media_type=content_type)
+
+@app.get("/db/stats")
+def db_stats():
+    stats = scan_writer.stats()
+    stats["pool"] = engine.pool.status()
+    return stats
+
+async def classify_image(item, digest=None):
+    # item is anything BreedClassifier accepts (a saved upload's path, or bytes).
+    # Returns (results, model version, embedding or None)
+    digest = digest or image_digest(item)
+    results = prediction_cache.get_memory(digest)
+    if results is None:
+        # Disk tier and model-file stat() calls stay off the event loop
+        results = await run_in_threadpool(prediction_cache.get, digest)
+    if results is not None:
+        return results, model.version, cached_embedding(model.version, digest)
+    if not model.ready:
+        raise HTTPException(status_code=503, detail="Model is still loading", headers={"Retry-After": "5"})
+
+    # A retry can arrive while the original is still being scored - share its result
+    pending = inflight_predictions.get(digest)
+    if pending is not None:
+        return await asyncio.shield(pending)
+    pending = asyncio.ensure_future(batcher.submit(item))
+    inflight_predictions[digest] = pending
+    try:
+        results, version, embedding = await asyncio.shield(pending)
+        await run_in_threadpool(prediction_cache.put, digest, results)
+        return results, version, embedding
+    finally:
+        inflight_predictions.pop(digest, None)
+
+def cached_embedding(version, digest):
+    # A prediction-cache hit never reaches the model: reuse the embedding of
+    # the upload that filled the cache, if it was recent enough to remember
+    index = embedding_indexes.get(version)
+    row = index.row_for_digest(digest) if index is not None else None
+    return None if row is None else index.vector(row)
+
+async def add_embedding(version, embedding, digest):
+    # Row in the version's embedding index for a new scan (None if there's no embedding)
+    index = embedding_indexes.get(version) if embedding is not None else None
+    if index is None:
+        return None
+    return await run_in_threadpool(index.add, embedding, digest)
+
+def link_embeddings(scans):
+    # Rows only become searchable once their scan is committed and has an id
+    for scan in scans:
+        if scan.embedding_row is not None:
+            embedding_indexes.get(scan.model_version).link(scan.embedding_row, scan.id)
+
 @app.post("/predict", response_model=PredictionResponse)
 async def predict_breed(
     file: UploadFile = File(...), 
     mobile: str = Form("1234567890"), # Default for legacy/dev
-    db: Session = Depends(get_db)
+    check_duplicate: bool = Form(False),  # costs a similarity search and a query, so opt-in
 ):
-    print(f"Received prediction request for file: {file.filename} from user: {mobile}")
-    
-    # Use permanent uploads directory
-    uploads_dir = "uploads"
-    os.makedirs(uploads_dir, exist_ok=True)
-    
-    # Create unique filename
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"{mobile}_{timestamp}_{file.filename}"
-    file_path = os.path.join(uploads_dir, filename)
-    
-    # Image URL (assuming localhost access from emulator/device needs loopback or IP)
-    # We will store relative path or construct full URL. Storing relative is safer.
-    # Frontend will prepend backend URL.
-    image_url_db = f"/uploads/{filename}"
-
+    started = time.perf_counter()
     try:
-        print(f"Saving file to: {file_path}")
-        with open(file_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
-        print("File saved successfully.")
-            
-        # Run prediction
-        print("Calling classifier.predict()...")
-        results = classifier.predict(file_path)
-        print(f"Prediction results: {results}")
-        
+        # Read into memory (hashed as it arrives) and classified from there; the
+        # content-addressed blob and its thumbnails are written in the background.
+        # Over the upload memory budget it is streamed to disk and classified from the file.
+        # The image URL is relative (/blobs/<key>); the frontend prepends the backend URL.
+        reserved = file.size if file.size is not None else MAX_UPLOAD_BYTES
+        if upload_writer.reserve(reserved):
+            try:
+                content, digest, kind = await read_upload(file)
+                key = blob_key(digest, kind)
+                upload_writer.submit(content, key)
+                # Run prediction (queued and batched with other in-flight requests)
+                results, version, embedding = await classify_image(content, digest)
+            finally:
+                upload_writer.release(reserved)
+        else:
+            key, digest, local_path = await store_upload(file)
+            thumbnail_worker.submit(local_path, key)
+            results, version, embedding = await classify_image(local_path, digest)
+        image_url_db = blob_url(key)
+
         # Record Scan in DB
+        scan_id = None
         try:
             top_breed = results[0]['breed'] if results else "Unknown"
             top_conf = str(results[0]['confidence']) if results else "0.0"
@@ -340,24 +612,109 @@ async def predict_breed(
                 user_mobile=mobile,
                 breed=top_breed,
                 confidence=top_conf,
-                image_url=image_url_db
+                image_url=image_url_db,
+                model_version=version,
+                embedding_row=await add_embedding(version, embedding, digest),
             )
-            db.add(new_scan)
-            db.commit()
-            print(f"Scan recorded for {mobile} with image {image_url_db}")
-        except Exception as e:
-            print(f"Failed to log scan to DB: {e}")
-            
-        return {"predictions": results}
-        
-    except Exception as e:
-        print(f"Error processing file in main.py: {e}")
-        import traceback
-        traceback.print_exc()
+            # Group-committed with other concurrent scans
+            await scan_writer.submit(new_scan)
+            scan_id = new_scan.id
+            link_embeddings([new_scan])
+        except Exception:
+            log.exception("Failed to log scan to DB", extra={"mobile": mobile, "image": image_url_db})
+
+        # Same animal (or photo) already scanned by this user?
+        duplicate_of = None
+        if check_duplicate and scan_id is not None and embedding is not None and DUPLICATE_SIMILARITY > 0:
+            try:
+                async with AsyncSessionLocal() as db:
+                    nearest = await similar_scans(db, version, embedding, 1, mobile=mobile, exclude_scan=scan_id)
+                if nearest and nearest[0]["duplicate"]:
+                    duplicate_of = nearest[0]["id"]
+            except Exception:
+                log.exception("Duplicate check failed", extra={"mobile": mobile, "scan_id": scan_id})
+
+        log_sampled(log, "predict", mobile=mobile, image=image_url_db, breed=top_breed, confidence=top_conf,
+                    version=version, ms=round((time.perf_counter() - started) * 1000, 1))
+        return {"predictions": results, "model_version": version, "scan_id": scan_id, "duplicate_of": duplicate_of}
+
+    except HTTPException:
+        raise
+    except Exception:
+        log.exception("Prediction failed", extra={"mobile": mobile, "upload_name": file.filename})
         return {"predictions": []}
         
     # No finally block to delete file, we keep it now!
 
+@app.post("/predict/batch", response_model=BatchPredictionResponse)
+async def predict_breed_batch(
+    files: List[UploadFile] = File(...),
+    mobile: str = Form("1234567890"),
+):
+    # For offline-queued scans: one request, batched forward passes, one commit.
+    # Multipart parts are streamed/spooled by Starlette, not held as one body.
+    if len(files) > PREDICT_BATCH_MAX_FILES:
+        raise HTTPException(status_code=413, detail=f"At most {PREDICT_BATCH_MAX_FILES} images per batch")
+    if not model.ready:
+        raise HTTPException(status_code=503, detail="Model is still loading", headers={"Retry-After": "5"})
+    started = time.perf_counter()
+
+    image_urls = []
+    saved = []
+    for file in files:
+        try:
+            key, digest, local_path = await store_upload(file)
+            image_urls.append(blob_url(key))
+            saved.append((local_path, digest))
+            thumbnail_worker.submit(local_path, key)
+        except HTTPException as e:
+            image_urls.append(None)
+            saved.append(e)  # oversized / not an image: reported for this item only
+
+    # All items go through the batcher together, so they fill whole batches
+    async def classify_saved(entry):
+        if isinstance(entry, Exception):
+            raise entry
+        return await classify_image(*entry)
+
+    outcomes = await asyncio.gather(*(classify_saved(entry) for entry in saved), return_exceptions=True)
+
+    items = []
+    scans = []
+    scan_items = []
+    for i, (file, outcome) in enumerate(zip(files, outcomes)):
+        if isinstance(outcome, Exception):
+            detail = outcome.detail if isinstance(outcome, HTTPException) else str(outcome)
+            items.append({"index": i, "filename": file.filename, "predictions": [], "error": detail})
+            continue
+        predictions, version, embedding = outcome
+        items.append({"index": i, "filename": file.filename, "predictions": predictions,
+                      "model_version": version, "error": None})
+        scans.append(Scan(
+            user_mobile=mobile,
+            breed=predictions[0]['breed'] if predictions else "Unknown",
+            confidence=str(predictions[0]['confidence']) if predictions else "0.0",
+            image_url=image_urls[i],
+            model_version=version,
+            embedding_row=await add_embedding(version, embedding, saved[i][1]),
+        ))
+        scan_items.append(items[-1])
+
+    # Single transaction for the whole sync (submitted as one item)
+    try:
+        if scans:
+            await scan_writer.submit(scans)
+            link_embeddings(scans)
+            for item, scan in zip(scan_items, scans):
+                item["scan_id"] = scan.id
+    except Exception:
+        log.exception("Failed to log batch scans to DB", extra={"mobile": mobile, "scans": len(scans)})
+
+    failed = sum(1 for item in items if item["error"])
+    log_sampled(log, "predict_batch", mobile=mobile, images=len(items), failed=failed,
+                ms=round((time.perf_counter() - started) * 1000, 1))
+    return {"results": items}
+
 if __name__ == "__main__":
     import uvicorn
     # Listen on all network interfaces so LAN devices can connect
@@ -0,0 +1,32 @@
+import argparse
+
+from database import Base, engine, migrate_db, rebuild_scan_stats
+from observability import setup_logging
+from storage import migrate_uploads, collect_garbage
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cattle Sense maintenance commands.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("rebuild-stats", help="Recompute the scan_counts counters from the scans table")
+    migrate = commands.add_parser("migrate-uploads", help="Move legacy uploads/<name> files into the blob store")
+    migrate.add_argument("--delete-originals", action="store_true", help="remove the flat files once migrated")
+    gc = commands.add_parser("gc-uploads", help="Delete blobs no scan or profile references")
+    gc.add_argument("--min-age-hours", type=float, default=24.0, help="never delete blobs newer than this")
+    gc.add_argument("--dry-run", action="store_true", help="only list what would be deleted")
+    args = parser.parse_args()
+    setup_logging()  # migrate_db() and the rebuild report through the app loggers
+
+    Base.metadata.create_all(bind=engine)
+    migrate_db()
+
+    if args.command == "rebuild-stats":
+        rebuild_scan_stats()
+    elif args.command == "migrate-uploads":
+        migrate_uploads(delete_originals=args.delete_originals)
+    elif args.command == "gc-uploads":
+        collect_garbage(min_age_hours=args.min_age_hours, dry_run=args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,354 @@
+import os
+import sys
+import time
+import random
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from observability import get_logger, MODEL_SWAPS, SHADOW_PREDICTIONS
+
+log = get_logger("model")
+
+# Add ml_pipeline to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'ml_pipeline', 'src', 'models')))
+
+# Try importing, mock if fails (for dev robustness)
+try:
+    from breed_classifier import BreedClassifier
+    from model_registry import REGISTRY_PATH, read_registry, resolve_model_dir
+except ImportError:
+    class MockPrediction(list):
+        mock = True
+    REGISTRY_PATH = ""
+    def read_registry(path=None): return {}
+    def resolve_model_dir(role="active", path=None): return ("mock", "") if role == "active" else (None, None)
+    class BreedClassifier:
+        model_path = ""
+        classes_path = ""
+        def __init__(self, load_model=True, model_dir="", version="mock", **kwargs):
+            self.model_dir = model_dir
+            self.version = version
+        def load(self): pass
+        def warm_up(self): pass
+        def predict(self, _): return MockPrediction([{"breed": "Mock", "confidence": 1.0}])
+        def predict_batch(self, items, top_k=3, with_embeddings=False):
+            results = [self.predict(i) for i in items]
+            return (results, None) if with_embeddings else results
+
+# INFERENCE_WORKERS > 0 moves the model into a pool of worker processes
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", "0"))
+# How often models/registry.json is checked for a new active or candidate version
+REGISTRY_POLL_SECONDS = float(os.environ.get("REGISTRY_POLL_SECONDS", "5"))
+SWAP_DRAIN_SECONDS = 60.0  # in-flight batches a replaced worker pool gets to finish
+SHADOW_MAX_PENDING = 2  # shadow batches queued before new ones are skipped
+
+
+class ShadowScorer:
+    """Re-scores a random share of batches on the candidate model, off the request path.
+
+    Runs after the active model has answered, on its own thread; the results
+    are only compared with the active ones (top-1 agreement), never returned.
+    """
+
+    def __init__(self, classifier, fraction, max_pending=SHADOW_MAX_PENDING):
+        self.classifier = classifier
+        self.version = classifier.version
+        self.fraction = fraction
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix="shadow")
+        self._slots = threading.Semaphore(max_pending)
+
+        # Metrics
+        self.batches = 0
+        self.compared = 0
+        self.agreed = 0
+        self.skipped = 0
+        self.errors = 0
+        self.seconds = 0.0
+
+    def maybe_score(self, items, results):
+        if random.random() >= self.fraction:
+            return
+        if not self._slots.acquire(blocking=False):
+            self.skipped += 1
+            return
+        self._executor.submit(self._score, list(items), results)
+
+    def _score(self, items, results):
+        try:
+            started = time.perf_counter()
+            shadow_results = self.classifier.predict_batch(items)
+            self.seconds += time.perf_counter() - started
+            self.batches += 1
+            for active, shadow in zip(results, shadow_results):
+                if isinstance(active, Exception) or isinstance(shadow, Exception) or not active or not shadow:
+                    continue
+                agree = active[0]["breed"] == shadow[0]["breed"]
+                self.compared += 1
+                self.agreed += agree
+                SHADOW_PREDICTIONS.labels(self.version, "agree" if agree else "disagree").inc()
+        except Exception:
+            self.errors += 1
+            log.exception("Shadow scoring failed", extra={"version": self.version})
+        finally:
+            self._slots.release()
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    def stats(self):
+        return {
+            "version": self.version,
+            "fraction": self.fraction,
+            "batches": self.batches,
+            "compared": self.compared,
+            "top1_agreement": round(self.agreed / self.compared, 4) if self.compared else None,
+            "skipped": self.skipped,
+            "errors": self.errors,
+            "avg_batch_ms": round(self.seconds / self.batches * 1000, 1) if self.batches else None,
+        }
+
+
+def _has_model(model_dir):
+    # train.py always writes the keras model; exported artifacts are optional
+    return os.path.exists(os.path.join(model_dir, "cattle_model.keras"))
+
+
+class ModelLoader:
+    """Owns the classifier (or worker pool) and brings it up off the startup path.
+
+    The API starts serving immediately; start() loads and warms the model on a
+    background thread and `ready` flips once the first real batch won't pay
+    any load or tracing cost. The same thread then watches the model registry:
+    a newly activated version is loaded and warmed next to the serving one and
+    swapped in with one reference assignment, so batches already running
+    finish on the model they started with and nothing waits on the load.
+    """
+
+    def __init__(self, num_workers=INFERENCE_WORKERS, metrics=None, registry_path=REGISTRY_PATH,
+                 poll_seconds=REGISTRY_POLL_SECONDS):
+        self.num_workers = num_workers
+        self.metrics = metrics
+        self.registry_path = registry_path
+        self.poll_seconds = poll_seconds
+        # (version, classifier, pool), always replaced as a whole.
+        # Classes-only until the first load - enough for model_files() and formatting
+        version, model_dir = resolve_model_dir()
+        self._active = (version, self._classifier(model_dir, version, load_model=False), None)
+        self.shadow = None
+        self.status = "not_started"
+        self.error = None
+        self.load_seconds = None
+        self.swaps = 0
+        self._failed_version = None
+        self._registry_mtime = None
+        self._model_mtime = None
+        self._ready = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    @property
+    def version(self):
+        return self._active[0]
+
+    @property
+    def classifier(self):
+        return self._active[1]
+
+    @property
+    def pool(self):
+        return self._active[2]
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    @property
+    def concurrency(self):
+        return max(1, self.num_workers)
+
+    def model_files(self):
+        # Changes on every swap, so cached predictions never outlive their model
+        classifier = self.classifier
+        return [getattr(classifier, "model_path", ""), getattr(classifier, "classes_path", ""),
+                getattr(classifier, "calibration_path", "")]
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="model-loader", daemon=True)
+            self._thread.start()
+
+    def wait(self, timeout=None):
+        return self._ready.wait(timeout)
+
+    def _classifier(self, model_dir, version, load_model=True):
+        classifier = BreedClassifier(load_model=load_model, model_dir=model_dir, version=version)
+        if self.metrics is not None:
+            classifier.metrics = self.metrics
+        return classifier
+
+    def _load_version(self, version, model_dir):
+        # A warmed-up (version, classifier, pool) ready to be swapped in
+        if self.num_workers > 0:
+            from worker_pool import InferencePool
+            pool = InferencePool(self.num_workers, metrics=self.metrics, model_dir=model_dir, version=version)
+            pool.start()  # each worker warms itself up before reporting ready
+            return version, pool.preprocessor, pool
+        classifier = self._classifier(model_dir, version)
+        classifier.warm_up()
+        return version, classifier, None
+
+    def _run(self):
+        self._registry_mtime = self._registry_stat()
+        self._model_mtime = self._model_stat()
+        self._load_first()
+
+        while not self._stop.wait(self.poll_seconds):
+            mtime = self._registry_stat()
+            if mtime != self._registry_mtime:
+                self._registry_mtime = mtime
+                # A version that failed before may have been fixed since
+                self._failed_version = None
+                self.reload()
+            elif not self.ready:
+                # Flat models/ directory: no registry write announces a new model
+                mtime = self._model_stat()
+                if mtime != self._model_mtime:
+                    self._model_mtime = mtime
+                    self._load_first()
+
+    def _load_first(self):
+        # On failure the registry watch keeps running and tries again on the next change
+        self.status = "loading"
+        started = time.perf_counter()
+        try:
+            self._active = self._load_version(*resolve_model_dir(path=self.registry_path))
+        except Exception as e:
+            self.status = "failed"
+            self.error = str(e)
+            log.exception("Model load failed, retrying when the registry or model files change")
+            return
+        self.load_seconds = round(time.perf_counter() - started, 2)
+        self.status = "ready"
+        self.error = None
+        log.info(f"Model ready in {self.load_seconds}s",
+                 extra={"version": self.version, "backend": getattr(self.classifier, "backend", "mock")})
+        self._ready.set()
+        self._update_shadow()
+
+    def _registry_stat(self):
+        try:
+            return os.stat(self.registry_path).st_mtime_ns
+        except OSError:
+            return None
+
+    def _model_stat(self):
+        try:
+            _, model_dir = resolve_model_dir(path=self.registry_path)
+            return os.stat(os.path.join(model_dir, "cattle_model.keras")).st_mtime_ns
+        except OSError:
+            return None
+
+    def reload(self):
+        # Bring the serving and shadow models in line with the registry
+        try:
+            version, model_dir = resolve_model_dir(path=self.registry_path)
+        except Exception:
+            log.exception("Could not read the model registry")
+            return
+        if not self.ready:
+            self._load_first()
+            return
+        if version != self.version and version != self._failed_version:
+            self._swap(version, model_dir)
+        self._update_shadow()
+
+    def _swap(self, version, model_dir):
+        started = time.perf_counter()
+        log.info("Loading model version", extra={"version": version, "model_dir": model_dir})
+        try:
+            if not _has_model(model_dir):
+                raise FileNotFoundError(f"no model in {model_dir}")
+            active = self._load_version(version, model_dir)
+        except Exception as e:
+            # Keep serving the current version; _run clears this on the next registry change
+            self._failed_version = version
+            self.error = f"{version}: {e}"
+            MODEL_SWAPS.labels("failed").inc()
+            log.exception("Model swap failed, keeping the current version",
+                          extra={"version": version, "current": self.version})
+            return
+        previous_version, _, previous_pool = self._active
+        self._active = active
+        self._failed_version = None
+        self.error = None
+        self.swaps += 1
+        MODEL_SWAPS.labels("ok").inc()
+        log.info("Model swapped", extra={"version": version, "previous": previous_version,
+                                         "load_seconds": round(time.perf_counter() - started, 2)})
+        if previous_pool is not None:
+            previous_pool.stop(drain_timeout=SWAP_DRAIN_SECONDS)
+
+    def _update_shadow(self):
+        registry = read_registry(self.registry_path)
+        version, model_dir = resolve_model_dir("candidate", self.registry_path)
+        fraction = float(registry.get("shadow_fraction") or 0.0)
+        if version is None or version == self.version or fraction <= 0:
+            if self.shadow is not None:
+                log.info("Shadow scoring stopped", extra=self.shadow.stats())
+                self.shadow.close()
+                self.shadow = None
+            return
+        if self.shadow is not None and self.shadow.version == version:
+            self.shadow.fraction = fraction
+            return
+        try:
+            if not _has_model(model_dir):
+                raise FileNotFoundError(f"no model in {model_dir}")
+            # Always in-process: the candidate only sees a small share of batches
+            candidate = BreedClassifier(model_dir=model_dir, version=version)
+            candidate.warm_up()
+        except Exception:
+            log.exception("Could not load the shadow candidate", extra={"version": version})
+            return
+        previous, self.shadow = self.shadow, ShadowScorer(candidate, fraction)
+        if previous is not None:
+            previous.close()
+        log.info("Shadow scoring started", extra={"version": version, "fraction": fraction})
+
+    def stop(self):
+        self._stop.set()
+        if self.shadow is not None:
+            self.shadow.close()
+        if self.pool is not None:
+            self.pool.stop()
+
+    def predict_batch(self, items):
+        # (results, version, embedding or None) per item, or the item's Exception.
+        # The active tuple is read once, so a swap mid-batch can't mix two versions
+        version, classifier, pool = self._active
+        results, embeddings = (pool or classifier).predict_batch(items, with_embeddings=True)
+        shadow = self.shadow
+        if shadow is not None:
+            shadow.maybe_score(items, results)
+        return [r if isinstance(r, Exception) else (r, version, None if embeddings is None else embeddings[i])
+                for i, r in enumerate(results)]
+
+    def stats(self):
+        version, classifier, pool = self._active
+        stats = {
+            "status": self.status,
+            "ready": self.ready,
+            "error": self.error,
+            "load_seconds": self.load_seconds,
+            "version": version,
+            "swaps": self.swaps,
+            "backend": getattr(classifier, "backend", "mock"),
+            "mock_mode": self.ready and pool is None and getattr(classifier, "model", None) is None,
+        }
+        if pool is not None:
+            stats["pool"] = pool.stats()
+        elif hasattr(classifier, "tta_stats"):
+            stats["tta"] = dict(classifier.tta_stats, threshold=classifier.tta_threshold)
+        if self.shadow is not None:
+            stats["shadow"] = self.shadow.stats()
+        return stats
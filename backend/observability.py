@@ -0,0 +1,190 @@
+import os
+import json
+import time
+import queue
+import random
+import atexit
+import logging
+import threading
+import logging.handlers
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CollectorRegistry, Counter, Histogram, REGISTRY, CONTENT_TYPE_LATEST, generate_latest,
+)
+
+# Logging: JSON lines (or plain text) written by a background thread, so a
+# request never waits on stdout. Routine per-request events are sampled;
+# warnings and errors are always kept.
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.environ.get("LOG_FORMAT", "json")  # json or text
+LOG_SAMPLE_RATE = float(os.environ.get("LOG_SAMPLE_RATE", "0.01"))
+# Slow-request profiling: off unless PROFILE_SLOW_MS > 0
+PROFILE_SLOW_MS = float(os.environ.get("PROFILE_SLOW_MS", "0"))
+PROFILER = os.environ.get("PROFILER", "pyinstrument")  # pyinstrument or cprofile
+PROFILE_DIR = os.environ.get("PROFILE_DIR", "profiles")
+# Set with several uvicorn workers so /metrics aggregates all of them
+PROMETHEUS_MULTIPROC_DIR = os.environ.get("PROMETHEUS_MULTIPROC_DIR", "")
+
+log = logging.getLogger("cattlesense")
+
+# Seconds, from ~1ms (post-processing) to ~10s (a large upload on a slow link)
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STAGES = ("upload_read", "file_write", "decode", "inference", "postprocess", "db_commit")
+
+STAGE_SECONDS = Histogram("cattlesense_stage_seconds", "Time spent per hot-path stage", ["stage"],
+                          buckets=STAGE_BUCKETS)
+REQUEST_SECONDS = Histogram("cattlesense_request_seconds", "HTTP request latency", ["method", "route", "status"],
+                            buckets=STAGE_BUCKETS)
+MOCK_FALLBACKS = Counter("cattlesense_mock_fallback_total", "Images answered with mock predictions")
+INFERENCE_ERRORS = Counter("cattlesense_inference_errors_total", "Inference failures", ["kind"])
+SLOW_REQUESTS = Counter("cattlesense_slow_requests_total", "Requests slower than PROFILE_SLOW_MS", ["route"])
+MODEL_SWAPS = Counter("cattlesense_model_swaps_total", "Model hot-swaps from the registry", ["outcome"])
+SHADOW_PREDICTIONS = Counter("cattlesense_shadow_predictions_total",
+                             "Candidate-model predictions compared with the active model", ["version", "outcome"])
+
+
+class JsonFormatter(logging.Formatter):
+    # Standard LogRecord attributes; anything else passed via extra= becomes a JSON field
+    RESERVED = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "event": record.getMessage(),
+        }
+        entry.update({k: v for k, v in vars(record).items() if k not in self.RESERVED})
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def setup_logging():
+    """Routes the "cattlesense" loggers through a queue to a stderr handler thread."""
+    if log.handlers:
+        return
+    handler = logging.StreamHandler()
+    if LOG_FORMAT == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    records = queue.SimpleQueue()
+    listener = logging.handlers.QueueListener(records, handler)
+    listener.start()
+    atexit.register(listener.stop)
+    log.addHandler(logging.handlers.QueueHandler(records))
+    log.setLevel(LOG_LEVEL)
+    log.propagate = False
+
+
+def get_logger(name):
+    return log.getChild(name)
+
+
+def log_sampled(logger, event, rate=None, **fields):
+    # INFO for a random LOG_SAMPLE_RATE fraction of calls; the volume scales with traffic otherwise
+    if random.random() < (LOG_SAMPLE_RATE if rate is None else rate):
+        logger.info(event, extra=fields)
+
+
+def observe_stage(stage, seconds):
+    STAGE_SECONDS.labels(stage).observe(seconds)
+
+
+@contextmanager
+def stage_timer(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        STAGE_SECONDS.labels(stage).observe(time.perf_counter() - started)
+
+
+class ClassifierMetrics:
+    """Hook for BreedClassifier / InferencePool (classifier.metrics = ClassifierMetrics())."""
+
+    def observe(self, stage, seconds):
+        STAGE_SECONDS.labels(stage).observe(seconds)
+
+    def incr(self, event, n=1):
+        if event == "mock_fallback":
+            MOCK_FALLBACKS.inc(n)
+        else:
+            INFERENCE_ERRORS.labels(event).inc(n)
+
+
+def metrics_response_body():
+    # (body, content type) for GET /metrics
+    registry = REGISTRY
+    if PROMETHEUS_MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+# --- Slow-request profiling ---
+
+class SlowRequestProfiler:
+    """Profiles requests and keeps the report only for those slower than PROFILE_SLOW_MS.
+
+    One request is profiled at a time (the profilers are per-thread and not
+    free), so under load this samples whichever request arrives while none
+    is being profiled. cProfile also attributes other coroutines that ran
+    during the request's awaits; pyinstrument's async mode does not.
+    """
+
+    def __init__(self, threshold_ms=PROFILE_SLOW_MS, profiler=PROFILER, out_dir=PROFILE_DIR):
+        self.threshold = threshold_ms / 1000.0
+        self.profiler = profiler
+        self.out_dir = out_dir
+        self._busy = threading.Lock()
+        self.saved = 0
+
+    @property
+    def enabled(self):
+        return self.threshold > 0
+
+    def start(self):
+        # Returns a started profiler, or None if another request holds it
+        if not self.enabled or not self._busy.acquire(blocking=False):
+            return None
+        try:
+            if self.profiler == "cprofile":
+                import cProfile
+                profiler = cProfile.Profile()
+                profiler.enable()
+            else:
+                from pyinstrument import Profiler
+                profiler = Profiler(async_mode="enabled")
+                profiler.start()
+            return profiler
+        except Exception as e:
+            self._busy.release()
+            log.warning("Profiler unavailable", extra={"profiler": self.profiler, "error": str(e)})
+            self.threshold = 0.0
+            return None
+
+    def finish(self, profiler, seconds, route):
+        try:
+            if self.profiler == "cprofile":
+                profiler.disable()
+            else:
+                profiler.stop()
+            if seconds < self.threshold:
+                return
+            os.makedirs(self.out_dir, exist_ok=True)
+            stem = f"{time.strftime('%Y%m%d-%H%M%S')}-{int(seconds * 1000)}ms-{route.strip('/').replace('/', '_') or 'root'}"
+            if self.profiler == "cprofile":
+                path = os.path.join(self.out_dir, stem + ".prof")  # open with snakeviz / pstats
+                profiler.dump_stats(path)
+            else:
+                path = os.path.join(self.out_dir, stem + ".html")
+                with open(path, "w") as f:
+                    f.write(profiler.output_html())
+            self.saved += 1
+            log.warning("Slow request profiled", extra={"route": route, "ms": round(seconds * 1000, 1), "profile": path})
+        finally:
+            self._busy.release()
@@ -0,0 +1,190 @@
+import os
+import hmac
+import time
+import random
+import hashlib
+import sqlite3
+import threading
+
+# One-time passwords live outside the API process so every worker sees the
+# same codes. Empty OTP_STORE_URL = SQLite file (all workers on one host);
+# redis://host:6379/0 = Redis (several hosts)
+OTP_STORE_URL = os.environ.get("OTP_STORE_URL", "")
+OTP_DB_PATH = os.environ.get("OTP_DB_PATH", "otp.db")
+OTP_LENGTH = 4
+OTP_TTL_SECONDS = int(os.environ.get("OTP_TTL_SECONDS", "300"))
+OTP_MAX_ATTEMPTS = int(os.environ.get("OTP_MAX_ATTEMPTS", "5"))  # wrong guesses before the code is burnt
+# Rate limits per mobile number
+OTP_RESEND_INTERVAL = int(os.environ.get("OTP_RESEND_INTERVAL", "30"))  # seconds between codes
+OTP_MAX_PER_HOUR = int(os.environ.get("OTP_MAX_PER_HOUR", "5"))
+
+_random = random.SystemRandom()
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after):
+        super().__init__(f"Too many OTP requests, retry in {int(retry_after)}s")
+        self.retry_after = max(1, int(retry_after))
+
+
+def generate_otp(length=OTP_LENGTH):
+    return "".join(_random.choice("0123456789") for _ in range(length))
+
+
+def _hash(mobile, otp):
+    # Codes are never stored in clear
+    return hashlib.sha256(f"{mobile}:{otp}".encode()).hexdigest()
+
+
+class OTPStore:
+    """Issues and checks OTPs with expiry, attempt limits and send rate limits.
+
+    issue() returns a fresh code (replacing any previous one) or raises
+    RateLimited; verify() consumes the code on success.
+    """
+
+    def __init__(self, ttl=OTP_TTL_SECONDS, max_attempts=OTP_MAX_ATTEMPTS,
+                 resend_interval=OTP_RESEND_INTERVAL, max_per_hour=OTP_MAX_PER_HOUR):
+        self.ttl = ttl
+        self.max_attempts = max_attempts
+        self.resend_interval = resend_interval
+        self.max_per_hour = max_per_hour
+
+    def issue(self, mobile):
+        raise NotImplementedError
+
+    def verify(self, mobile, otp):
+        raise NotImplementedError
+
+
+class SQLiteOTPStore(OTPStore):
+    """SQLite in WAL mode; BEGIN IMMEDIATE makes check-and-set atomic across processes."""
+
+    def __init__(self, path=OTP_DB_PATH, **kwargs):
+        super().__init__(**kwargs)
+        self.path = path
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS otps (mobile TEXT PRIMARY KEY, code_hash TEXT NOT NULL, "
+                "expires_at REAL NOT NULL, attempts INTEGER NOT NULL DEFAULT 0)"
+            )
+            conn.execute("CREATE TABLE IF NOT EXISTS otp_sends (mobile TEXT NOT NULL, sent_at REAL NOT NULL)")
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_otp_sends_mobile ON otp_sends (mobile, sent_at)")
+
+    def _connect(self):
+        # One connection per thread; requests run on the threadpool
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0, isolation_level=None)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def issue(self, mobile):
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM otp_sends WHERE sent_at < ?", (now - 3600,))
+            conn.execute("DELETE FROM otps WHERE expires_at < ?", (now,))
+            sent = [t for (t,) in conn.execute(
+                "SELECT sent_at FROM otp_sends WHERE mobile = ? ORDER BY sent_at", (mobile,))]
+            if sent and now - sent[-1] < self.resend_interval:
+                raise RateLimited(self.resend_interval - (now - sent[-1]))
+            if len(sent) >= self.max_per_hour:
+                raise RateLimited(sent[-self.max_per_hour] + 3600 - now)
+            otp = generate_otp()
+            conn.execute(
+                "INSERT OR REPLACE INTO otps (mobile, code_hash, expires_at, attempts) VALUES (?, ?, ?, 0)",
+                (mobile, _hash(mobile, otp), now + self.ttl),
+            )
+            conn.execute("INSERT INTO otp_sends (mobile, sent_at) VALUES (?, ?)", (mobile, now))
+            conn.execute("COMMIT")
+            return otp
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def verify(self, mobile, otp):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT code_hash, expires_at, attempts FROM otps WHERE mobile = ?", (mobile,)
+            ).fetchone()
+            ok = False
+            if row is not None:
+                code_hash, expires_at, attempts = row
+                if expires_at < time.time() or attempts >= self.max_attempts:
+                    conn.execute("DELETE FROM otps WHERE mobile = ?", (mobile,))
+                elif hmac.compare_digest(code_hash, _hash(mobile, otp)):
+                    conn.execute("DELETE FROM otps WHERE mobile = ?", (mobile,))
+                    ok = True
+                else:
+                    conn.execute("UPDATE otps SET attempts = attempts + 1 WHERE mobile = ?", (mobile,))
+            conn.execute("COMMIT")
+            return ok
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+
+class RedisOTPStore(OTPStore):
+    """Any Redis-protocol server; expiry is left to Redis TTLs."""
+
+    # Compare-and-consume in one round trip so concurrent guesses can't race
+    VERIFY_SCRIPT = """
+    local code = redis.call('HGET', KEYS[1], 'code')
+    if not code then return 0 end
+    if tonumber(redis.call('HGET', KEYS[1], 'attempts')) >= tonumber(ARGV[2]) then
+        redis.call('DEL', KEYS[1])
+        return 0
+    end
+    if code == ARGV[1] then
+        redis.call('DEL', KEYS[1])
+        return 1
+    end
+    redis.call('HINCRBY', KEYS[1], 'attempts', 1)
+    return 0
+    """
+
+    def __init__(self, url=OTP_STORE_URL, **kwargs):
+        import redis  # only needed for OTP_STORE_URL=redis://...
+        super().__init__(**kwargs)
+        self.client = redis.Redis.from_url(url)
+        self._verify = self.client.register_script(self.VERIFY_SCRIPT)
+
+    def issue(self, mobile):
+        now = time.time()
+        sends = f"otp:sends:{mobile}"
+        # Resend interval: a key that only exists for resend_interval seconds
+        if not self.client.set(f"otp:recent:{mobile}", 1, nx=True, ex=self.resend_interval):
+            raise RateLimited(self.client.ttl(f"otp:recent:{mobile}"))
+        pipe = self.client.pipeline()
+        pipe.zremrangebyscore(sends, 0, now - 3600)
+        pipe.zrange(sends, 0, 0, withscores=True)
+        pipe.zcard(sends)
+        _, oldest, count = pipe.execute()
+        if count >= self.max_per_hour:
+            raise RateLimited(oldest[0][1] + 3600 - now)
+
+        otp = generate_otp()
+        pipe = self.client.pipeline()
+        pipe.zadd(sends, {f"{now}": now})
+        pipe.expire(sends, 3600)
+        pipe.delete(f"otp:code:{mobile}")
+        pipe.hset(f"otp:code:{mobile}", mapping={"code": _hash(mobile, otp), "attempts": 0})
+        pipe.expire(f"otp:code:{mobile}", self.ttl)
+        pipe.execute()
+        return otp
+
+    def verify(self, mobile, otp):
+        return bool(self._verify(keys=[f"otp:code:{mobile}"], args=[_hash(mobile, otp), self.max_attempts]))
+
+
+def get_otp_store():
+    if OTP_STORE_URL.startswith(("redis://", "rediss://", "unix://")):
+        return RedisOTPStore()
+    return SQLiteOTPStore()
@@ -0,0 +1,151 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+from collections import OrderedDict
+
+from observability import get_logger
+
+log = get_logger("prediction_cache")
+
+PREDICTION_CACHE_SIZE = int(os.environ.get("PREDICTION_CACHE_SIZE", "10000"))
+# Optional persistent tier, e.g. PREDICTION_CACHE_DB=./prediction_cache.db
+PREDICTION_CACHE_DB = os.environ.get("PREDICTION_CACHE_DB", "")
+VERSION_CHECK_INTERVAL = 2.0  # seconds between stat() calls on the model files
+
+
+def image_digest(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+class PredictionCache:
+    """Top-k predictions keyed by image hash + model version.
+
+    The model version is derived from the size/mtime of the model and class
+    files, so retraining or swapping either one makes every old entry miss.
+    version_files may be a callable, for a model that is hot-swapped to a
+    different directory.
+    """
+
+    def __init__(self, version_files, max_entries=PREDICTION_CACHE_SIZE, db_path=PREDICTION_CACHE_DB):
+        self.version_files = version_files if callable(version_files) else list(version_files)
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.disk_hits = 0
+        self.invalidations = 0
+        self._version = None
+        self._version_checked = 0.0
+
+        self.db = None
+        if db_path:
+            self.db = sqlite3.connect(db_path, check_same_thread=False)
+            self.db.execute("PRAGMA journal_mode=WAL")
+            self.db.execute("PRAGMA synchronous=NORMAL")
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS predictions (key TEXT PRIMARY KEY, results TEXT NOT NULL)"
+            )
+            self.db.commit()
+
+    def model_version(self):
+        now = time.monotonic()
+        if self._version is None or now - self._version_checked > VERSION_CHECK_INTERVAL:
+            h = hashlib.sha256()
+            paths = self.version_files() if callable(self.version_files) else self.version_files
+            for path in paths:
+                try:
+                    st = os.stat(path)
+                    h.update(f"{path}:{st.st_size}:{st.st_mtime_ns};".encode())
+                except OSError:
+                    h.update(f"{path}:missing;".encode())
+            version = h.hexdigest()[:16]
+            if self._version is not None and version != self._version:
+                log.info("Model files changed, invalidating prediction cache",
+                         extra={"old_version": self._version, "new_version": version})
+                self.clear()
+            self._version = version
+            self._version_checked = now
+        return self._version
+
+    def key(self, digest):
+        return f"{self.model_version()}:{digest}"
+
+    def get_memory(self, digest):
+        # Memory tier only - no stat() or SQLite, so it is safe on the event loop.
+        # None on a miss and while the model-version check is due; get() decides those
+        version = self._version
+        if version is None or time.monotonic() - self._version_checked > VERSION_CHECK_INTERVAL:
+            return None
+        key = f"{version}:{digest}"
+        with self.lock:
+            results = self.entries.get(key)
+            if results is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+            return results
+
+    def get(self, digest):
+        key = self.key(digest)
+        with self.lock:
+            results = self.entries.get(key)
+            if results is not None:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return results
+
+            if self.db is not None:
+                row = self.db.execute("SELECT results FROM predictions WHERE key = ?", (key,)).fetchone()
+                if row is not None:
+                    results = json.loads(row[0])
+                    self._remember(key, results)
+                    self.hits += 1
+                    self.disk_hits += 1
+                    return results
+
+            self.misses += 1
+            return None
+
+    def put(self, digest, results):
+        if getattr(results, "mock", False):
+            return  # made up without the model; the next upload should get a real answer
+        key = self.key(digest)
+        with self.lock:
+            self._remember(key, results)
+            if self.db is not None:
+                self.db.execute(
+                    "INSERT OR REPLACE INTO predictions (key, results) VALUES (?, ?)",
+                    (key, json.dumps(results)),
+                )
+                self.db.commit()
+
+    def _remember(self, key, results):
+        self.entries[key] = results
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.invalidations += 1
+            if self.db is not None:
+                self.db.execute("DELETE FROM predictions")
+                self.db.commit()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "model_version": self._version,
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "disk_tier": self.db is not None,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "invalidations": self.invalidations,
+        }
@@ -0,0 +1,163 @@
+import os
+import time
+import random
+import asyncio
+
+from starlette.concurrency import run_in_threadpool
+
+from observability import get_logger, log_sampled
+
+log = get_logger("sms")
+
+# twilio = real SMS via Twilio; stub = log and keep messages in memory (dev, tests).
+# Default: twilio when credentials are set, stub otherwise
+TWILIO_ACCOUNT_SID = os.environ.get("TWILIO_ACCOUNT_SID", "")
+TWILIO_AUTH_TOKEN = os.environ.get("TWILIO_AUTH_TOKEN", "")
+TWILIO_PHONE_NUMBER = os.environ.get("TWILIO_PHONE_NUMBER", "")
+SMS_PROVIDER = os.environ.get("SMS_PROVIDER", "twilio" if TWILIO_ACCOUNT_SID and TWILIO_AUTH_TOKEN else "stub")
+SMS_WORKERS = int(os.environ.get("SMS_WORKERS", "4"))  # concurrent gateway calls
+SMS_MAX_RETRIES = int(os.environ.get("SMS_MAX_RETRIES", "3"))
+SMS_RETRY_BASE_SECONDS = float(os.environ.get("SMS_RETRY_BASE_SECONDS", "0.5"))
+SMS_TIMEOUT_SECONDS = float(os.environ.get("SMS_TIMEOUT_SECONDS", "10"))
+SMS_QUEUE_SIZE = 1000
+
+
+class PermanentSMSError(Exception):
+    # The gateway rejected the message itself (bad number, ...); retrying won't help
+    pass
+
+
+class StubSMSProvider:
+    def __init__(self, max_kept=100):
+        self.sent = []
+        self.max_kept = max_kept
+
+    def send(self, to_number, body):
+        log.info(f"[sms stub] {body}", extra={"to": to_number})
+        self.sent = self.sent[-(self.max_kept - 1):] + [(to_number, body)]
+        return f"stub-{len(self.sent)}"
+
+
+class TwilioSMSProvider:
+    """One Twilio client for the whole process, over a pooled keep-alive HTTP session."""
+
+    def __init__(self, account_sid=TWILIO_ACCOUNT_SID, auth_token=TWILIO_AUTH_TOKEN,
+                 from_number=TWILIO_PHONE_NUMBER, timeout=SMS_TIMEOUT_SECONDS):
+        from twilio.rest import Client  # only needed for SMS_PROVIDER=twilio
+        from twilio.http.http_client import TwilioHttpClient
+        self.from_number = from_number
+        self.client = Client(account_sid, auth_token,
+                             http_client=TwilioHttpClient(pool_connections=True, timeout=timeout))
+
+    def send(self, to_number, body):
+        from twilio.base.exceptions import TwilioRestException
+        try:
+            return self.client.messages.create(body=body, from_=self.from_number, to=to_number).sid
+        except TwilioRestException as e:
+            # 429 and 5xx are worth retrying, other 4xx are not
+            if e.status != 429 and e.status < 500:
+                raise PermanentSMSError(str(e)) from e
+            raise
+
+
+def get_sms_provider():
+    if SMS_PROVIDER == "twilio":
+        try:
+            return TwilioSMSProvider()
+        except ImportError:
+            log.warning("twilio is not installed, SMS will only be logged (SMS_PROVIDER=stub)")
+    return StubSMSProvider()
+
+
+class SMSQueue:
+    """Sends SMS in the background so /auth/login never waits on the gateway.
+
+    submit() only enqueues; `workers` tasks send through the provider in the
+    threadpool, retrying transient failures with exponential backoff + jitter.
+    """
+
+    def __init__(self, provider=None, workers=SMS_WORKERS, max_retries=SMS_MAX_RETRIES,
+                 retry_base=SMS_RETRY_BASE_SECONDS, max_pending=SMS_QUEUE_SIZE):
+        self.provider = provider
+        self.workers = max(1, workers)
+        self.max_retries = max_retries
+        self.retry_base = retry_base
+        self.max_pending = max_pending
+        self.queue = None
+        self._tasks = []
+
+        # Metrics
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+        self.dropped = 0
+        self.send_seconds = 0.0
+
+    def start(self):
+        if not self._tasks:
+            if self.provider is None:
+                self.provider = get_sms_provider()
+            self.queue = asyncio.Queue(maxsize=self.max_pending)
+            self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+
+    async def stop(self, timeout=10.0):
+        # Give queued messages a chance to go out, then cancel
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout)
+        except asyncio.TimeoutError:
+            log.warning("SMS queue stopped with messages unsent", extra={"unsent": self.queue.qsize()})
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, to_number, body):
+        # False if the queue is full; never blocks
+        self.start()
+        try:
+            self.queue.put_nowait((to_number, body))
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+
+    def stats(self):
+        return {
+            "provider": type(self.provider).__name__ if self.provider else None,
+            "pending": self.queue.qsize() if self.queue else 0,
+            "sent": self.sent,
+            "failed": self.failed,
+            "retried": self.retried,
+            "dropped": self.dropped,
+            "avg_send_ms": round(self.send_seconds / self.sent * 1000, 1) if self.sent else None,
+        }
+
+    async def _run(self):
+        while True:
+            to_number, body = await self.queue.get()
+            try:
+                await self._send(to_number, body)
+            finally:
+                self.queue.task_done()
+
+    async def _send(self, to_number, body):
+        for attempt in range(self.max_retries + 1):
+            started = time.perf_counter()
+            try:
+                sid = await run_in_threadpool(self.provider.send, to_number, body)
+                self.sent += 1
+                self.send_seconds += time.perf_counter() - started
+                log_sampled(log, "SMS sent", sid=sid)
+                return
+            except PermanentSMSError as e:
+                log.warning("SMS rejected by the gateway", extra={"to": to_number, "error": str(e)})
+                break
+            except Exception as e:
+                if attempt == self.max_retries:
+                    log.error("Failed to send SMS", extra={"to": to_number, "attempts": attempt + 1, "error": str(e)})
+                    break
+                self.retried += 1
+                await asyncio.sleep(self.retry_base * 2 ** attempt * (0.5 + random.random()))
+        self.failed += 1
@@ -0,0 +1,328 @@
+import os
+import time
+import shutil
+import hashlib
+import tempfile
+
+# Uploads are stored once per distinct content, named by their sha256:
+#   key  = "<sha256>.<ext>"
+#   disk = BLOB_DIR/<2 hex>/<2 hex>/<key>
+# Scan.image_url / User.profile_picture hold "/blobs/<key>"
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "disk")  # disk or s3
+BLOB_DIR = os.environ.get("BLOB_DIR", os.path.join("uploads", "blobs"))
+# S3-compatible object store (AWS, MinIO, ...), only used with STORAGE_BACKEND=s3
+S3_ENDPOINT_URL = os.environ.get("S3_ENDPOINT_URL", "")  # e.g. http://localhost:9000 for MinIO
+S3_BUCKET = os.environ.get("S3_BUCKET", "cattle-sense")
+S3_ACCESS_KEY_ID = os.environ.get("S3_ACCESS_KEY_ID", "")
+S3_SECRET_ACCESS_KEY = os.environ.get("S3_SECRET_ACCESS_KEY", "")
+# Local read-through copy of S3 blobs, for inference and thumbnailing
+S3_CACHE_DIR = os.environ.get("S3_CACHE_DIR", os.path.join("uploads", "blob_cache"))
+
+BLOB_URL_PREFIX = "/blobs/"
+EXTENSIONS = {"jpeg": "jpg", "png": "png", "webp": "webp", "gif": "gif", "bmp": "bmp", "heif": "heic"}
+
+
+def blob_key(digest, kind):
+    return f"{digest}.{EXTENSIONS.get(kind, 'bin')}"
+
+
+def blob_url(key):
+    return BLOB_URL_PREFIX + key
+
+
+def key_from_url(url):
+    # The blob key referenced by an image_url / profile_picture, or None
+    if url and url.startswith(BLOB_URL_PREFIX):
+        return url[len(BLOB_URL_PREFIX):]
+    return None
+
+
+def is_valid_key(key):
+    digest, _, ext = key.partition(".")
+    return len(digest) == 64 and all(c in "0123456789abcdef" for c in digest) and ext.isalnum()
+
+
+def _sharded_path(root, key):
+    return os.path.join(root, key[:2], key[2:4], key)
+
+
+class BlobStore:
+    """Where uploaded images live. Subclasses implement the storage calls.
+
+    tmp_dir is where uploads are streamed before put_file(); it is on the same
+    filesystem as the store's local files so put_file() can rename, not copy.
+    """
+
+    tmp_dir = None
+
+    def put_file(self, tmp_path, key):
+        # Moves tmp_path into the store under key. If key already exists tmp_path is
+        # removed and the blob's modified time refreshed, so collect_garbage() sees it as new
+        raise NotImplementedError
+
+    def put_bytes(self, data, key):
+        # Same as put_file() for content already in memory
+        os.makedirs(self.tmp_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            self.put_file(tmp_path, key)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def exists(self, key):
+        raise NotImplementedError
+
+    def local_path(self, key):
+        # A readable local file with the blob's content (for inference, thumbnails, serving)
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def last_modified(self, key):
+        # Epoch seconds, or None if the blob is gone
+        raise NotImplementedError
+
+    def iter_blobs(self):
+        # Yields (key, last_modified_epoch) for every stored blob
+        raise NotImplementedError
+
+
+class DiskBlobStore(BlobStore):
+    def __init__(self, root=BLOB_DIR):
+        self.root = root
+        self.tmp_dir = os.path.join(root, "tmp")
+
+    def put_file(self, tmp_path, key):
+        path = _sharded_path(self.root, key)
+        if os.path.exists(path):
+            # Same content already stored; refresh it so GC sees it as new.
+            # GC may delete it in between - then store this copy after all
+            try:
+                os.utime(path)
+                os.remove(tmp_path)
+                return
+            except FileNotFoundError:
+                pass
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(tmp_path, path)
+
+    def exists(self, key):
+        return os.path.exists(_sharded_path(self.root, key))
+
+    def local_path(self, key):
+        return _sharded_path(self.root, key)
+
+    def delete(self, key):
+        try:
+            os.remove(_sharded_path(self.root, key))
+        except FileNotFoundError:
+            pass
+
+    def last_modified(self, key):
+        try:
+            return os.stat(_sharded_path(self.root, key)).st_mtime
+        except FileNotFoundError:
+            return None
+
+    def iter_blobs(self):
+        for dirpath, _, filenames in os.walk(self.root):
+            for name in filenames:
+                if is_valid_key(name):
+                    yield name, os.stat(os.path.join(dirpath, name)).st_mtime
+
+
+class S3BlobStore(BlobStore):
+    """S3-compatible bucket (MinIO works as a local stand-in), with a local cache."""
+
+    def __init__(self, bucket=S3_BUCKET, endpoint_url=S3_ENDPOINT_URL, cache_dir=S3_CACHE_DIR):
+        import boto3  # only needed for STORAGE_BACKEND=s3
+        self.bucket = bucket
+        self.cache_dir = cache_dir
+        self.tmp_dir = os.path.join(cache_dir, "tmp")
+        self.client = boto3.client(
+            "s3",
+            endpoint_url=endpoint_url or None,
+            aws_access_key_id=S3_ACCESS_KEY_ID or None,
+            aws_secret_access_key=S3_SECRET_ACCESS_KEY or None,
+        )
+
+    def put_file(self, tmp_path, key):
+        if self.exists(key):
+            # Copy onto itself: only way to refresh LastModified
+            self.client.copy_object(Bucket=self.bucket, Key=key, CopySource={"Bucket": self.bucket, "Key": key},
+                                    MetadataDirective="REPLACE")
+        else:
+            self.client.upload_file(tmp_path, self.bucket, key)
+        cached = _sharded_path(self.cache_dir, key)
+        os.makedirs(os.path.dirname(cached), exist_ok=True)
+        os.replace(tmp_path, cached)
+
+    def exists(self, key):
+        return self.last_modified(key) is not None
+
+    def last_modified(self, key):
+        from botocore.exceptions import ClientError
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=key)["LastModified"].timestamp()
+        except ClientError:
+            return None
+
+    def local_path(self, key):
+        cached = _sharded_path(self.cache_dir, key)
+        if not os.path.exists(cached):
+            os.makedirs(os.path.dirname(cached), exist_ok=True)
+            tmp_path = f"{cached}.{os.getpid()}.part"
+            self.client.download_file(self.bucket, key, tmp_path)
+            os.replace(tmp_path, cached)
+        return cached
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+        try:
+            os.remove(_sharded_path(self.cache_dir, key))
+        except FileNotFoundError:
+            pass
+
+    def iter_blobs(self):
+        for page in self.client.get_paginator("list_objects_v2").paginate(Bucket=self.bucket):
+            for obj in page.get("Contents", []):
+                if is_valid_key(obj["Key"]):
+                    yield obj["Key"], obj["LastModified"].timestamp()
+
+
+def get_blob_store():
+    if STORAGE_BACKEND == "s3":
+        return S3BlobStore()
+    return DiskBlobStore()
+
+
+blob_store = get_blob_store()
+
+
+# --- Maintenance (manage.py migrate-uploads / gc-uploads) ---
+
+def _store_existing_file(path, store):
+    from uploads import sniff_image_type, UPLOAD_CHUNK_SIZE
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        head = f.read(16)
+        digest.update(head)
+        for chunk in iter(lambda: f.read(UPLOAD_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    key = blob_key(digest.hexdigest(), sniff_image_type(head))
+    if not store.exists(key):
+        os.makedirs(store.tmp_dir, exist_ok=True)
+        tmp_path = os.path.join(store.tmp_dir, f"{key}.migrating")
+        shutil.copyfile(path, tmp_path)
+        store.put_file(tmp_path, key)
+    return key
+
+
+def migrate_uploads(uploads_dir="uploads", delete_originals=False, batch_size=1000, store=None):
+    """Moves legacy flat /uploads/<name> references into the blob store.
+
+    Each file is hashed and stored once, however many rows point at it; rows
+    are rewritten to /blobs/<key> in batches. Rows whose file is missing are
+    left alone and counted.
+    """
+    from database import SessionLocal, Scan, User
+    from thumbnails import delete_thumbnails
+    store = store or blob_store
+    keys = {}  # legacy filename -> blob key
+    missing = 0
+    updated = 0
+    started = time.perf_counter()
+
+    def key_for(url):
+        nonlocal missing
+        name = url[len("/uploads/"):]
+        if name not in keys:
+            path = os.path.join(uploads_dir, name)
+            if "/" in name or not os.path.isfile(path):
+                missing += 1
+                keys[name] = None
+            else:
+                keys[name] = _store_existing_file(path, store)
+        return keys[name]
+
+    with SessionLocal() as db:
+        for model, column in ((Scan, Scan.image_url), (User, User.profile_picture)):
+            last_id = 0
+            while True:
+                rows = (db.query(model).filter(column.like("/uploads/%"), model.id > last_id)
+                        .order_by(model.id).limit(batch_size).all())
+                if not rows:
+                    break
+                for row in rows:
+                    key = key_for(getattr(row, column.key))
+                    if key is not None:
+                        setattr(row, column.key, blob_url(key))
+                        updated += 1
+                last_id = rows[-1].id
+                db.commit()
+
+    if delete_originals:
+        for name, key in keys.items():
+            if key is not None:
+                try:
+                    os.remove(os.path.join(uploads_dir, name))
+                except FileNotFoundError:
+                    pass
+                delete_thumbnails(name)
+    print(f"Migrated {updated} references to {sum(1 for k in keys.values() if k)} blobs "
+          f"({missing} missing files) in {time.perf_counter() - started:.1f}s")
+    return updated
+
+
+def _still_in_use(store, key, cutoff):
+    # Re-uploaded (or referenced by a new row) since the referenced set was read
+    from database import SessionLocal, Scan, User
+    modified = store.last_modified(key)
+    if modified is None or modified > cutoff:
+        return True
+    url = blob_url(key)
+    with SessionLocal() as db:
+        return (db.query(Scan.id).filter(Scan.image_url == url).first() is not None
+                or db.query(User.id).filter(User.profile_picture == url).first() is not None)
+
+
+def collect_garbage(min_age_hours=24.0, dry_run=False, store=None):
+    """Deletes blobs no Scan or User row references (plus their thumbnails).
+
+    Blobs younger than min_age_hours are kept: a fresh blob can be briefly
+    unreferenced while its Scan row is group-committed. Re-uploading stored
+    content refreshes the blob's modified time, and each orphan is checked
+    again (age, then references) right before it is deleted, because the
+    referenced set is read before the store is walked.
+    """
+    from database import SessionLocal, Scan, User
+    from thumbnails import delete_thumbnails
+    store = store or blob_store
+    referenced = set()
+    with SessionLocal() as db:
+        for (url,) in db.query(Scan.image_url).filter(Scan.image_url.like(BLOB_URL_PREFIX + "%")).yield_per(10000):
+            referenced.add(key_from_url(url))
+        for (url,) in db.query(User.profile_picture).filter(User.profile_picture.like(BLOB_URL_PREFIX + "%")):
+            referenced.add(key_from_url(url))
+
+    cutoff = time.time() - min_age_hours * 3600
+    total = orphans = 0
+    for key, modified in store.iter_blobs():
+        total += 1
+        if key in referenced or modified > cutoff:
+            continue
+        if not dry_run and _still_in_use(store, key, cutoff):
+            continue
+        orphans += 1
+        if dry_run:
+            print(f"Would delete orphan blob {key}")
+            continue
+        store.delete(key)
+        delete_thumbnails(key)
+    verb = "Would delete" if dry_run else "Deleted"
+    print(f"{verb} {orphans} of {total} blobs ({len(referenced)} referenced)")
+    return orphans
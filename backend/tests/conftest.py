@@ -0,0 +1,13 @@
+import os
+import sys
+import tempfile
+
+# Module-level settings are read at import time: point every store at a
+# scratch directory before any test imports the backend
+_scratch = tempfile.mkdtemp(prefix="cattlesense-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_scratch, 'test.db')}"
+os.environ["OTP_DB_PATH"] = os.path.join(_scratch, "otp.db")
+os.environ["BLOB_DIR"] = os.path.join(_scratch, "blobs")
+os.environ["EMBEDDING_DIR"] = os.path.join(_scratch, "embeddings")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,44 @@
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from batching import MicroBatcher
+
+
+def test_stop_flushes_partly_collected_batch():
+    # stop() cancels the worker mid-collect; the slot it held must come back
+    # or the leftover flush waits for it forever
+    processed = []
+
+    async def write(items):
+        processed.extend(items)
+        return items
+
+    async def main():
+        batcher = MicroBatcher(write, max_batch_size=8, max_wait_ms=10_000, concurrency=1)
+        pending = asyncio.ensure_future(batcher.submit("scan"))
+        await asyncio.sleep(0.05)
+        assert batcher._collecting
+        await asyncio.wait_for(batcher.stop(), timeout=2)
+        assert await pending == "scan"
+
+    asyncio.run(main())
+    assert processed == ["scan"]
+
+
+def test_short_result_list_fails_every_caller():
+    async def write(items):
+        return items[:-1]
+
+    async def main():
+        batcher = MicroBatcher(write, max_batch_size=4, max_wait_ms=20)
+        outcomes = await asyncio.wait_for(
+            asyncio.gather(*(batcher.submit(i) for i in range(3)), return_exceptions=True), timeout=2)
+        await batcher.stop()
+        return outcomes
+
+    outcomes = asyncio.run(main())
+    assert len(outcomes) == 3
+    assert all(isinstance(outcome, RuntimeError) for outcome in outcomes)
@@ -0,0 +1,53 @@
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "ml_pipeline", "src")))
+
+from clean_data import find_duplicates
+
+
+def flip(bits, positions):
+    for p in positions:
+        bits ^= 1 << p
+    return bits
+
+
+def brute_force_near(rows, max_distance):
+    pairs = set()
+    for a in range(len(rows)):
+        for b in range(a + 1, len(rows)):
+            if rows[a][2] != rows[b][2] and bin(rows[a][3] ^ rows[b][3]).count("1") <= max_distance:
+                pairs.add(frozenset((rows[a][0], rows[b][0])))
+    return pairs
+
+
+def test_banding_finds_every_pair_within_distance():
+    rng = random.Random(0)
+    rows = []
+    for i in range(300):
+        ph = rng.getrandbits(64)
+        rows.append((f"img{i}.jpg", "Gir", f"sha{i}", ph))
+        # Near copies at every distance up to one past the limit, bits spread over all bands
+        distance = i % 6
+        rows.append((f"img{i}-near.jpg", "Sahiwal", f"sha{i}-near", flip(ph, rng.sample(range(64), distance))))
+
+    _, near = find_duplicates(rows, max_distance=4)
+    found = {frozenset(pair["files"]) for pair in near}
+    assert found == brute_force_near(rows, 4)
+    assert len(near) == len(found)  # a pair sharing several bands is reported once
+    assert all(pair["distance"] <= 4 and pair["cross_breed"] for pair in near if "-near" in pair["files"][1])
+
+
+def test_exact_duplicates_group_by_content_hash():
+    rows = [
+        ("a.jpg", "Gir", "same", 1),
+        ("b.jpg", "Gir", "same", 1),
+        ("c.jpg", "Murrah", "same", 1),
+        ("d.jpg", "Gir", "other", 1),
+    ]
+    exact, near = find_duplicates(rows, max_distance=4)
+    assert exact == [{"files": ["a.jpg", "b.jpg", "c.jpg"], "cross_breed": True}]
+    # Identical content isn't reported again as a near duplicate
+    assert {frozenset(pair["files"]) for pair in near} == {
+        frozenset(("a.jpg", "d.jpg")), frozenset(("b.jpg", "d.jpg")), frozenset(("c.jpg", "d.jpg"))}
@@ -0,0 +1,67 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+
+from database import Base, ScanCount, Scan, SessionLocal, async_engine, commit_scans, engine, rebuild_scan_stats
+
+
+@pytest.fixture(autouse=True)
+def fresh_tables():
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+
+
+def counts():
+    with SessionLocal() as db:
+        return {(r.user_mobile, r.kind, r.key): r.count for r in db.query(ScanCount)}
+
+
+def commit(*scans):
+    async def main():
+        await commit_scans(list(scans))
+        await async_engine.dispose()
+    asyncio.run(main())
+
+
+def scan(mobile, breed, confidence, month):
+    return Scan(user_mobile=mobile, breed=breed, confidence=confidence, timestamp=datetime(2026, month, 3))
+
+
+def test_commit_bumps_every_counter_once_per_scan():
+    commit(scan("1", "Gir", "0.91", 9), scan("1", "Gir", "0.42", 10), scan("2", "Murrah", "0.5", 10))
+    assert counts() == {
+        ("1", "total", ""): 2,
+        ("1", "breed", "Gir"): 2,
+        ("1", "confidence", "9"): 1,
+        ("1", "confidence", "4"): 1,
+        ("1", "month", "2026-09"): 1,
+        ("1", "month", "2026-10"): 1,
+        ("2", "total", ""): 1,
+        ("2", "breed", "Murrah"): 1,
+        ("2", "confidence", "5"): 1,
+        ("2", "month", "2026-10"): 1,
+    }
+
+    # A second commit upserts into the existing rows
+    commit(scan("1", "Gir", "0.95", 10))
+    after = counts()
+    assert after[("1", "total", "")] == 3
+    assert after[("1", "breed", "Gir")] == 3
+    assert after[("1", "confidence", "9")] == 2
+    assert after[("1", "month", "2026-10")] == 2
+    assert len(after) == 10
+
+
+def test_rebuild_matches_incremental_counts():
+    commit(scan("1", "Gir", "0.91", 9), scan("1", "Sahiwal", "not a number", 10), scan("2", "Murrah", "1.0", 10))
+    incremental = counts()
+    assert incremental[("1", "confidence", "0")] == 1  # unparsable confidence lands in bucket 0
+    assert incremental[("2", "confidence", "9")] == 1  # 1.0 is clamped into the top bucket
+
+    with SessionLocal() as db:
+        db.query(ScanCount).filter(ScanCount.user_mobile == "1").delete()
+        db.add(ScanCount(user_mobile="3", kind="total", key="", count=7))  # stale row
+        db.commit()
+    rebuild_scan_stats(batch_size=2)
+    assert counts() == incremental
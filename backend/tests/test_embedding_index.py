@@ -0,0 +1,41 @@
+import numpy as np
+
+from embedding_index import EmbeddingIndex
+
+
+def build(tmp_path, vectors, train_size):
+    index = EmbeddingIndex(str(tmp_path / "index"), dim=vectors.shape[1], train_size=train_size, nprobe=8, rerank=8)
+    for i, vector in enumerate(vectors):
+        index.link(index.add(vector), i + 1)
+    if index._training is not None:
+        index._training.join()
+    return index
+
+
+def test_rows_restrict_the_exact_search(tmp_path):
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(50, 128)).astype(np.float32)
+    index = build(tmp_path, vectors, train_size=1000)
+    query = vectors[0]
+
+    assert index.search(query, k=1)[0][0] == 1
+    mine = [10, 20, 30]
+    hits = index.search(query, k=5, rows=mine)
+    assert sorted(scan_id for scan_id, _ in hits) == [11, 21, 31]
+    assert index.search(query, k=5, rows=mine, exclude_scan=21)[0][0] != 21
+
+
+def test_rows_are_filtered_before_the_ann_rerank(tmp_path):
+    # Many other scans sit right next to the query; a user's own scans must
+    # still come back even though they'd never make the global top rerank
+    rng = np.random.default_rng(1)
+    query = rng.normal(size=128).astype(np.float32)
+    crowd = query + rng.normal(scale=0.01, size=(400, 128)).astype(np.float32)
+    mine = query + rng.normal(scale=0.5, size=(5, 128)).astype(np.float32)
+    index = build(tmp_path, np.concatenate([crowd, mine]), train_size=100)
+    assert index._ann is not None
+
+    own_rows = list(range(400, 405))
+    index.train_size = 2  # force the ANN path for the filtered search too
+    hits = index.search(query, k=3, rows=own_rows)
+    assert hits and all(scan_id > 400 for scan_id, _ in hits)
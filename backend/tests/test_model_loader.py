@@ -0,0 +1,109 @@
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import model_loader
+from model_loader import ModelLoader
+from model_registry import activate_version, read_registry, register_version, rollback
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+
+def test_activate_and_rollback(tmp_path):
+    path = str(tmp_path / "registry.json")
+    register_version("v1", activate=True, path=path)
+    register_version("v2", candidate=True, shadow_fraction=0.1, path=path)
+
+    registry = activate_version("v2", path=path)
+    assert registry["active"] == "v2"
+    assert registry["previous"] == "v1"
+    assert registry["candidate"] is None  # promoted, no longer shadowing itself
+
+    assert rollback(path=path)["active"] == "v1"
+    assert read_registry(path)["previous"] == "v2"
+    assert rollback(path=path)["active"] == "v2"
+
+
+def test_activate_unknown_version(tmp_path):
+    path = str(tmp_path / "registry.json")
+    register_version("v1", activate=True, path=path)
+    try:
+        activate_version("v9", path=path)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("activated an unregistered version")
+    assert read_registry(path)["active"] == "v1"
+
+
+def fake_loads(monkeypatch, failures):
+    # _load_version fails for every version in `failures`, which the test can edit
+    calls = []
+
+    def load_version(self, version, model_dir):
+        calls.append(version)
+        if version in failures:
+            raise RuntimeError(f"broken {version}")
+        return version, object(), None
+
+    monkeypatch.setattr(ModelLoader, "_load_version", load_version)
+    monkeypatch.setattr(ModelLoader, "_update_shadow", lambda self: None)
+    monkeypatch.setattr(model_loader, "_has_model", lambda model_dir: True)
+    return calls
+
+
+def touch(path):
+    # Some filesystems have coarse mtimes; make sure the registry watch sees a change
+    stat = os.stat(path)
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def test_failed_first_load_is_retried_on_registry_change(tmp_path, monkeypatch):
+    path = str(tmp_path / "registry.json")
+    register_version("v1", activate=True, path=path)
+    failures = {"v1"}
+    calls = fake_loads(monkeypatch, failures)
+
+    loader = ModelLoader(registry_path=path, poll_seconds=0.01)
+    loader.start()
+    try:
+        assert wait_until(lambda: loader.status == "failed")
+        failures.clear()
+        touch(path)
+        assert wait_until(lambda: loader.ready)
+        assert loader.version == "v1"
+        assert loader.error is None
+        assert calls == ["v1", "v1"]
+    finally:
+        loader.stop()
+
+
+def test_failed_swap_is_retried_on_registry_change(tmp_path, monkeypatch):
+    path = str(tmp_path / "registry.json")
+    register_version("v1", activate=True, path=path)
+    failures = {"v2"}
+    calls = fake_loads(monkeypatch, failures)
+
+    loader = ModelLoader(registry_path=path, poll_seconds=0.01)
+    loader.start()
+    try:
+        assert wait_until(lambda: loader.ready)
+        register_version("v2", activate=True, path=path)
+        touch(path)
+        assert wait_until(lambda: calls.count("v2") == 1)
+        assert loader.version == "v1"  # still serving the old one
+
+        # Same version, fixed files: the next registry write retries it
+        failures.clear()
+        touch(path)
+        assert wait_until(lambda: loader.version == "v2")
+        assert loader.swaps == 1
+    finally:
+        loader.stop()
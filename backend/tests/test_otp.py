@@ -0,0 +1,91 @@
+import threading
+
+import pytest
+
+import otp
+from otp import RateLimited, SQLiteOTPStore
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(otp.time, "time", clock)
+    return clock
+
+
+def store(tmp_path, **kwargs):
+    kwargs = dict(dict(ttl=300, max_attempts=3, resend_interval=30, max_per_hour=3), **kwargs)
+    return SQLiteOTPStore(str(tmp_path / "otp.db"), **kwargs)
+
+
+def test_code_is_consumed_on_success(tmp_path, clock):
+    s = store(tmp_path)
+    code = s.issue("1")
+    assert not s.verify("2", code)  # bound to the mobile it was sent to
+    assert s.verify("1", code)
+    assert not s.verify("1", code)
+
+
+def test_code_expires_after_ttl(tmp_path, clock):
+    s = store(tmp_path)
+    code = s.issue("1")
+    clock.now += 301
+    assert not s.verify("1", code)
+
+
+def test_wrong_guesses_burn_the_code(tmp_path, clock):
+    s = store(tmp_path)
+    code = s.issue("1")
+    wrong = "0000" if code != "0000" else "1111"
+    for _ in range(3):
+        assert not s.verify("1", wrong)
+    assert not s.verify("1", code)
+
+
+def test_resend_interval_and_hourly_cap(tmp_path, clock):
+    s = store(tmp_path)
+    s.issue("1")
+    clock.now += 10
+    with pytest.raises(RateLimited) as e:
+        s.issue("1")
+    assert e.value.retry_after == 20
+    s.issue("2")  # limits are per mobile
+
+    clock.now += 20
+    s.issue("1")
+    clock.now += 30
+    s.issue("1")
+    clock.now += 30
+    with pytest.raises(RateLimited) as e:
+        s.issue("1")  # fourth code within the hour
+    assert e.value.retry_after == 3600 - 90
+
+    clock.now += 3600
+    s.issue("1")
+
+
+def test_concurrent_verify_succeeds_once(tmp_path, clock):
+    # Separate stores on one file stand in for separate API workers
+    code = store(tmp_path).issue("1")
+    stores = [store(tmp_path) for _ in range(8)]
+    results = []
+    barrier = threading.Barrier(len(stores))
+
+    def guess(s):
+        barrier.wait()
+        results.append(s.verify("1", code))
+
+    threads = [threading.Thread(target=guess, args=(s,)) for s in stores]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert sorted(results) == [False] * 7 + [True]
@@ -0,0 +1,61 @@
+from datetime import datetime, timedelta
+
+import pytest
+from fastapi.testclient import TestClient
+
+import main
+from database import Base, Scan, SessionLocal, engine
+
+
+@pytest.fixture
+def client():
+    Base.metadata.drop_all(bind=engine)
+    Base.metadata.create_all(bind=engine)
+    return TestClient(main.app)  # no lifespan: the history endpoints need no model
+
+
+def add_scans(mobile, timestamps):
+    with SessionLocal() as db:
+        scans = [Scan(user_mobile=mobile, breed="Gir", confidence="0.9", timestamp=ts) for ts in timestamps]
+        db.add_all(scans)
+        db.commit()
+        return [scan.id for scan in scans]
+
+
+def test_cursor_round_trip():
+    ts = datetime(2026, 10, 18, 9, 30, 15, 123456)
+    assert main.decode_scan_cursor(main.encode_scan_cursor(ts, 42)) == (ts, 42)
+
+
+def test_invalid_cursor_is_a_400(client):
+    assert client.get("/scans/1", params={"cursor": "not-a-cursor"}).status_code == 400
+
+
+def test_pages_cover_every_scan_once_with_tied_timestamps(client):
+    base = datetime(2026, 10, 1)
+    # Three scans share one timestamp, so the id has to break the tie across a page boundary
+    ids = add_scans("1", [base, base + timedelta(minutes=1)] + [base + timedelta(minutes=2)] * 3)
+    add_scans("2", [base + timedelta(minutes=5)])
+
+    seen = []
+    cursor = None
+    for _ in range(10):
+        params = {"limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        response = client.get("/scans/1", params=params)
+        assert response.status_code == 200
+        seen.extend(item["id"] for item in response.json())
+        cursor = response.headers.get("x-next-cursor")
+        if cursor is None:
+            break
+
+    # Newest first; within the same timestamp, highest id first
+    assert seen == [ids[4], ids[3], ids[2], ids[1], ids[0]]
+
+
+def test_last_full_page_has_no_cursor(client):
+    add_scans("1", [datetime(2026, 10, 1), datetime(2026, 10, 2)])
+    response = client.get("/scans/1", params={"limit": 2})
+    assert len(response.json()) == 2
+    assert "x-next-cursor" not in response.headers
@@ -0,0 +1,32 @@
+import os
+
+import storage
+from storage import DiskBlobStore
+
+
+def put(store, tmp_path, content, key):
+    source = tmp_path / f"upload-{len(os.listdir(tmp_path))}"
+    source.write_bytes(content)
+    store.put_file(str(source), key)
+    return source
+
+
+def test_reupload_survives_gc_deleting_the_blob(tmp_path, monkeypatch):
+    store = DiskBlobStore(str(tmp_path / "blobs"))
+    key = "ab" * 32 + ".jpg"
+    put(store, tmp_path, b"image", key)
+
+    # GC removes the blob between the exists() check and the mtime refresh
+    real_utime = os.utime
+
+    def utime_after_gc(path, *args, **kwargs):
+        store.delete(key)
+        return real_utime(path, *args, **kwargs)
+
+    monkeypatch.setattr(storage.os, "utime", utime_after_gc)
+    source = put(store, tmp_path, b"image", key)
+
+    assert store.exists(key)
+    assert not source.exists()
+    with open(store.local_path(key), "rb") as f:
+        assert f.read() == b"image"
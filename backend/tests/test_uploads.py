@@ -0,0 +1,49 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import uploads
+from uploads import UploadWriter
+
+
+class FlakyStore:
+    def __init__(self, failures=0):
+        self.failures = failures
+        self.blobs = {}
+
+    def put_bytes(self, data, key):
+        if self.failures:
+            self.failures -= 1
+            raise OSError("disk full")
+        self.blobs[key] = data
+
+    def local_path(self, key):
+        return f"/blobs/{key}"
+
+
+def test_budget_counts_reserved_and_queued_bytes():
+    writer = UploadWriter(max_bytes=100, store=FlakyStore())
+    assert writer.reserve(60)
+    assert not writer.reserve(60)  # would go over: caller streams to disk
+    writer.release(60)
+    assert writer.reserve(60)
+    assert writer.stats()["spilled_to_disk"] == 1
+
+
+def test_failed_write_is_retried_and_served_meanwhile(monkeypatch):
+    monkeypatch.setattr(uploads, "WRITE_RETRY_SECONDS", 0.01)
+    store = FlakyStore(failures=2)
+    stored = []
+    writer = UploadWriter(max_bytes=100, store=store, on_stored=lambda path, key: stored.append(key))
+    writer.submit(b"image", "abc.jpg")
+    assert writer.pending.get("abc.jpg") == b"image" or "abc.jpg" in store.blobs
+    writer.stop()
+
+    assert store.blobs == {"abc.jpg": b"image"}
+    assert stored == ["abc.jpg"]
+    assert writer.pending == {}
+    assert writer.held_bytes == 0
+    assert writer.stats()["write_errors"] == 2
+    assert writer.stats()["lost"] == 0
+
@@ -0,0 +1,144 @@
+import os
+import queue
+import tempfile
+import threading
+from urllib.parse import quote
+
+from PIL import Image, ImageOps, features
+
+from storage import key_from_url
+from observability import get_logger
+
+log = get_logger("thumbnails")
+
+UPLOADS_DIR = "uploads"
+THUMBS_DIR = os.path.join(UPLOADS_DIR, "thumbs")
+# Longest side in pixels: "sm" for history rows, "md" for detail views
+THUMBNAIL_SIZES = {"sm": 160, "md": 480}
+THUMBNAIL_FORMAT = "webp" if features.check("webp") else "jpeg"
+THUMBNAIL_QUALITY = 80
+THUMBNAIL_MAX_AGE = 365 * 24 * 3600  # a thumbnail never changes once written
+
+
+def thumbnail_name(source_name, size):
+    return f"{source_name}.{size}.{THUMBNAIL_FORMAT}"
+
+
+def source_name(thumb_name):
+    # Inverse of thumbnail_name(); None if it isn't one of ours
+    base, size, ext = (thumb_name.rsplit(".", 2) + ["", ""])[:3]
+    if size not in THUMBNAIL_SIZES or ext != THUMBNAIL_FORMAT or not base:
+        return None
+    return base
+
+
+def thumbnail_path(thumb_name):
+    # Sharded by the first two characters, like the blob store
+    return os.path.join(THUMBS_DIR, thumb_name[:2], thumb_name)
+
+
+def thumbnail_urls(image_url):
+    # {"sm": "/thumbs/...", "md": ...} for a stored upload, {} for anything else.
+    # The source is the blob key, or the file name for not yet migrated /uploads/ URLs
+    legacy_prefix = f"/{UPLOADS_DIR}/"
+    source = key_from_url(image_url)
+    if source is None and image_url and image_url.startswith(legacy_prefix):
+        source = image_url[len(legacy_prefix):]
+    if not source:
+        return {}
+    return {size: f"/thumbs/{quote(thumbnail_name(source, size))}" for size in THUMBNAIL_SIZES}
+
+
+def delete_thumbnails(source):
+    for size in THUMBNAIL_SIZES:
+        try:
+            os.remove(thumbnail_path(thumbnail_name(source, size)))
+        except FileNotFoundError:
+            pass
+
+
+def generate_thumbnails(source_path, source):
+    """Writes every THUMBNAIL_SIZES variant of source_path into THUMBS_DIR.
+
+    The source is decoded once (JPEG draft mode at roughly the largest size)
+    and each smaller variant is scaled down from the previous one.
+    """
+    # The worker, on-demand /thumbs fetches and repeat uploads can all get here for one source
+    if all(os.path.exists(thumbnail_path(thumbnail_name(source, size))) for size in THUMBNAIL_SIZES):
+        return
+    largest = max(THUMBNAIL_SIZES.values())
+    with Image.open(source_path) as img:
+        img.draft("RGB", (largest, largest))
+        img = ImageOps.exif_transpose(img)  # phone photos are often stored rotated
+        if img.mode != "RGB":
+            img = img.convert("RGB")
+        for size, side in sorted(THUMBNAIL_SIZES.items(), key=lambda kv: -kv[1]):
+            img.thumbnail((side, side), Image.LANCZOS)
+            path = thumbnail_path(thumbnail_name(source, size))
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Own temp file per writer, so concurrent writers never share or tear one
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".part")
+            try:
+                os.fchmod(fd, 0o644)  # mkstemp creates it owner-only
+                with os.fdopen(fd, "wb") as f:
+                    img.save(f, format=THUMBNAIL_FORMAT.upper(), quality=THUMBNAIL_QUALITY)
+                os.replace(tmp_path, path)
+            except BaseException:
+                try:
+                    os.remove(tmp_path)
+                except OSError:
+                    pass
+                raise
+
+
+class ThumbnailWorker:
+    """Generates thumbnails for newly stored uploads on a background thread."""
+
+    def __init__(self, max_pending=1024):
+        self.queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        self.generated = 0
+        self.failed = 0
+        self.dropped = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="thumbnails", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        # Finish what is queued before shutting down
+        if self._thread is not None:
+            self.queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, source_path, source):
+        # Never blocks a request: if the queue is full the thumbnail is made on first fetch instead
+        try:
+            self.queue.put_nowait((source_path, source))
+        except queue.Full:
+            self.dropped += 1
+
+    def stats(self):
+        return {
+            "pending": self.queue.qsize(),
+            "generated": self.generated,
+            "failed": self.failed,
+            "dropped": self.dropped,
+            "format": THUMBNAIL_FORMAT,
+            "sizes": THUMBNAIL_SIZES,
+        }
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                break
+            source_path, source = job
+            try:
+                generate_thumbnails(source_path, source)
+                self.generated += 1
+            except Exception as e:
+                self.failed += 1
+                log.warning("Thumbnail generation failed", extra={"source": source_path, "error": str(e)})
@@ -0,0 +1,262 @@
+import os
+import time
+import uuid
+import queue
+import hashlib
+import threading
+
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+
+from storage import blob_store, blob_key
+from observability import get_logger, observe_stage
+
+log = get_logger("uploads")
+
+# Largest accepted image, per file
+MAX_UPLOAD_BYTES = int(float(os.environ.get("MAX_UPLOAD_MB", "15")) * 1024 * 1024)
+UPLOAD_CHUNK_SIZE = 256 * 1024
+# Room for multipart boundaries and form fields on top of the file itself
+MULTIPART_OVERHEAD = 64 * 1024
+# Upload bytes /predict may hold in memory at once (being classified or waiting
+# for the background write); past it, uploads are streamed to disk instead
+UPLOAD_MEMORY_BYTES = int(float(os.environ.get("UPLOAD_MEMORY_MB", "256")) * 1024 * 1024)
+WRITE_RETRY_SECONDS = 0.5  # first backoff of a failed background write, doubled per attempt
+WRITE_RETRY_MAX_SECONDS = 30.0
+WRITE_ATTEMPTS_ON_STOP = 3  # tries per queued upload once shutdown has begun
+
+
+def sniff_image_type(head):
+    # Magic bytes, not the client's filename or Content-Type
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    if head[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif"
+    if head.startswith(b"BM"):
+        return "bmp"
+    if head[4:8] == b"ftyp" and head[8:12] in (b"heic", b"heix", b"mif1", b"msf1", b"avif"):
+        return "heif"
+    return None
+
+
+def too_large(max_bytes=MAX_UPLOAD_BYTES):
+    return HTTPException(status_code=413, detail=f"Image larger than {max_bytes // (1024 * 1024)} MB")
+
+
+async def read_upload(file, max_bytes=MAX_UPLOAD_BYTES):
+    """Reads an UploadFile into memory; returns (content, sha256 hex digest, image type).
+
+    Same checks as save_upload() - 415 on the first chunk for non-images, 413
+    as soon as max_bytes is crossed - but nothing touches the disk, so the
+    bytes can go straight to inference.
+    """
+    if file.size is not None and file.size > max_bytes:
+        raise too_large(max_bytes)
+    started = time.perf_counter()
+    chunk = await file.read(UPLOAD_CHUNK_SIZE)
+    kind = sniff_image_type(chunk[:16])
+    if kind is None:
+        raise HTTPException(status_code=415, detail="Not a supported image file")
+
+    digest = hashlib.sha256()
+    chunks = []
+    size = 0
+    while chunk:
+        size += len(chunk)
+        if size > max_bytes:
+            raise too_large(max_bytes)
+        digest.update(chunk)
+        chunks.append(chunk)
+        chunk = await file.read(UPLOAD_CHUNK_SIZE)
+    observe_stage("upload_read", time.perf_counter() - started)
+    return b"".join(chunks), digest.hexdigest(), kind
+
+
+def remove_quietly(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+async def save_upload(file, path, max_bytes=MAX_UPLOAD_BYTES):
+    """Streams an UploadFile to path chunk by chunk; returns (sha256 hex digest, image type).
+
+    Only one chunk is held in memory at a time and every disk operation runs in
+    the threadpool. Non-images (by magic bytes) are rejected with 415 before
+    anything is written, oversized files with 413 as soon as the limit is
+    crossed. The file appears at path only once it is complete.
+    """
+    if file.size is not None and file.size > max_bytes:
+        raise too_large(max_bytes)
+    read_seconds = write_seconds = 0.0
+    t = time.perf_counter()
+    chunk = await file.read(UPLOAD_CHUNK_SIZE)
+    read_seconds += time.perf_counter() - t
+    kind = sniff_image_type(chunk[:16])
+    if kind is None:
+        raise HTTPException(status_code=415, detail="Not a supported image file")
+
+    digest = hashlib.sha256()
+    size = 0
+    tmp_path = path + ".part"
+    f = await run_in_threadpool(open, tmp_path, "wb")
+    try:
+        while chunk:
+            size += len(chunk)
+            if size > max_bytes:
+                raise too_large(max_bytes)
+            digest.update(chunk)
+            t = time.perf_counter()
+            await run_in_threadpool(f.write, chunk)
+            write_seconds += time.perf_counter() - t
+            t = time.perf_counter()
+            chunk = await file.read(UPLOAD_CHUNK_SIZE)
+            read_seconds += time.perf_counter() - t
+        t = time.perf_counter()
+        await run_in_threadpool(f.close)
+        await run_in_threadpool(os.replace, tmp_path, path)  # never serve a half-written file
+        write_seconds += time.perf_counter() - t
+    except BaseException:
+        await run_in_threadpool(f.close)
+        await run_in_threadpool(remove_quietly, tmp_path)
+        raise
+    observe_stage("upload_read", read_seconds)
+    observe_stage("file_write", write_seconds)
+    return digest.hexdigest(), kind
+
+
+async def store_upload(file, max_bytes=MAX_UPLOAD_BYTES):
+    """Streams an upload into the blob store; returns (key, digest, local path).
+
+    Identical content maps to the same key, so retries and re-uploads are
+    stored once and two uploads can never overwrite each other.
+    """
+    await run_in_threadpool(os.makedirs, blob_store.tmp_dir, exist_ok=True)
+    tmp_path = os.path.join(blob_store.tmp_dir, uuid.uuid4().hex)
+    digest, kind = await save_upload(file, tmp_path, max_bytes)
+    key = blob_key(digest, kind)
+    try:
+        await run_in_threadpool(blob_store.put_file, tmp_path, key)
+    finally:
+        await run_in_threadpool(remove_quietly, tmp_path)
+    local_path = await run_in_threadpool(blob_store.local_path, key)
+    return key, digest, local_path
+
+
+class UploadWriter:
+    """Puts uploads that were read into memory into the blob store from a background thread.
+
+    Until its write lands a blob is served from `pending`, so its URL works as
+    soon as it is returned. on_stored(local_path, key) runs after each write
+    (thumbnails). Memory is bounded by bytes: a request reserve()s its upload's
+    size before reading it and release()s it when done, and queued content
+    counts until it is written. When the budget is used up reserve() says no
+    and the caller streams to disk instead. A failed write is retried with
+    backoff and its content stays in `pending` (and keeps being served) until
+    it succeeds - an upload that was answered is never dropped.
+    """
+
+    def __init__(self, max_bytes=UPLOAD_MEMORY_BYTES, on_stored=None, store=None):
+        self.max_bytes = max_bytes
+        self.queue = queue.Queue()  # bounded by max_bytes through reserve()
+        self.on_stored = on_stored
+        self.store = store or blob_store
+        self.pending = {}  # key -> content not yet written
+        self.held_bytes = 0
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self.written = 0
+        self.spilled = 0
+        self.write_errors = 0
+        self.lost = 0
+
+    def start(self):
+        if self._thread is None:
+            self._stopping.clear()
+            self._thread = threading.Thread(target=self._run, name="upload-writer", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        # Write everything still queued before shutting down
+        if self._thread is not None:
+            self._stopping.set()
+            self.queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def reserve(self, nbytes):
+        with self._lock:
+            if self.held_bytes + nbytes > self.max_bytes:
+                self.spilled += 1
+                return False
+            self.held_bytes += nbytes
+            return True
+
+    def release(self, nbytes):
+        with self._lock:
+            self.held_bytes -= nbytes
+
+    def submit(self, content, key):
+        self.start()
+        with self._lock:
+            if key in self.pending:
+                return  # same content already on its way
+            self.pending[key] = content
+            self.held_bytes += len(content)
+        self.queue.put((content, key))
+
+    def stats(self):
+        return {
+            "pending": len(self.pending),
+            "held_bytes": self.held_bytes,
+            "max_bytes": self.max_bytes,
+            "written": self.written,
+            "spilled_to_disk": self.spilled,
+            "write_errors": self.write_errors,
+            "lost": self.lost,
+        }
+
+    def _write(self, content, key):
+        attempt = 0
+        while True:
+            try:
+                self.store.put_bytes(content, key)
+                break
+            except Exception as e:
+                attempt += 1
+                self.write_errors += 1
+                if self._stopping.is_set() and attempt >= WRITE_ATTEMPTS_ON_STOP:
+                    self.lost += 1
+                    log.error("Upload could not be written before shutdown",
+                              extra={"key": key, "attempts": attempt, "error": str(e)})
+                    self._forget(content, key)
+                    return
+                delay = min(WRITE_RETRY_SECONDS * 2 ** (attempt - 1), WRITE_RETRY_MAX_SECONDS)
+                log.warning("Upload write failed, retrying",
+                            extra={"key": key, "attempts": attempt, "retry_in": delay, "error": str(e)})
+                self._stopping.wait(delay)
+        self.written += 1
+        self._forget(content, key)
+        if self.on_stored is not None:
+            try:
+                self.on_stored(self.store.local_path(key), key)
+            except Exception:
+                log.exception("Post-write hook failed", extra={"key": key})
+
+    def _forget(self, content, key):
+        with self._lock:
+            self.pending.pop(key, None)
+            self.held_bytes -= len(content)
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            if job is None:
+                break
+            self._write(*job)
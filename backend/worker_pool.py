@@ -0,0 +1,266 @@
+import os
+import sys
+import time
+import queue
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import numpy as np
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'ml_pipeline', 'src', 'models')))
+from breed_classifier import BreedClassifier, IMG_SIZE
+from inference_backends import EMBEDDING_DIM
+from observability import get_logger
+
+log = get_logger("inference")
+
+# Pool tunables - workers * threads should not exceed the physical core count
+INFERENCE_WORKERS = int(os.environ.get("INFERENCE_WORKERS", "0"))
+INFERENCE_THREADS_PER_WORKER = int(os.environ.get("INFERENCE_THREADS_PER_WORKER", "1"))
+WORKER_MAX_BATCH = 32
+WORKER_TIMEOUT = 60.0  # seconds before a silent worker is treated as hung
+
+
+def _worker_main(conn, in_name, out_name, max_batch, num_classes, num_threads, model_dir):
+    # Pin the math libraries before anything imports them
+    for var in ("OMP_NUM_THREADS", "MKL_NUM_THREADS", "OPENBLAS_NUM_THREADS", "TF_NUM_INTRAOP_THREADS"):
+        os.environ[var] = str(num_threads)
+    os.environ["TF_NUM_INTEROP_THREADS"] = "1"
+
+    classifier = BreedClassifier(num_threads=num_threads, model_dir=model_dir)
+    classifier.warm_up()
+    shm_in = shared_memory.SharedMemory(name=in_name)
+    shm_out = shared_memory.SharedMemory(name=out_name)
+    inputs = np.ndarray((max_batch, IMG_SIZE[1], IMG_SIZE[0], 3), dtype=np.float32, buffer=shm_in.buf)
+    # Each row: the probabilities, then the pooled embedding
+    outputs = np.ndarray((max_batch, num_classes + EMBEDDING_DIM), dtype=np.float32, buffer=shm_out.buf)
+    conn.send("ready")
+
+    try:
+        while True:
+            n = conn.recv()
+            if n is None:
+                break
+            try:
+                probs, embeddings = classifier.predict_outputs(inputs[:n])
+                if probs is None:
+                    conn.send("mock")
+                    continue
+                outputs[:n, :num_classes] = probs
+                if embeddings is None:
+                    conn.send("ok:probs")  # artifact exported without the embedding output
+                    continue
+                outputs[:n, num_classes:] = embeddings
+                conn.send("ok")
+            except Exception as e:
+                conn.send(f"error: {e}")
+    finally:
+        del inputs, outputs
+        shm_in.close()
+        shm_out.close()
+
+
+class _Worker:
+    """One inference process plus the shared-memory tensors it reads and writes."""
+
+    def __init__(self, ctx, index, max_batch, num_classes, num_threads, model_dir):
+        self.ctx = ctx
+        self.model_dir = model_dir
+        self.index = index
+        self.max_batch = max_batch
+        self.num_classes = num_classes
+        self.num_threads = num_threads
+        self.restarts = 0
+
+        in_size = max_batch * IMG_SIZE[0] * IMG_SIZE[1] * 3 * 4
+        out_size = max_batch * (num_classes + EMBEDDING_DIM) * 4
+        self.shm_in = shared_memory.SharedMemory(create=True, size=in_size)
+        self.shm_out = shared_memory.SharedMemory(create=True, size=out_size)
+        self.inputs = np.ndarray((max_batch, IMG_SIZE[1], IMG_SIZE[0], 3), dtype=np.float32, buffer=self.shm_in.buf)
+        self.outputs = np.ndarray((max_batch, num_classes + EMBEDDING_DIM), dtype=np.float32, buffer=self.shm_out.buf)
+        self.process = None
+        self.conn = None
+
+    def spawn(self):
+        parent_conn, child_conn = self.ctx.Pipe()
+        self.process = self.ctx.Process(
+            target=_worker_main,
+            args=(child_conn, self.shm_in.name, self.shm_out.name, self.max_batch, self.num_classes, self.num_threads,
+                  self.model_dir),
+            name=f"inference-worker-{self.index}",
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+
+    def wait_ready(self):
+        if not self.conn.poll(WORKER_TIMEOUT * 5):  # model load can be slow
+            raise RuntimeError(f"Worker {self.index} did not start")
+        self.conn.recv()
+
+    def restart(self):
+        log.warning("Restarting inference worker", extra={"worker": self.index})
+        self.restarts += 1
+        if self.process is not None and self.process.is_alive():
+            self.process.kill()
+        if self.process is not None:
+            self.process.join(timeout=5)
+        self.spawn()
+        self.wait_ready()
+
+    def run(self, n):
+        # Inputs are already in shared memory; only the batch size crosses the pipe
+        try:
+            self.conn.send(n)
+            waited = 0.0
+            while not self.conn.poll(0.5):
+                waited += 0.5
+                if not self.process.is_alive() or waited >= WORKER_TIMEOUT:
+                    raise EOFError("worker died")
+            return self.conn.recv()
+        except (EOFError, OSError, BrokenPipeError):
+            self.restart()
+            raise RuntimeError(f"Inference worker {self.index} crashed")
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except Exception:
+            pass
+        if self.process is not None:
+            self.process.join(timeout=5)
+            if self.process.is_alive():
+                self.process.kill()
+        del self.inputs, self.outputs
+        for shm in (self.shm_in, self.shm_out):
+            shm.close()
+            shm.unlink()
+
+
+class InferencePool:
+    """Fixed set of worker processes, each with its own model and thread budget.
+
+    predict_batch() is blocking and thread-safe: each call checks out an idle
+    worker, preprocesses straight into that worker's shared-memory input and
+    formats the probabilities it writes back. A crashed worker is restarted and
+    the batch retried once.
+    """
+
+    def __init__(self, num_workers=INFERENCE_WORKERS, threads_per_worker=INFERENCE_THREADS_PER_WORKER,
+                 max_batch=WORKER_MAX_BATCH, metrics=None, model_dir=None, version=None):
+        self.num_workers = max(1, num_workers)
+        self.threads_per_worker = threads_per_worker
+        self.max_batch = max_batch
+        # Classes-only instance for decode/normalise and top-k formatting
+        self.preprocessor = BreedClassifier(load_model=False, model_dir=model_dir, version=version)
+        self.model_dir = self.preprocessor.model_dir
+        self.version = self.preprocessor.version
+        if metrics is not None:
+            self.preprocessor.metrics = metrics
+        self.workers = []
+        self._idle = queue.Queue()
+
+    def start(self):
+        # spawn, not fork: TensorFlow is not fork-safe
+        ctx = mp.get_context("spawn")
+        num_classes = max(len(self.preprocessor.int_to_class), 1)
+        for i in range(self.num_workers):
+            worker = _Worker(ctx, i, self.max_batch, num_classes, self.threads_per_worker, self.model_dir)
+            worker.spawn()
+            self.workers.append(worker)
+        for worker in self.workers:
+            worker.wait_ready()
+            self._idle.put(worker)
+        if self.preprocessor.tta_threshold > 0:
+            # TTA runs here, not in the workers, so its cost estimate is seeded here too
+            worker = self._idle.get()
+            try:
+                self.preprocessor.measure_tta_cost(lambda views: self._forward(worker, views))
+            except Exception as e:
+                log.warning("Could not measure the TTA cost", extra={"version": self.version, "error": str(e)})
+            finally:
+                self._idle.put(worker)
+        log.info(f"Started {self.num_workers} inference workers x {self.threads_per_worker} threads")
+
+    def stop(self, drain_timeout=None):
+        # With drain_timeout, wait (up to that long) for in-flight batches to finish first
+        if drain_timeout is not None:
+            deadline = time.monotonic() + drain_timeout
+            for _ in self.workers:
+                try:
+                    self._idle.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    log.warning("Stopping inference pool with batches still running", extra={"version": self.version})
+                    break
+        for worker in self.workers:
+            worker.stop()
+        self.workers = []
+
+    def _forward(self, worker, items):
+        # Probabilities for already decoded items (TTA views), through the same worker
+        out = []
+        for start in range(0, len(items), self.max_batch):
+            chunk = items[start:start + self.max_batch]
+            self.preprocessor.preprocess_batch(chunk, out=worker.inputs)
+            status = worker.run(len(chunk))
+            if status not in ("ok", "ok:probs"):
+                raise RuntimeError(status)
+            out.append(np.array(worker.outputs[:len(chunk), :worker.num_classes]))
+        return np.concatenate(out)
+
+    def _run_chunk(self, worker, chunk, top_k, started):
+        # (results, embeddings or None) for one chunk
+        metrics = self.preprocessor.metrics
+        t0 = time.perf_counter()
+        _, failed = self.preprocessor.preprocess_batch(chunk, out=worker.inputs)
+        t1 = time.perf_counter()
+        status = worker.run(len(chunk))
+        if status == "mock":
+            metrics.incr("mock_fallback", len(chunk))
+            return [self.preprocessor._mock_prediction() for _ in chunk], None
+        if status not in ("ok", "ok:probs"):
+            metrics.incr("model_error")
+            raise RuntimeError(status)
+        probs = np.array(worker.outputs[:len(chunk), :worker.num_classes])
+        embeddings = np.array(worker.outputs[:len(chunk), worker.num_classes:]) if status == "ok" else None
+        probs = self.preprocessor.apply_tta(chunk, probs, failed, lambda views: self._forward(worker, views), started)
+        t2 = time.perf_counter()
+        formatted = self.preprocessor.postprocessor.format(probs, top_k)
+        metrics.observe("decode", t1 - t0)
+        metrics.observe("inference", t2 - t1)
+        metrics.observe("postprocess", time.perf_counter() - t2)
+        if failed:
+            metrics.incr("decode_error", len(failed))
+        return [failed.get(i, row) for i, row in enumerate(formatted)], embeddings
+
+    def predict_batch(self, items, top_k=3, with_embeddings=False):
+        # Same contract as BreedClassifier.predict_batch
+        worker = self._idle.get()
+        started = time.perf_counter()
+        try:
+            results = []
+            embeddings = []
+            for start in range(0, len(items), self.max_batch):
+                chunk = items[start:start + self.max_batch]
+                try:
+                    rows, chunk_embeddings = self._run_chunk(worker, chunk, top_k, started)
+                except RuntimeError as e:
+                    log.warning("Retrying batch after worker failure", extra={"error": str(e)})
+                    rows, chunk_embeddings = self._run_chunk(worker, chunk, top_k, started)
+                results.extend(rows)
+                embeddings.append(chunk_embeddings)
+            if with_embeddings:
+                return results, None if any(e is None for e in embeddings) else np.concatenate(embeddings)
+            return results
+        finally:
+            self._idle.put(worker)
+
+    def stats(self):
+        return {
+            "workers": self.num_workers,
+            "threads_per_worker": self.threads_per_worker,
+            "idle_workers": self._idle.qsize(),
+            "restarts": sum(w.restarts for w in self.workers),
+            "tta": dict(self.preprocessor.tta_stats, threshold=self.preprocessor.tta_threshold),
+        }
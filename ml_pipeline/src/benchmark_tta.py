@@ -0,0 +1,91 @@
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "models"))
+from breed_classifier import BreedClassifier, TTA_VIEWS
+from data_pipeline import list_dataset
+
+# Configuration
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(BASE_DIR, "data", "cattle")
+# 0 = TTA off (baseline), >1 = TTA on every image
+DEFAULT_THRESHOLDS = [0.0, 0.5, 0.7, 0.9, 1.01]
+
+
+def run(classifier, paths, labels, threshold, budget_ms, views, batch_size):
+    classifier.tta_threshold = threshold
+    classifier.tta_budget = budget_ms / 1000.0
+    classifier.tta_max_views = views
+    classifier.tta_stats = {"rescored": 0, "views": 0, "skipped_budget": 0}
+    top1 = top3 = scored = 0
+    latencies = []
+    for start in range(0, len(paths), batch_size):
+        chunk = paths[start:start + batch_size]
+        started = time.perf_counter()
+        results = classifier.predict_batch(chunk, top_k=3)
+        latencies.append((time.perf_counter() - started) * 1000)
+        for result, label in zip(results, labels[start:start + batch_size]):
+            if isinstance(result, Exception):
+                continue
+            scored += 1
+            breeds = [r["breed"] for r in result]
+            top1 += breeds[0] == label
+            top3 += label in breeds
+    return {
+        "threshold": threshold,
+        "top1": round(top1 / max(scored, 1), 4),
+        "top3": round(top3 / max(scored, 1), 4),
+        "rescored_fraction": round(classifier.tta_stats["rescored"] / max(scored, 1), 4),
+        "skipped_budget": classifier.tta_stats["skipped_budget"],
+        "batch_ms_p50": round(float(np.percentile(latencies, 50)), 1),
+        "batch_ms_p95": round(float(np.percentile(latencies, 95)), 1),
+        "ms_per_image": round(sum(latencies) / max(len(paths), 1), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Accuracy vs. latency of test-time augmentation on the validation split.")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=DEFAULT_THRESHOLDS)
+    parser.add_argument("--budget-ms", type=float, default=1e9, help="per-batch TTA budget (default: unlimited)")
+    parser.add_argument("--views", type=int, default=len(TTA_VIEWS), help=f"max extra views, up to {len(TTA_VIEWS)}")
+    parser.add_argument("--batch-size", type=int, default=1, help="1 = one request at a time, like /predict")
+    parser.add_argument("--limit", type=int, default=1000, help="validation images to use")
+    parser.add_argument("--out", default=None, help="also write the results as JSON")
+    args = parser.parse_args()
+
+    classifier = BreedClassifier()
+    if classifier.model is None:
+        sys.exit("No trained model found - run train.py first")
+    classifier.warm_up()
+
+    class_names, _, val = list_dataset(DATA_DIR)
+    # Spread the sample over all breeds instead of taking the first few
+    step = max(1, len(val[0]) // args.limit)
+    paths = val[0][::step][:args.limit]
+    labels = [class_names[i] for i in val[1][::step][:args.limit]]
+    print(f"Benchmarking TTA on {len(paths)} validation images (batch size {args.batch_size})")
+
+    rows = [run(classifier, paths, labels, t, args.budget_ms, args.views, args.batch_size) for t in args.thresholds]
+    baseline = rows[0] if rows and rows[0]["threshold"] <= 0 else None
+
+    print(f"{'threshold':>9} {'top1':>7} {'top3':>7} {'rescored':>9} {'ms/img':>8} {'p95 ms':>8}")
+    for row in rows:
+        print(f"{row['threshold']:>9.2f} {row['top1']:>7.3f} {row['top3']:>7.3f} "
+              f"{row['rescored_fraction']:>9.1%} {row['ms_per_image']:>8.2f} {row['batch_ms_p95']:>8.1f}")
+        if baseline is not None:
+            row["top1_gain"] = round(row["top1"] - baseline["top1"], 4)
+            row["cost_ratio"] = round(row["ms_per_image"] / max(baseline["ms_per_image"], 1e-9), 2)
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"images": len(paths), "batch_size": args.batch_size, "views": args.views,
+                       "budget_ms": args.budget_ms, "results": rows}, f, indent=2)
+        print(f"Results written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
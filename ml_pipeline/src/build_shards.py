@@ -0,0 +1,119 @@
+import os
+import io
+import json
+import time
+import random
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+import tensorflow as tf
+
+from data_pipeline import list_dataset
+
+# Configuration
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(BASE_DIR, "data", "cattle")
+SHARDS_DIR = os.path.join(BASE_DIR, "data", "shards")
+IMG_SIZE = (224, 224)
+SHARD_SIZE = 1024       # examples per shard (~20MB at 224x224 JPEG q95)
+JPEG_QUALITY = 95
+SHARD_FORMAT = 1
+
+
+def resize_to_jpeg(item):
+    # Runs in a worker process: one draft-mode decode, resize, re-encode
+    path, label = item
+    try:
+        with Image.open(path) as img:
+            img.draft('RGB', IMG_SIZE)
+            img = img.convert('RGB')
+            # Nearest matches the training pipeline and BreedClassifier
+            img = img.resize(IMG_SIZE, Image.NEAREST)
+            buf = io.BytesIO()
+            img.save(buf, format='JPEG', quality=JPEG_QUALITY)
+        return buf.getvalue(), label, path
+    except Exception as e:
+        print(f"Skipping {path}: {e}")
+        return None, label, path
+
+
+def _example(image, label, path):
+    return tf.train.Example(features=tf.train.Features(feature={
+        "image": tf.train.Feature(bytes_list=tf.train.BytesList(value=[image])),
+        "label": tf.train.Feature(int64_list=tf.train.Int64List(value=[label])),
+        "path": tf.train.Feature(bytes_list=tf.train.BytesList(value=[path.encode()])),
+    })).SerializeToString()
+
+
+def write_shards(items, data_dir, out_dir, split, pool, shard_size=SHARD_SIZE):
+    # Fixed-size shards written in order; returns (shard filenames, examples written)
+    num_shards = max(1, -(-len(items) // shard_size))
+    names = [f"{split}-{i:05d}-of-{num_shards:05d}.tfrecord" for i in range(num_shards)]
+    written = 0
+    writer = None
+    for i, (image, label, path) in enumerate(pool.map(resize_to_jpeg, items, chunksize=32)):
+        if i % shard_size == 0:
+            if writer is not None:
+                writer.close()
+            writer = tf.io.TFRecordWriter(os.path.join(out_dir, names[i // shard_size]))
+        if image is not None:
+            writer.write(_example(image, label, os.path.relpath(path, data_dir)))
+            written += 1
+    if writer is not None:
+        writer.close()
+    return names, written
+
+
+def build_shards(data_dir=DATA_DIR, out_dir=SHARDS_DIR, validation_split=0.2, shard_size=SHARD_SIZE,
+                 seed=42, workers=None):
+    """Packs data_dir into TFRecord shards of pre-resized JPEGs.
+
+    Training examples are shuffled once (seeded) before sharding so every shard
+    mixes breeds; validation keeps sorted order. meta.json is written last and
+    is what data_pipeline.build_shard_datasets() reads.
+    """
+    started = time.perf_counter()
+    class_names, (train_paths, train_labels), (val_paths, val_labels) = list_dataset(data_dir, validation_split)
+    train = list(zip(train_paths, train_labels))
+    val = list(zip(val_paths, val_labels))
+    random.Random(seed).shuffle(train)
+    print(f"Packing {len(train)} training and {len(val)} validation images in {len(class_names)} classes...")
+
+    os.makedirs(out_dir, exist_ok=True)
+    meta_path = os.path.join(out_dir, "meta.json")
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+    for name in os.listdir(out_dir):
+        if name.endswith(".tfrecord"):
+            os.remove(os.path.join(out_dir, name))
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        train_shards, n_train = write_shards(train, data_dir, out_dir, "train", pool, shard_size)
+        val_shards, n_val = write_shards(val, data_dir, out_dir, "val", pool, shard_size)
+
+    meta = {
+        "format": SHARD_FORMAT,
+        "classes": class_names,
+        "img_size": list(IMG_SIZE),
+        "validation_split": validation_split,
+        "seed": seed,
+        "train": {"shards": train_shards, "count": n_train},
+        "val": {"shards": val_shards, "count": n_val},
+    }
+    with open(meta_path, "w") as f:
+        json.dump(meta, f, indent=2)
+    print(f"Wrote {len(train_shards) + len(val_shards)} shards to {out_dir} "
+          f"in {time.perf_counter() - started:.1f}s")
+    return meta
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pack the cleaned dataset into TFRecord shards.")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--out-dir", default=SHARDS_DIR)
+    parser.add_argument("--validation-split", type=float, default=0.2)
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    args = parser.parse_args()
+    build_shards(args.data_dir, args.out_dir, args.validation_split, args.shard_size, args.seed, args.workers)
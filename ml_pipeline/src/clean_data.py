@@ -1,71 +1,242 @@
 import os
+import io
+import json
+import time
+import hashlib
+import sqlite3
+import argparse
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
 from PIL import Image
-import sys
 
 # Configuration
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DATA_DIR = os.path.join(BASE_DIR, "data", "cattle")
+MANIFEST_PATH = os.path.join(BASE_DIR, "data", "clean_manifest.sqlite")
+REPORT_PATH = os.path.join(BASE_DIR, "data", "clean_report.json")
+NEAR_DUP_DISTANCE = 4  # max Hamming distance between 64-bit dHashes
 
-def clean_data():
-    print(f"Scanning dataset in {DATA_DIR}...")
-    
-    corrupt_count = 0
-    converted_count = 0
-    total_count = 0
 
-    if not os.path.exists(DATA_DIR):
+def dhash(img, size=8):
+    # Difference hash: 64 bits of "is this pixel brighter than its right neighbour"
+    small = img.convert('L').resize((size + 1, size), Image.BILINEAR)
+    px = list(small.getdata())
+    bits = 0
+    for row in range(size):
+        for col in range(size):
+            left = px[row * (size + 1) + col]
+            right = px[row * (size + 1) + col + 1]
+            bits = (bits << 1) | (left > right)
+    return bits
+
+
+def process_file(file_path, dry_run=False):
+    # Runs in a worker process. Reads the file once and decodes it once.
+    result = {"path": file_path, "status": "ok", "error": None}
+    try:
+        with open(file_path, 'rb') as f:
+            data = f.read()
+        with Image.open(io.BytesIO(data)) as img:
+            img.load()  # Full decode - catches truncated/corrupt files
+            mode = img.mode
+            # Check for transparency/palette issues or non-RGB
+            if mode in ('P', 'RGBA', 'LA'):
+                rgb_img = img.convert('RGB')
+                if dry_run:
+                    result["status"] = "would_convert"
+                else:
+                    buf = io.BytesIO()
+                    rgb_img.save(buf, format=img.format or 'PNG')
+                    data = buf.getvalue()
+                    with open(file_path, 'wb') as f:
+                        f.write(data)
+                    result["status"] = "converted"
+                    mode = 'RGB'
+                img = rgb_img
+            result.update(
+                width=img.width,
+                height=img.height,
+                mode=mode,
+                phash=f"{dhash(img):016x}",
+                sha256=hashlib.sha256(data).hexdigest(),
+            )
+    except (IOError, SyntaxError, OSError, ValueError, Image.DecompressionBombError) as e:
+        result["status"] = "corrupt"
+        result["error"] = str(e)
+    st = os.stat(file_path)
+    result["size"] = st.st_size
+    result["mtime_ns"] = st.st_mtime_ns
+    return result
+
+
+def open_manifest(path):
+    db = sqlite3.connect(path)
+    db.execute("""
+        CREATE TABLE IF NOT EXISTS files (
+            path TEXT PRIMARY KEY,
+            breed TEXT,
+            size INTEGER,
+            mtime_ns INTEGER,
+            sha256 TEXT,
+            phash TEXT,  -- 16 hex digits; doesn't fit a signed SQLite INTEGER
+            width INTEGER,
+            height INTEGER,
+            mode TEXT,
+            status TEXT,
+            error TEXT
+        )
+    """)
+    return db
+
+
+def scan_files(data_dir):
+    # os.scandir gives size/mtime from the directory entry, no extra stat per file on most platforms
+    for breed_entry in os.scandir(data_dir):
+        if not breed_entry.is_dir():
+            continue
+        for entry in os.scandir(breed_entry.path):
+            if entry.is_file():
+                st = entry.stat()
+                yield entry.path, breed_entry.name, st.st_size, st.st_mtime_ns
+
+
+def find_duplicates(rows, max_distance=NEAR_DUP_DISTANCE):
+    """Exact duplicates by content hash, near duplicates by dHash distance.
+
+    Near duplicates use pigeonhole banding: the 64 bits are cut into
+    max_distance + 1 bands, so any pair within max_distance bits agrees exactly
+    on at least one band and only same-band candidates get compared.
+    """
+    by_hash = defaultdict(list)
+    for path, breed, sha, _ in rows:
+        by_hash[sha].append((path, breed))
+    exact = [
+        {"files": [p for p, _ in group], "cross_breed": len({b for _, b in group}) > 1}
+        for group in by_hash.values() if len(group) > 1
+    ]
+
+    bands = max_distance + 1
+    widths = [64 // bands + (1 if i < 64 % bands else 0) for i in range(bands)]
+    buckets = defaultdict(list)
+    for i, (_, _, _, ph) in enumerate(rows):
+        shift = 64
+        for b, width in enumerate(widths):
+            shift -= width
+            buckets[(b, (ph >> shift) & ((1 << width) - 1))].append(i)
+
+    seen = set()
+    near = []
+    for members in buckets.values():
+        for a_pos in range(len(members)):
+            for b_pos in range(a_pos + 1, len(members)):
+                a, b = members[a_pos], members[b_pos]
+                if (a, b) in seen:
+                    continue
+                seen.add((a, b))
+                ra, rb = rows[a], rows[b]
+                if ra[2] == rb[2]:
+                    continue  # already an exact duplicate
+                distance = bin(ra[3] ^ rb[3]).count("1")
+                if distance <= max_distance:
+                    near.append({
+                        "files": [ra[0], rb[0]],
+                        "distance": distance,
+                        "cross_breed": ra[1] != rb[1],
+                    })
+    return exact, near
+
+
+def clean_data(dry_run=False, workers=None, data_dir=DATA_DIR, manifest_path=MANIFEST_PATH):
+    print(f"Scanning dataset in {data_dir}...")
+    started = time.perf_counter()
+
+    if not os.path.exists(data_dir):
         print("Data directory not found!")
         return
 
-    for breed_folder in os.listdir(DATA_DIR):
-        breed_path = os.path.join(DATA_DIR, breed_folder)
-        if not os.path.isdir(breed_path):
+    db = open_manifest(manifest_path)
+    known = {row[0]: row[1:] for row in db.execute("SELECT path, size, mtime_ns, status FROM files")}
+
+    # Only new or changed files get opened (plus conversions a dry run left pending)
+    on_disk = {}
+    todo = []
+    for path, breed, size, mtime_ns in scan_files(data_dir):
+        on_disk[path] = breed
+        prev_size, prev_mtime, status = known.get(path, (None, None, None))
+        if (prev_size, prev_mtime) != (size, mtime_ns) or (status == "would_convert" and not dry_run):
+            todo.append(path)
+
+    removed = [p for p in known if p not in on_disk]
+    if removed:
+        db.executemany("DELETE FROM files WHERE path = ?", [(p,) for p in removed])
+
+    print(f"{len(on_disk)} files, {len(todo)} new or changed, {len(removed)} gone since last run")
+
+    converted = []
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            for res in pool.map(process_file, todo, [dry_run] * len(todo), chunksize=64):
+                if res["status"] == "converted":
+                    converted.append(res["path"])
+                db.execute(
+                    "INSERT OR REPLACE INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (res["path"], on_disk[res["path"]], res["size"], res["mtime_ns"], res.get("sha256"),
+                     res.get("phash"), res.get("width"), res.get("height"), res.get("mode"),
+                     res["status"], res["error"]),
+                )
+
+    if dry_run:
+        converted = [row[0] for row in db.execute("SELECT path FROM files WHERE status = 'would_convert'")]
+
+    # Corrupt files stay in the manifest until a real run deletes them
+    corrupt = db.execute("SELECT path, error FROM files WHERE status = 'corrupt'").fetchall()
+    deleted = 0
+    for path, error in corrupt:
+        if dry_run:
+            print(f"Would delete corrupt image: {path} - {error}")
             continue
+        print(f"Deleting corrupt image: {path} - {error}")
+        try:
+            os.remove(path)
+            db.execute("DELETE FROM files WHERE path = ?", (path,))
+            deleted += 1
+        except OSError:
+            pass
+    db.commit()
+
+    # Duplicates are checked across the whole manifest, not just this run's files
+    rows = [
+        (path, breed, sha, int(ph, 16))
+        for path, breed, sha, ph in db.execute("SELECT path, breed, sha256, phash FROM files WHERE status != 'corrupt'")
+        if sha is not None and ph is not None
+    ]
+    exact, near = find_duplicates(rows)
+    db.close()
 
-        for filename in os.listdir(breed_path):
-            file_path = os.path.join(breed_path, filename)
-            total_count += 1
-            
-            try:
-                with Image.open(file_path) as img:
-                    img.load() # Force load pixel data
-                    mode = img.mode
-                    info = img.info.copy() # Copy info to avoid keeping ref
-                
-                # Re-open if we need to convert and save (now that the handle is closed)
-                # Check for transparency/palette issues or non-RGB
-                if mode in ('P', 'RGBA', 'LA') or (mode == 'P' and 'transparency' in info):
-                    # Convert to RGB
-                    # We need to open again to convert safely? 
-                    # Actually, if we loaded it, we can just use the object if we didn't use 'with' or if we copied it. 
-                    # Better pattern for overwrite:
-                    
-                    with Image.open(file_path) as img:
-                        rgb_img = img.convert('RGB')
-                    
-                    # Now original is closed, we can save
-                    rgb_img.save(file_path) 
-                    converted_count += 1
-                    
-                # Full verification
-                with Image.open(file_path) as img:
-                    img.verify() 
-
-            except (IOError, SyntaxError, OSError) as e:
-                print(f"Deleting corrupt image: {filename} - {e}")
-                try:
-                    os.remove(file_path)
-                    corrupt_count += 1
-                except:
-                    pass
-            except Exception as e:
-                 print(f"Error processing {filename}: {e}")
+    report = {
+        "dry_run": dry_run,
+        "total_images": len(on_disk),
+        "processed": len(todo),
+        "converted" if not dry_run else "would_convert": converted,
+        "corrupt": [{"path": path, "error": error} for path, error in corrupt],
+        "exact_duplicates": exact,
+        "near_duplicates": near,
+    }
+    with open(REPORT_PATH, 'w') as f:
+        json.dump(report, f, indent=2)
 
     print("-" * 30)
-    print(f"Scanning Complete.")
-    print(f"Total Images: {total_count}")
-    print(f"Converted to RGB: {converted_count}")
-    print(f"Deleted Corrupt: {corrupt_count}")
+    print(f"Scanning Complete in {time.perf_counter() - started:.1f}s.")
+    print(f"Total Images: {len(on_disk)}")
+    print(f"{'Would convert' if dry_run else 'Converted'} to RGB: {len(converted)}")
+    print(f"{'Would delete' if dry_run else 'Deleted'} Corrupt: {len(corrupt) if dry_run else deleted}")
+    print(f"Exact duplicate groups: {len(exact)} ({sum(g['cross_breed'] for g in exact)} across breeds)")
+    print(f"Near duplicate pairs: {len(near)} ({sum(p['cross_breed'] for p in near)} across breeds)")
+    print(f"Report written to {REPORT_PATH}")
 
 if __name__ == "__main__":
-    clean_data()
+    parser = argparse.ArgumentParser(description="Verify, convert and de-duplicate the training images.")
+    parser.add_argument("--dry-run", action="store_true", help="report only; don't convert or delete anything")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    args = parser.parse_args()
+    clean_data(dry_run=args.dry_run, workers=args.workers)
@@ -0,0 +1,236 @@
+import os
+import json
+import math
+import time
+import hashlib
+import tensorflow as tf
+
+# Same extensions flow_from_directory accepts
+IMAGE_EXTS = ('.png', '.jpg', '.jpeg', '.bmp', '.ppm', '.tif', '.tiff')
+AUTOTUNE = tf.data.AUTOTUNE
+
+# Augmentation - mirrors the old ImageDataGenerator settings in train.py
+ROTATION_RANGE = 30        # degrees
+WIDTH_SHIFT_RANGE = 0.2    # fraction of width
+HEIGHT_SHIFT_RANGE = 0.2   # fraction of height
+SHEAR_RANGE = 0.2          # degrees, as ImageDataGenerator interprets shear_range
+ZOOM_RANGE = 0.2           # each axis scaled independently in [0.8, 1.2]
+BRIGHTNESS_RANGE = (0.8, 1.2)
+
+
+def in_validation(breed, filename, validation_split):
+    # Split by a hash of the file's name, not its position in a listing, so adding
+    # or removing images never moves existing ones between train and validation
+    digest = hashlib.sha1(f"{breed}/{filename}".encode()).digest()
+    return int.from_bytes(digest[:4], "big") / 2 ** 32 < validation_split
+
+
+def list_dataset(data_dir, validation_split=0.2):
+    """Lists (paths, labels) for both subsets.
+
+    Classes are the sorted sub-directory names. Every consumer of the split -
+    the tf.data, generator and shard pipelines, the feature cache and
+    export_model.py - goes through in_validation(), so a model is validated,
+    calibrated and parity-checked on the same held-out images whichever
+    pipeline trained it.
+    """
+    class_names = sorted(d for d in os.listdir(data_dir) if os.path.isdir(os.path.join(data_dir, d)))
+    train, val = ([], []), ([], [])
+    for label, breed in enumerate(class_names):
+        breed_path = os.path.join(data_dir, breed)
+        for filename in sorted(f for f in os.listdir(breed_path) if f.lower().endswith(IMAGE_EXTS)):
+            subset = val if in_validation(breed, filename, validation_split) else train
+            subset[0].append(os.path.join(breed_path, filename))
+            subset[1].append(label)
+    return class_names, train, val
+
+
+def dataset_fingerprint(paths, labels, num_classes):
+    # Changes whenever a file is added/removed/modified or relabelled, like feature_cache.fingerprint()
+    h = hashlib.sha256(f"{num_classes};".encode())
+    for path, label in zip(paths, labels):
+        st = os.stat(path)
+        h.update(f"{path}:{label}:{st.st_size}:{st.st_mtime_ns};".encode())
+    return h.hexdigest()[:16]
+
+
+def _cache_path(cache_dir, subset, img_size, paths, labels, num_classes):
+    # tf.data cache files for one subset; caches of other versions of the dataset are removed
+    prefix = f"{subset}_{img_size[0]}x{img_size[1]}"
+    name = f"{prefix}_{dataset_fingerprint(paths, labels, num_classes)}"
+    for filename in os.listdir(cache_dir):
+        if filename.startswith(prefix) and not filename.startswith(name):
+            os.remove(os.path.join(cache_dir, filename))
+    return os.path.join(cache_dir, name)
+
+
+def decode_and_resize(path, label, img_size, num_classes):
+    data = tf.io.read_file(path)
+    img = tf.io.decode_image(data, channels=3, expand_animations=False)
+    img.set_shape([None, None, 3])
+    # Nearest matches flow_from_directory's default interpolation
+    img = tf.image.resize(img, img_size, method="nearest")
+    return tf.cast(img, tf.uint8), tf.one_hot(label, num_classes)
+
+
+def _random_affine(images):
+    # Rotation, shift, shear and zoom for the whole batch as one projective transform
+    batch = tf.shape(images)[0]
+    h = tf.cast(tf.shape(images)[1], tf.float32)
+    w = tf.cast(tf.shape(images)[2], tf.float32)
+    deg = math.pi / 180.0
+
+    theta = tf.random.uniform([batch], -ROTATION_RANGE, ROTATION_RANGE) * deg
+    shear = tf.random.uniform([batch], -SHEAR_RANGE, SHEAR_RANGE) * deg
+    zx = tf.random.uniform([batch], 1 - ZOOM_RANGE, 1 + ZOOM_RANGE)
+    zy = tf.random.uniform([batch], 1 - ZOOM_RANGE, 1 + ZOOM_RANGE)
+    tx = tf.random.uniform([batch], -WIDTH_SHIFT_RANGE, WIDTH_SHIFT_RANGE) * w
+    ty = tf.random.uniform([batch], -HEIGHT_SHIFT_RANGE, HEIGHT_SHIFT_RANGE) * h
+
+    # A = rotation @ shear @ zoom maps output pixels back to input pixels
+    cos, sin = tf.cos(theta), tf.sin(theta)
+    a00 = zx * cos
+    a01 = zy * (-cos * tf.sin(shear) - sin * tf.cos(shear))
+    a10 = zx * sin
+    a11 = zy * (-sin * tf.sin(shear) + cos * tf.cos(shear))
+    cx, cy = (w - 1) / 2.0, (h - 1) / 2.0
+    a02 = cx - a00 * cx - a01 * cy + tx
+    a12 = cy - a10 * cx - a11 * cy + ty
+    zeros = tf.zeros([batch])
+    transforms = tf.stack([a00, a01, a02, a10, a11, a12, zeros, zeros], axis=1)
+
+    return tf.raw_ops.ImageProjectiveTransformV3(
+        images=images,
+        transforms=transforms,
+        output_shape=tf.shape(images)[1:3],
+        fill_value=0.0,
+        interpolation="BILINEAR",
+        fill_mode="NEAREST",
+    )
+
+
+def augment_batch(images):
+    # images: float32 batch in [0, 1]
+    images = _random_affine(images)
+    batch = tf.shape(images)[0]
+    flip = tf.random.uniform([batch, 1, 1, 1]) < 0.5
+    images = tf.where(flip, tf.reverse(images, axis=[2]), images)
+    brightness = tf.random.uniform([batch, 1, 1, 1], BRIGHTNESS_RANGE[0], BRIGHTNESS_RANGE[1])
+    return tf.clip_by_value(images * brightness, 0.0, 1.0)
+
+
+def _make_dataset(paths, labels, img_size, batch_size, num_classes, training, cache_path=None, seed=42):
+    ds = tf.data.Dataset.from_tensor_slices((paths, labels))
+    ds = ds.map(lambda p, l: decode_and_resize(p, l, img_size, num_classes), num_parallel_calls=AUTOTUNE,
+                deterministic=not training)
+    ds = ds.ignore_errors()  # skip files that fail to decode instead of aborting the epoch
+    if cache_path is not None:
+        # Resized uint8 tensors on disk: later epochs (and runs) skip JPEG decode entirely
+        ds = ds.cache(cache_path)
+    return _batch(ds, batch_size, training, min(len(paths), 4096), seed)
+
+
+def _batch(ds, batch_size, training, shuffle_buffer, seed):
+    # (uint8 image, one-hot) examples -> shuffled, rescaled, augmented batches
+    if training:
+        ds = ds.shuffle(shuffle_buffer, seed=seed, reshuffle_each_iteration=True)
+    ds = ds.batch(batch_size, num_parallel_calls=AUTOTUNE)
+    ds = ds.map(lambda x, y: (tf.cast(x, tf.float32) / 255.0, y), num_parallel_calls=AUTOTUNE)  # rescale
+    if training:
+        ds = ds.map(lambda x, y: (augment_batch(x), y), num_parallel_calls=AUTOTUNE)
+    return ds.prefetch(AUTOTUNE)
+
+
+def build_datasets(data_dir, img_size=(224, 224), batch_size=32, validation_split=0.2, cache_dir=None, seed=42):
+    """Returns (train_ds, val_ds, class_names, n_train, n_val).
+
+    Validation batches are only rescaled, not augmented.
+    """
+    class_names, train, val = list_dataset(data_dir, validation_split)
+    num_classes = len(class_names)
+    train_cache = val_cache = None
+    if cache_dir:
+        os.makedirs(cache_dir, exist_ok=True)
+        # Keyed by the file list, so adding, removing or relabelling images never reuses a stale cache
+        train_cache = _cache_path(cache_dir, "train", img_size, train[0], train[1], num_classes)
+        val_cache = _cache_path(cache_dir, "val", img_size, val[0], val[1], num_classes)
+    print(f"Found {len(train[0])} training and {len(val[0])} validation images in {num_classes} classes.")
+    train_ds = _make_dataset(train[0], train[1], img_size, batch_size, num_classes, True, train_cache, seed)
+    val_ds = _make_dataset(val[0], val[1], img_size, batch_size, num_classes, False, val_cache, seed)
+    return train_ds, val_ds, class_names, len(train[0]), len(val[0])
+
+
+SHARD_FEATURES = {
+    "image": tf.io.FixedLenFeature([], tf.string),
+    "label": tf.io.FixedLenFeature([], tf.int64),
+}
+
+
+def _parse_shard_example(record, img_size, num_classes):
+    example = tf.io.parse_single_example(record, SHARD_FEATURES)
+    img = tf.io.decode_jpeg(example["image"], channels=3)
+    img.set_shape([img_size[0], img_size[1], 3])
+    return img, tf.one_hot(example["label"], num_classes)
+
+
+def _shard_dataset(files, img_size, batch_size, num_classes, training, seed):
+    ds = tf.data.Dataset.from_tensor_slices(files)
+    if training:
+        ds = ds.shuffle(len(files), seed=seed, reshuffle_each_iteration=True)
+    # Each shard is read front to back; several are read at once when training
+    ds = ds.interleave(tf.data.TFRecordDataset, cycle_length=min(len(files), 8) if training else 1,
+                       num_parallel_calls=AUTOTUNE if training else None, deterministic=not training)
+    ds = ds.map(lambda r: _parse_shard_example(r, img_size, num_classes), num_parallel_calls=AUTOTUNE,
+                deterministic=not training)
+    return _batch(ds, batch_size, training, 4096, seed)
+
+
+def build_shard_datasets(shards_dir, img_size=(224, 224), batch_size=32, seed=42, validation_split=0.2):
+    """Same return value as build_datasets(), streamed from build_shards.py output.
+
+    The split was fixed when the shards were built (with list_dataset(), like
+    every other pipeline); validation_split only checks that it is the one
+    the caller expects.
+    """
+    with open(os.path.join(shards_dir, "meta.json")) as f:
+        meta = json.load(f)
+    if tuple(meta["img_size"]) != tuple(img_size):
+        raise ValueError(f"Shards in {shards_dir} are {meta['img_size']}, expected {list(img_size)}; rebuild them")
+    if meta["validation_split"] != validation_split:
+        raise ValueError(f"Shards in {shards_dir} hold out {meta['validation_split']}, "
+                         f"expected {validation_split}; rebuild them")
+    class_names = meta["classes"]
+    num_classes = len(class_names)
+    train_files = [os.path.join(shards_dir, name) for name in meta["train"]["shards"]]
+    val_files = [os.path.join(shards_dir, name) for name in meta["val"]["shards"]]
+    n_train, n_val = meta["train"]["count"], meta["val"]["count"]
+    print(f"Found {n_train} training and {n_val} validation images in {num_classes} classes "
+          f"({len(train_files) + len(val_files)} shards).")
+    train_ds = _shard_dataset(train_files, img_size, batch_size, num_classes, True, seed)
+    val_ds = _shard_dataset(val_files, img_size, batch_size, num_classes, False, seed)
+    return train_ds, val_ds, class_names, n_train, n_val
+
+
+class ThroughputCallback(tf.keras.callbacks.Callback):
+    """Prints training images/sec at the end of every epoch (validation time excluded)."""
+
+    def __init__(self, num_images):
+        super().__init__()
+        self.num_images = num_images
+        self.started = None
+        self.train_elapsed = None
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.started = time.perf_counter()
+        self.train_elapsed = None
+
+    def on_test_begin(self, logs=None):
+        if self.started is not None and self.train_elapsed is None:
+            self.train_elapsed = time.perf_counter() - self.started
+
+    def on_epoch_end(self, epoch, logs=None):
+        elapsed = self.train_elapsed or (time.perf_counter() - self.started)
+        rate = self.num_images / elapsed if elapsed > 0 else 0.0
+        if logs is not None:
+            logs["images_per_sec"] = rate
+        print(f"Epoch {epoch + 1}: {rate:.1f} images/sec ({elapsed:.1f}s)")
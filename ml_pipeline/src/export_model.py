@@ -0,0 +1,170 @@
+import os
+import sys
+import json
+import random
+import argparse
+import numpy as np
+import tensorflow as tf
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "models"))
+from breed_classifier import BreedClassifier
+from inference_backends import artifact_path, load_runner, with_embedding_output
+from model_registry import resolve_model_dir, version_dir
+from data_pipeline import list_dataset
+
+# Configuration
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(BASE_DIR, "data", "cattle")
+VALIDATION_SPLIT = 0.2  # as in train.py
+
+
+def split_samples(data_dir, classes, num_calibration, num_parity, seed):
+    """(calibration, parity) lists of (path, label), labels in classes.json order.
+
+    Uses the same train/validation split as training (data_pipeline.list_dataset):
+    INT8 calibration draws from the training images, the parity check from the
+    validation images the model never saw.
+    """
+    class_names, train, val = list_dataset(data_dir, VALIDATION_SPLIT)
+    class_to_idx = {v: int(k) for k, v in classes.items()}
+
+    def sample(subset, limit):
+        paths, labels = subset
+        samples = [(path, class_to_idx[class_names[label]])
+                   for path, label in zip(paths, labels) if class_names[label] in class_to_idx]
+        random.Random(seed).shuffle(samples)
+        return samples[:limit]
+
+    return sample(train, num_calibration), sample(val, num_parity)
+
+
+def load_batch(preprocessor, paths):
+    # Same decode/resize/normalise path the server uses. Returns (batch, kept):
+    # unreadable images come back zero-filled and are dropped, kept indexes paths
+    batch, failed = preprocessor.preprocess_batch(paths)
+    for i, error in failed.items():
+        print(f"Skipping unreadable image {paths[i]}: {error}")
+    kept = [i for i in range(len(paths)) if i not in failed]
+    return batch[kept], kept  # fancy indexing copies out of the shared input buffer
+
+
+def iter_batches(preprocessor, samples, batch_size=16):
+    for start in range(0, len(samples), batch_size):
+        chunk = samples[start:start + batch_size]
+        batch, kept = load_batch(preprocessor, [p for p, _ in chunk])
+        if kept:
+            yield batch, np.array([chunk[i][1] for i in kept])
+
+
+def export_tflite(model, output_path, calibration=None, preprocessor=None):
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if calibration:
+        # Full INT8 post-training quantization, calibrated on training images
+        def representative_dataset():
+            for batch, _ in iter_batches(preprocessor, calibration, batch_size=1):
+                yield [batch]
+
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+        converter.representative_dataset = representative_dataset
+        converter.target_spec.supported_ops = [tf.lite.OpsSet.TFLITE_BUILTINS_INT8]
+        converter.inference_input_type = tf.int8
+        converter.inference_output_type = tf.int8
+    with open(output_path, "wb") as f:
+        f.write(converter.convert())
+    print(f"Saved TFLite model to {output_path}")
+
+
+def export_onnx(model, output_path, calibration=None, preprocessor=None):
+    import tf2onnx
+
+    spec = (tf.TensorSpec((None, 224, 224, 3), tf.float32, name="input"),)
+    fp32_path = output_path if not calibration else output_path.replace("_int8", "")
+    tf2onnx.convert.from_keras(model, input_signature=spec, opset=13, output_path=fp32_path)
+    print(f"Saved ONNX model to {fp32_path}")
+
+    if calibration:
+        from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+        class Reader(CalibrationDataReader):
+            def __init__(self):
+                self.batches = iter_batches(preprocessor, calibration, batch_size=1)
+
+            def get_next(self):
+                batch = next(self.batches, None)
+                return None if batch is None else {"input": batch[0]}
+
+        quantize_static(fp32_path, output_path, Reader(), quant_format=QuantFormat.QDQ,
+                        activation_type=QuantType.QInt8, weight_type=QuantType.QInt8)
+        print(f"Saved INT8 ONNX model to {output_path}")
+
+
+def check_parity(keras_runner, runner, preprocessor, samples):
+    # Compare the exported model against Keras on held-out images
+    agree = keras_correct = runner_correct = total = 0
+    max_diff = 0.0
+    for batch, labels in iter_batches(preprocessor, samples):
+        ref = keras_runner(batch)
+        out = runner(batch)
+        ref_top, out_top = ref.argmax(axis=1), out.argmax(axis=1)
+        agree += int((ref_top == out_top).sum())
+        keras_correct += int((ref_top == labels).sum())
+        runner_correct += int((out_top == labels).sum())
+        max_diff = max(max_diff, float(np.abs(ref - out).max()))
+        total += len(labels)
+    report = {
+        "samples": total,
+        "top1_agreement": round(agree / max(total, 1), 4),
+        "keras_accuracy": round(keras_correct / max(total, 1), 4),
+        "exported_accuracy": round(runner_correct / max(total, 1), 4),
+        "max_prob_diff": round(max_diff, 4),
+    }
+    print(json.dumps(report, indent=2))
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export cattle_model.keras for the lightweight runtimes.")
+    parser.add_argument("--format", choices=["tflite", "onnx", "all"], default="tflite")
+    parser.add_argument("--int8", action="store_true", help="INT8 post-training quantization")
+    parser.add_argument("--version", default=None,
+                        help="registry version to export (default: the active one); artifacts go next to its model")
+    parser.add_argument("--calibration-samples", type=int, default=200, help="training images for INT8 calibration")
+    parser.add_argument("--parity-samples", type=int, default=500,
+                        help="validation images to compare against the Keras model (0 to skip)")
+    parser.add_argument("--min-agreement", type=float, default=0.98,
+                        help="fail if top-1 agreement with Keras drops below this")
+    args = parser.parse_args()
+
+    models_dir = version_dir(args.version) if args.version else resolve_model_dir()[1]
+    keras_model_path = artifact_path(models_dir, "keras")
+    with open(os.path.join(models_dir, "classes.json"), "r") as f:
+        classes = json.load(f)
+
+    # Exported with the pooled features as a second output, for the scan embedding index
+    model = with_embedding_output(tf.keras.models.load_model(keras_model_path))
+    preprocessor = BreedClassifier(model_dir=models_dir, backend="keras")
+
+    calibration, parity = split_samples(DATA_DIR, classes, args.calibration_samples, args.parity_samples, seed=42)
+    if not args.int8:
+        calibration = None
+
+    formats = ["tflite", "onnx"] if args.format == "all" else [args.format]
+    failed = False
+    for fmt in formats:
+        output_path = artifact_path(models_dir, fmt, args.int8)
+        if fmt == "tflite":
+            export_tflite(model, output_path, calibration, preprocessor)
+        else:
+            export_onnx(model, output_path, calibration, preprocessor)
+
+        if parity:
+            report = check_parity(preprocessor.model, load_runner(fmt, output_path), preprocessor, parity)
+            if report["top1_agreement"] < args.min_agreement:
+                print(f"{fmt}: top-1 agreement below {args.min_agreement}!")
+                failed = True
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+import os
+import json
+import time
+import hashlib
+import argparse
+import numpy as np
+import tensorflow as tf
+from tensorflow.keras.layers import Input, GlobalAveragePooling2D
+from tensorflow.keras.models import Model
+from tensorflow.keras.optimizers import Adam
+
+from data_pipeline import list_dataset, decode_and_resize, augment_batch, AUTOTUNE
+
+# Configuration
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DATA_DIR = os.path.join(BASE_DIR, "data", "cattle")
+FEATURES_DIR = os.path.join(BASE_DIR, "data", "features")
+IMG_SIZE = (224, 224)
+FEATURE_DIM = 1280
+DEFAULT_VIEWS = 4  # view 0 is the plain image, the rest are augmented
+CACHE_FORMAT = 1
+
+
+def _backbone_hash(backbone):
+    h = hashlib.sha256()
+    for weights in backbone.get_weights():
+        h.update(np.ascontiguousarray(weights).tobytes())
+    return h.hexdigest()
+
+
+def fingerprint(paths, backbone, views, seed):
+    # Changes whenever a file is added/removed/modified or the backbone weights differ
+    h = hashlib.sha256()
+    h.update(f"v{CACHE_FORMAT}:{IMG_SIZE}:{views}:{seed};".encode())
+    h.update(_backbone_hash(backbone).encode())
+    for path in paths:
+        st = os.stat(path)
+        h.update(f"{path}:{st.st_size}:{st.st_mtime_ns};".encode())
+    return h.hexdigest()[:20]
+
+
+def _extract(extractor, paths, out, valid, augment, seed, batch_size):
+    # Writes one (N, 1280) view into `out`; rows whose file fails to decode stay invalid
+    indices = np.arange(len(paths))
+    ds = tf.data.Dataset.from_tensor_slices((paths, indices))
+    ds = ds.map(lambda p, i: (decode_and_resize(p, 0, IMG_SIZE, 1)[0], i), num_parallel_calls=AUTOTUNE)
+    ds = ds.ignore_errors()
+    ds = ds.batch(batch_size).map(lambda x, i: (tf.cast(x, tf.float32) / 255.0, i), num_parallel_calls=AUTOTUNE)
+    if augment:
+        tf.random.set_seed(seed)
+        ds = ds.map(lambda x, i: (augment_batch(x), i), num_parallel_calls=AUTOTUNE)
+    for images, idx in ds.prefetch(AUTOTUNE):
+        feats = extractor(images, training=False).numpy()
+        idx = idx.numpy()
+        out[idx] = feats.astype(np.float16)
+        valid[idx] = True
+
+
+def load_or_extract(backbone, data_dir=DATA_DIR, views=DEFAULT_VIEWS, seed=42, batch_size=64, cache_root=FEATURES_DIR):
+    """Returns cached pooled backbone features for the train/validation split.
+
+    Features live in memory-mapped float16 .npy files under
+    cache_root/<fingerprint>/, so re-runs (and hyperparameter sweeps) only pay
+    the backbone forward passes once per dataset + backbone combination.
+    """
+    class_names, train, val = list_dataset(data_dir)
+    key = fingerprint(train[0] + val[0], backbone, views, seed)
+    cache_dir = os.path.join(cache_root, key)
+    meta_path = os.path.join(cache_dir, "meta.json")
+
+    if not os.path.exists(meta_path):
+        print(f"Extracting backbone features ({views} views) into {cache_dir}...")
+        started = time.perf_counter()
+        os.makedirs(cache_dir, exist_ok=True)
+        extractor = tf.keras.Sequential([backbone, GlobalAveragePooling2D()])
+
+        train_x = np.lib.format.open_memmap(os.path.join(cache_dir, "train_x.npy"), mode="w+",
+                                            dtype=np.float16, shape=(views, len(train[0]), FEATURE_DIM))
+        train_valid = np.zeros(len(train[0]), dtype=bool)
+        for view in range(views):
+            view_valid = np.zeros(len(train[0]), dtype=bool)
+            _extract(extractor, train[0], train_x[view], view_valid, view > 0, seed + view, batch_size)
+            train_valid = view_valid if view == 0 else train_valid & view_valid
+            print(f"  view {view + 1}/{views} done")
+        train_x.flush()
+
+        val_x = np.lib.format.open_memmap(os.path.join(cache_dir, "val_x.npy"), mode="w+",
+                                          dtype=np.float16, shape=(len(val[0]), FEATURE_DIM))
+        val_valid = np.zeros(len(val[0]), dtype=bool)
+        _extract(extractor, val[0], val_x, val_valid, False, seed, batch_size)
+        val_x.flush()
+
+        np.save(os.path.join(cache_dir, "train_y.npy"), np.array(train[1], dtype=np.int32))
+        np.save(os.path.join(cache_dir, "val_y.npy"), np.array(val[1], dtype=np.int32))
+        np.save(os.path.join(cache_dir, "train_valid.npy"), train_valid)
+        np.save(os.path.join(cache_dir, "val_valid.npy"), val_valid)
+        # Written last: a cache dir without meta.json is an interrupted run and gets redone
+        with open(meta_path, "w") as f:
+            json.dump({"classes": class_names, "views": views, "train": len(train[0]), "val": len(val[0])}, f)
+        print(f"Feature extraction took {time.perf_counter() - started:.1f}s")
+    else:
+        print(f"Using cached features from {cache_dir}")
+
+    train_valid = np.load(os.path.join(cache_dir, "train_valid.npy"))
+    val_valid = np.load(os.path.join(cache_dir, "val_valid.npy"))
+    return {
+        "classes": class_names,
+        # Left memory-mapped: each epoch only pages in the one view it samples
+        "train_x": np.load(os.path.join(cache_dir, "train_x.npy"), mmap_mode="r"),
+        "train_y": np.load(os.path.join(cache_dir, "train_y.npy")),
+        "train_rows": np.flatnonzero(train_valid),
+        "val_x": np.load(os.path.join(cache_dir, "val_x.npy"), mmap_mode="r")[val_valid],
+        "val_y": np.load(os.path.join(cache_dir, "val_y.npy"))[val_valid],
+    }
+
+
+def train_head_on_features(features, head_layers, epochs=10, learning_rate=1e-3, batch_size=32, seed=42, callbacks=None,
+                           class_weight=None):
+    """Trains the classification head alone on cached features.
+
+    `head_layers` are the same (unbuilt) layers train.py stacks on top of the
+    pooled backbone output, so the trained weights can be copied straight back.
+    Each epoch sees one randomly chosen view per image. The returned History
+    covers every epoch, like a single fit() would.
+    """
+    num_classes = len(features["classes"])
+    inputs = Input(shape=(FEATURE_DIM,))
+    x = inputs
+    for layer in head_layers:
+        x = layer(x)
+    head = Model(inputs=inputs, outputs=x)
+    head.compile(optimizer=Adam(learning_rate=learning_rate),
+                 loss='categorical_crossentropy',
+                 metrics=['accuracy'])
+
+    train_x, rows = features["train_x"], features["train_rows"]
+    val_data = (np.asarray(features["val_x"], dtype=np.float32), tf.one_hot(features["val_y"], num_classes))
+    y = tf.one_hot(features["train_y"][rows], num_classes)
+    rng = np.random.default_rng(seed)
+
+    started = time.perf_counter()
+    # One fit() per epoch (each samples fresh views); their per-epoch logs are merged here
+    history = tf.keras.callbacks.History()
+    history.set_model(head)
+    history.epoch = []
+    for epoch in range(epochs):
+        views = rng.integers(0, train_x.shape[0], size=len(rows))
+        x = np.asarray(train_x[views, rows], dtype=np.float32)
+        epoch_history = head.fit(x, y, batch_size=batch_size, epochs=epoch + 1, initial_epoch=epoch,
+                                 validation_data=val_data, callbacks=callbacks, class_weight=class_weight, verbose=2)
+        history.epoch.extend(epoch_history.epoch)
+        for name, values in epoch_history.history.items():
+            history.history.setdefault(name, []).extend(values)
+    print(f"Head training took {time.perf_counter() - started:.1f}s")
+    return head, history
+
+
+if __name__ == "__main__":
+    # Quick head-only sweeps: python feature_cache.py --lr 3e-4 --epochs 20
+    from tensorflow.keras.applications import MobileNetV2
+    from train import build_head_layers
+
+    parser = argparse.ArgumentParser(description="Train the classification head on cached backbone features.")
+    parser.add_argument("--views", type=int, default=DEFAULT_VIEWS)
+    parser.add_argument("--epochs", type=int, default=10)
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    backbone = MobileNetV2(weights='imagenet', include_top=False, input_shape=(224, 224, 3))
+    backbone.trainable = False
+    features = load_or_extract(backbone, views=args.views)
+    _, history = train_head_on_features(features, build_head_layers(len(features["classes"])),
+                                        epochs=args.epochs, learning_rate=args.lr, batch_size=args.batch_size)
+    print(json.dumps({k: round(float(v[-1]), 4) for k, v in history.history.items()}))
@@ -1,22 +1,104 @@
 import os
+import io
 import json
+import time
+import logging
+import threading
 import numpy as np
-import tensorflow as tf
-from tensorflow.keras.models import load_model
-from tensorflow.keras.preprocessing import image
+from PIL import Image
 import random
 
+from inference_backends import BACKENDS, artifact_path, load_runner
+from postprocess import PostProcessor, load_temperature
+from model_registry import resolve_model_dir
+
+logger = logging.getLogger("cattlesense.classifier")
+
+IMG_SIZE = (224, 224)
+MAX_BATCH_SIZE = 64
+
+# Test-time augmentation: off unless TTA_THRESHOLD > 0. Images whose top-1
+# confidence is below the threshold are re-scored on extra views (flips and
+# crops, in this order) and the softmax is averaged, as long as the estimated
+# cost fits in TTA_BUDGET_MS for the batch.
+TTA_THRESHOLD = float(os.environ.get("TTA_THRESHOLD", "0"))
+TTA_BUDGET_MS = float(os.environ.get("TTA_BUDGET_MS", "250"))
+TTA_VIEWS = ("flip", "center", "center_flip", "top_left", "top_right", "bottom_left", "bottom_right")
+TTA_CROP = 0.875  # crop side as a fraction of the image side
+
+# Calibrated top-1 below this -> "Unknown" (e.g. not a bovine); 0 disables.
+# The temperature is the model directory's calibration.json (fitted by train.py)
+REJECT_THRESHOLD = float(os.environ.get("REJECT_THRESHOLD", "0"))
+
+class NullMetrics:
+    # Instrumentation hook; the API swaps in one that feeds its /metrics endpoint
+    def observe(self, stage, seconds):
+        pass
+
+    def incr(self, event, n=1):
+        pass
+
+class MockPrediction(list):
+    # Top-k made up without the model (mock mode, or after a model error).
+    # Serialises like any result, but must never be cached as the image's answer
+    mock = True
+
 class BreedClassifier:
-    def __init__(self, model_path=r"..\..\models\cattle_model.keras", classes_path=r"..\..\models\classes.json"):
+    def __init__(self, model_path=None, classes_path=None,
+                 backend=None, int8=None, num_threads=None, load_model=True,
+                 calibration_path=None, reject_threshold=REJECT_THRESHOLD, model_dir=None, version=None):
+        # Backend is "keras", "tflite" or "onnx"; only keras pulls in TensorFlow
+        self.backend = (backend or os.environ.get("INFERENCE_BACKEND", "keras")).lower()
+        if self.backend not in BACKENDS:
+            raise ValueError(f"Unknown inference backend: {self.backend}")
+        if int8 is None:
+            int8 = os.environ.get("INFERENCE_INT8", "0") == "1"
+        self.num_threads = num_threads
+        # Every file comes from one model directory: the registry's active version by default
+        if model_dir is None:
+            version, model_dir = resolve_model_dir()
+        self.model_dir = model_dir
+        self.version = version or os.path.basename(os.path.normpath(model_dir))
+        if model_path is None:
+            model_path = artifact_path(model_dir, self.backend, int8)
+        if classes_path is None:
+            classes_path = os.path.join(model_dir, "classes.json")
+        if calibration_path is None:
+            calibration_path = os.path.join(model_dir, "calibration.json")
         self.model_path = os.path.abspath(os.path.join(os.path.dirname(__file__), model_path))
         self.classes_path = os.path.abspath(os.path.join(os.path.dirname(__file__), classes_path))
         self.model = None
         self.classes = {}
+        self.int_to_class = {}
         self.mock_classes = ["Murrah", "Gir", "Sahiwal", "Jaffarabadi", "Nili-Ravi"]
 
-        self._load_resources()
+        # Reused input tensor so each batch doesn't allocate a fresh float32 array
+        self._input_buffer = np.empty((MAX_BATCH_SIZE, IMG_SIZE[1], IMG_SIZE[0], 3), dtype=np.float32)
+        self._buffer_lock = threading.Lock()
+
+        self.tta_threshold = TTA_THRESHOLD
+        self.tta_budget = TTA_BUDGET_MS / 1000.0
+        self.tta_max_views = len(TTA_VIEWS)
+        # Running estimate of decode + forward seconds per extra view, for the budget
+        self._seconds_per_view = None
+        self.tta_stats = {"rescored": 0, "views": 0, "skipped_budget": 0}
+        # observe(stage, seconds) for decode / inference / postprocess,
+        # incr(event) for mock_fallback / decode_error / model_error
+        self.metrics = NullMetrics()
+
+        # load_model=False gives a classes-only instance for pre/post-processing;
+        # call load() later (e.g. from a background thread) to bring the model up
+        self._load_classes()
+        self.calibration_path = calibration_path
+        self.postprocessor = PostProcessor(
+            [self.int_to_class.get(i, "Unknown") for i in range(max(self.int_to_class, default=-1) + 1)],
+            temperature=load_temperature(calibration_path),
+            reject_threshold=reject_threshold,
+        )
+        if load_model:
+            self.load()
 
-    def _load_resources(self):
+    def _load_classes(self):
         # Try loading classes
         if os.path.exists(self.classes_path):
             try:
@@ -24,58 +106,248 @@ class BreedClassifier:
                     self.classes = json.load(f)
                     # JSON keys are strings ("0"), we need indices as ints (0)
                     self.int_to_class = {int(k): v for k, v in self.classes.items()}
-                print(f"Loaded {len(self.classes)} classes.")
-            except Exception as e:
-                print(f"Error loading classes: {e}")
+                logger.info(f"Loaded {len(self.classes)} classes", extra={"classes_path": self.classes_path})
+            except Exception:
+                logger.exception("Could not load classes", extra={"classes_path": self.classes_path})
+
+    def load(self):
+        # Exported artifact missing - fall back to the full Keras model
+        if self.backend != "keras" and not os.path.exists(self.model_path):
+            logger.warning(f"No {self.backend} model, falling back to keras", extra={"model_path": self.model_path})
+            self.backend = "keras"
+            self.model_path = artifact_path(self.model_dir, "keras")
 
         # Try loading model
         if os.path.exists(self.model_path):
             try:
-                print(f"Loading TensorFlow model from: {self.model_path}")
-                self.model = load_model(self.model_path)
-                print("Model loaded successfully.")
-            except Exception as e:
-                print(f"Error loading model: {e}")
+                logger.info(f"Loading {self.backend} model", extra={"model_path": self.model_path})
+                self.model = load_runner(self.backend, self.model_path, self.num_threads)
+                logger.info("Model loaded", extra={"model_path": self.model_path})
+            except Exception:
+                logger.exception("Could not load model", extra={"model_path": self.model_path})
+        else:
+            logger.warning("Model file not found, using mock mode", extra={"model_path": self.model_path})
+
+    def warm_up(self, batch_sizes=(1, 8)):
+        # Run throwaway batches so graph tracing / tensor allocation isn't
+        # paid by the first real request
+        if self.model is None:
+            return
+        for n in batch_sizes:
+            self.model(np.zeros((n, IMG_SIZE[1], IMG_SIZE[0], 3), dtype=np.float32))
+        self.measure_tta_cost(self._forward)
+
+    def measure_tta_cost(self, forward):
+        # Seeds the per-view cost estimate from a synthetic photo, so the first real
+        # TTA batch already respects the budget. forward as in apply_tta()
+        if self.tta_threshold <= 0:
+            return
+        noise = np.random.default_rng(0).integers(0, 256, (960, 1280, 3), dtype=np.uint8)
+        buf = io.BytesIO()
+        Image.fromarray(noise).save(buf, format="JPEG")
+        photo = buf.getvalue()
+        forward(self.tta_views(photo, self.tta_max_views))  # first pass pays one-off allocation
+        started = time.perf_counter()
+        views = self.tta_views(photo, self.tta_max_views)
+        forward(views)
+        self._seconds_per_view = (time.perf_counter() - started) / len(views)
+
+    def _load_image(self, item):
+        # item can be a file path, raw encoded bytes or an already decoded array
+        if isinstance(item, np.ndarray):
+            if item.shape[:2] == (IMG_SIZE[1], IMG_SIZE[0]):
+                return item
+            img = Image.fromarray(item.astype(np.uint8))
+        else:
+            if isinstance(item, (bytes, bytearray, memoryview)):
+                item = io.BytesIO(item)
+            img = Image.open(item)
+            # JPEG draft mode decodes at 1/2, 1/4 or 1/8 scale (still >= target),
+            # so a 12MP phone photo never gets fully decoded
+            img.draft('RGB', IMG_SIZE)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        # Nearest matches keras load_img, which the model was trained with
+        return img.resize(IMG_SIZE, Image.NEAREST)
+
+    def tta_views(self, item, num_views):
+        # Up to num_views augmented uint8 arrays of item, in TTA_VIEWS order
+        if isinstance(item, np.ndarray):
+            img = Image.fromarray(item.astype(np.uint8))
         else:
-            print(f"Model file not found at: {self.model_path}")
-            print("Using Mock mode.")
+            if isinstance(item, (bytes, bytearray, memoryview)):
+                item = io.BytesIO(item)
+            img = Image.open(item)
+            # Crops need a bit more resolution than the plain resize
+            img.draft('RGB', (int(IMG_SIZE[0] / TTA_CROP) + 1, int(IMG_SIZE[1] / TTA_CROP) + 1))
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        w, h = img.size
+        cw, ch = int(w * TTA_CROP), int(h * TTA_CROP)
+        boxes = {
+            "center": ((w - cw) // 2, (h - ch) // 2),
+            "top_left": (0, 0),
+            "top_right": (w - cw, 0),
+            "bottom_left": (0, h - ch),
+            "bottom_right": (w - cw, h - ch),
+        }
+        views = []
+        for name in TTA_VIEWS[:num_views]:
+            base = name.replace("_flip", "")
+            if base == "flip":
+                view = img
+            else:
+                x, y = boxes[base]
+                view = img.crop((x, y, x + cw, y + ch))
+            view = view.resize(IMG_SIZE, Image.NEAREST)
+            if name.endswith("flip"):
+                view = view.transpose(Image.FLIP_LEFT_RIGHT)
+            views.append(np.asarray(view))
+        return views
+
+    def apply_tta(self, items, probs, failed, forward, started):
+        """Re-scores low-confidence rows of probs in place with averaged TTA views.
+
+        forward(list_of_uint8_arrays) -> (n, num_classes) probabilities; every
+        view of every low-confidence item goes through it as one batch.
+        started is when this batch began, so the budget covers the whole call.
+        """
+        if self.tta_threshold <= 0:
+            return probs
+        low = [i for i in range(len(items)) if i not in failed and probs[i].max() < self.tta_threshold]
+        if not low:
+            return probs
+        remaining = self.tta_budget - (time.perf_counter() - started)
+        per_view = self._seconds_per_view
+        # No measured cost yet (warm_up() seeds it): no extra views rather than an unbounded number
+        num_views = 0 if not per_view else min(self.tta_max_views, int(remaining / (per_view * len(low))))
+        if num_views < 1:
+            self.tta_stats["skipped_budget"] += len(low)
+            return probs
+
+        tta_started = time.perf_counter()
+        views, owners = [], []
+        for i in low:
+            try:
+                item_views = self.tta_views(items[i], num_views)
+            except Exception:
+                continue
+            views.extend(item_views)
+            owners.extend([i] * len(item_views))
+        if not views:
+            return probs
+        view_probs = np.asarray(forward(views))
+        owners = np.asarray(owners)
+        for i in low:
+            rows = view_probs[owners == i]
+            probs[i] = (probs[i] + rows.sum(axis=0)) / (len(rows) + 1)
+
+        cost = (time.perf_counter() - tta_started) / len(views)
+        self._seconds_per_view = cost if self._seconds_per_view is None else 0.8 * self._seconds_per_view + 0.2 * cost
+        self.tta_stats["rescored"] += len(low)
+        self.tta_stats["views"] += len(views)
+        return probs
+
+    def _forward(self, items):
+        # Probabilities for already decoded items, chunked through the shared buffer
+        out = []
+        for start in range(0, len(items), MAX_BATCH_SIZE):
+            with self._buffer_lock:
+                batch, _ = self.preprocess_batch(items[start:start + MAX_BATCH_SIZE])
+                out.append(np.array(self.model(batch)))
+        return np.concatenate(out)
+
+    def preprocess_batch(self, items, out=None):
+        # Decodes and normalises items into out (defaults to the shared input buffer).
+        # Returns (batch, failed) - a bad image zero-fills its slot and lands in
+        # failed as {index: error} instead of sinking the whole batch
+        batch = (self._input_buffer if out is None else out)[:len(items)]
+        failed = {}
+        for i, item in enumerate(items):
+            try:
+                pixels = np.asarray(self._load_image(item))
+            except Exception as e:
+                batch[i] = 0.0
+                failed[i] = ValueError(f"Could not decode image: {e}")
+                continue
+            if pixels.dtype == np.uint8:
+                np.multiply(pixels, 1.0 / 255.0, out=batch[i], casting='unsafe')  # Normalize
+            else:
+                batch[i] = pixels  # float arrays are assumed already normalised
+        return batch, failed
+
+    def _single(self, item, top_k=3):
+        result = self.predict_batch([item], top_k)[0]
+        if isinstance(result, Exception):
+            raise result
+        return result
 
     def predict(self, image_path):
-        # REAL INFERENCE
+        return self._single(image_path)
+
+    def predict_bytes(self, data, top_k=3):
+        return self._single(data, top_k)
+
+    def predict_array(self, array, top_k=3):
+        return self._single(array, top_k)
+
+    def predict_batch(self, items, top_k=3, with_embeddings=False):
+        # REAL INFERENCE - one forward pass per MAX_BATCH_SIZE chunk.
+        # Items that fail to decode get their exception in place of a result.
+        # with_embeddings=True returns (results, embeddings): the (n, EMBEDDING_DIM)
+        # pooled features of the same pass, None in mock mode
         if self.model and self.int_to_class:
             try:
-                print(f"Processing image at: {image_path}")
-                # Preprocess
-                img = image.load_img(image_path, target_size=(224, 224))
-                img_array = image.img_to_array(img)
-                img_array = np.expand_dims(img_array, axis=0)
-                img_array /= 255.0  # Normalize
-
-                print("Running mode.predict()...")
-                # Predict
-                predictions = self.model.predict(img_array)
-                print("Raw predictions shape:", predictions.shape)
-                
-                top_indices = predictions[0].argsort()[-3:][::-1] # Top 3
-                
+                started = time.perf_counter()
                 results = []
-                for idx in top_indices:
-                    confidence = float(predictions[0][idx])
-                    breed_name = self.int_to_class.get(idx, "Unknown")
-                    results.append({"breed": breed_name, "confidence": round(confidence, 2)})
-                
-                print(f"Formatted results: {results}")
+                embeddings = []
+                for start in range(0, len(items), MAX_BATCH_SIZE):
+                    chunk = items[start:start + MAX_BATCH_SIZE]
+                    with self._buffer_lock:
+                        t0 = time.perf_counter()
+                        batch, failed = self.preprocess_batch(chunk)
+                        t1 = time.perf_counter()
+                        predictions, chunk_embeddings = self.predict_outputs(batch)
+                    embeddings.append(chunk_embeddings)
+                    predictions = self.apply_tta(chunk, predictions, failed, self._forward, started)
+                    t2 = time.perf_counter()
+                    formatted = self.postprocessor.format(predictions, top_k)
+                    self.metrics.observe("decode", t1 - t0)
+                    self.metrics.observe("inference", t2 - t1)
+                    self.metrics.observe("postprocess", time.perf_counter() - t2)
+                    if failed:
+                        self.metrics.incr("decode_error", len(failed))
+                    results.extend(failed.get(i, row) for i, row in enumerate(formatted))
+                if with_embeddings:
+                    return results, None if any(e is None for e in embeddings) else np.concatenate(embeddings)
                 return results
-            except Exception as e:
-                print(f"Inference failed: {e}. Falling back to mock.")
-                import traceback
-                traceback.print_exc()
-        
+            except Exception:
+                logger.exception("Inference failed, falling back to mock")
+                self.metrics.incr("model_error")
+
         # MOCK FALLBACK
-        print("Returning simulated prediction.")
+        self.metrics.incr("mock_fallback", len(items))
+        results = [self._mock_prediction() for _ in items]
+        return (results, None) if with_embeddings else results
+
+    def predict_probs(self, batch):
+        # Raw softmax for an already preprocessed batch; None in mock mode
+        if self.model is None:
+            return None
+        return self.model(batch)
+
+    def predict_outputs(self, batch):
+        # (softmax, pooled embeddings) for an already preprocessed batch, from one
+        # forward pass; embeddings is None for an artifact exported without them
+        if self.model is None:
+            return None, None
+        probs, embeddings = self.model.forward(batch)
+        return np.array(probs), None if embeddings is None else np.array(embeddings)
+
+    def _mock_prediction(self):
         top_breeds = random.sample(self.mock_classes, 3)
-        return [
+        return MockPrediction([
             {"breed": top_breeds[0], "confidence": 0.88},
             {"breed": top_breeds[1], "confidence": 0.08},
             {"breed": top_breeds[2], "confidence": 0.04}
-        ]
+        ])
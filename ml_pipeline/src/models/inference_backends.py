@@ -0,0 +1,132 @@
+import os
+import numpy as np
+
+# Each runner takes a float32 NHWC batch normalised to [0, 1] and returns
+# softmax probabilities as an (N, num_classes) numpy array. forward() also
+# returns the (N, EMBEDDING_DIM) pooled MobileNetV2 features, or None for an
+# artifact exported without them. Only the keras runner needs TensorFlow;
+# the others use the lightweight runtimes.
+
+BACKENDS = ("keras", "tflite", "onnx")
+EMBEDDING_DIM = 1280
+
+
+def with_embedding_output(model):
+    # Same model with the GlobalAveragePooling2D output as a second output
+    import tensorflow as tf
+    pooled = [layer for layer in model.layers if isinstance(layer, tf.keras.layers.GlobalAveragePooling2D)]
+    if len(model.outputs) > 1 or not pooled:
+        return model
+    return tf.keras.Model(model.inputs, [model.outputs[0], pooled[-1].output])
+
+
+class KerasRunner:
+    def __init__(self, model_path, num_threads=None):
+        import tensorflow as tf
+        from tensorflow.keras.models import load_model
+        if num_threads:
+            # Must happen before TF initialises its thread pools
+            tf.config.threading.set_intra_op_parallelism_threads(num_threads)
+            tf.config.threading.set_inter_op_parallelism_threads(1)
+        self.model = with_embedding_output(load_model(model_path))
+
+    def forward(self, batch):
+        # Calling the model directly skips model.predict()'s per-call
+        # setup, which dominates at small batch sizes
+        out = self.model(batch, training=False)
+        if isinstance(out, (list, tuple)):
+            return np.asarray(out[0]), np.asarray(out[1])
+        return np.asarray(out), None
+
+    def __call__(self, batch):
+        return self.forward(batch)[0]
+
+
+class TFLiteRunner:
+    def __init__(self, model_path, num_threads=None):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            from tensorflow.lite import Interpreter
+        self.interpreter = Interpreter(model_path=model_path, num_threads=num_threads)
+        self.interpreter.allocate_tensors()
+        self._find_tensors()
+        self._batch_size = self.input["shape"][0]
+
+    def _find_tensors(self):
+        # Outputs are told apart by width, their order isn't guaranteed
+        self.input = self.interpreter.get_input_details()[0]
+        outputs = self.interpreter.get_output_details()
+        self.output = next(o for o in outputs if o["shape"][-1] != EMBEDDING_DIM)
+        self.embedding_output = next((o for o in outputs if o["shape"][-1] == EMBEDDING_DIM), None)
+
+    def _get(self, detail):
+        out = self.interpreter.get_tensor(detail["index"])
+        if detail["dtype"] in (np.int8, np.uint8):
+            scale, zero_point = detail["quantization"]
+            out = (out.astype(np.float32) - zero_point) * scale
+        return out
+
+    def _resize(self, batch_size):
+        # Re-allocating is expensive, so only do it when the batch size changes
+        if batch_size != self._batch_size:
+            self.interpreter.resize_tensor_input(self.input["index"], [batch_size, *self.input["shape"][1:]])
+            self.interpreter.allocate_tensors()
+            self._find_tensors()
+            self._batch_size = batch_size
+
+    def forward(self, batch):
+        self._resize(len(batch))
+        dtype = self.input["dtype"]
+        if dtype in (np.int8, np.uint8):
+            # Fully quantized model: map [0, 1] floats onto the int8 input scale
+            scale, zero_point = self.input["quantization"]
+            batch = np.clip(np.round(batch / scale + zero_point), np.iinfo(dtype).min, np.iinfo(dtype).max).astype(dtype)
+        self.interpreter.set_tensor(self.input["index"], batch)
+        self.interpreter.invoke()
+        embeddings = self._get(self.embedding_output) if self.embedding_output is not None else None
+        return self._get(self.output), embeddings
+
+    def __call__(self, batch):
+        return self.forward(batch)[0]
+
+
+class OnnxRunner:
+    def __init__(self, model_path, num_threads=None):
+        import onnxruntime as ort
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(model_path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        widths = [o.shape[-1] for o in self.session.get_outputs()]
+        self.output_index = next(i for i, w in enumerate(widths) if w != EMBEDDING_DIM)
+        self.embedding_index = next((i for i, w in enumerate(widths) if w == EMBEDDING_DIM), None)
+
+    def forward(self, batch):
+        out = self.session.run(None, {self.input_name: batch})
+        return out[self.output_index], (out[self.embedding_index] if self.embedding_index is not None else None)
+
+    def __call__(self, batch):
+        return self.forward(batch)[0]
+
+
+def artifact_path(models_dir, backend, int8=False):
+    suffix = "_int8" if int8 else ""
+    if backend == "keras":
+        return os.path.join(models_dir, "cattle_model.keras")
+    if backend == "tflite":
+        return os.path.join(models_dir, f"cattle_model{suffix}.tflite")
+    if backend == "onnx":
+        return os.path.join(models_dir, f"cattle_model{suffix}.onnx")
+    raise ValueError(f"Unknown inference backend: {backend}")
+
+
+def load_runner(backend, model_path, num_threads=None):
+    if backend == "keras":
+        return KerasRunner(model_path, num_threads)
+    if backend == "tflite":
+        return TFLiteRunner(model_path, num_threads)
+    if backend == "onnx":
+        return OnnxRunner(model_path, num_threads)
+    raise ValueError(f"Unknown inference backend: {backend}")
@@ -0,0 +1,158 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+
+# Versioned models:
+#   models/registry.json            which version serves, which one shadows
+#   models/versions/<version>/      cattle_model.keras, classes.json, calibration.json,
+#                                   exported .tflite/.onnx artifacts
+# The API watches registry.json and hot-swaps when "active" changes. Without a
+# registry the flat models/ directory is served as version "unversioned".
+MODELS_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..", "models"))
+REGISTRY_PATH = os.path.join(MODELS_DIR, "registry.json")
+VERSIONS_DIR = os.path.join(MODELS_DIR, "versions")
+UNVERSIONED = "unversioned"
+# Serve exactly this directory and ignore the registry (dev, benchmarks)
+MODEL_DIR_OVERRIDE = os.environ.get("MODEL_DIR", "")
+
+
+def new_version_id():
+    return time.strftime("v%Y%m%d-%H%M%S")
+
+
+def version_dir(version, versions_dir=VERSIONS_DIR):
+    return os.path.join(versions_dir, version)
+
+
+def read_registry(path=REGISTRY_PATH):
+    registry = {"active": None, "candidate": None, "shadow_fraction": 0.0, "versions": {}}
+    if os.path.exists(path):
+        with open(path) as f:
+            registry.update(json.load(f))
+    return registry
+
+
+def write_registry(registry, path=REGISTRY_PATH):
+    # Written to a temp file and renamed, so the API never reads half a registry
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(registry, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+def resolve_model_dir(role="active", path=REGISTRY_PATH):
+    """(version, directory) to serve for role "active" or "candidate"; (None, None) if unset."""
+    if MODEL_DIR_OVERRIDE:
+        return (os.path.basename(os.path.normpath(MODEL_DIR_OVERRIDE)), MODEL_DIR_OVERRIDE) if role == "active" else (None, None)
+    registry = read_registry(path)
+    version = registry.get(role)
+    if version:
+        return version, version_dir(version)
+    if role == "active":
+        return UNVERSIONED, MODELS_DIR
+    return None, None
+
+
+def register_version(version, metrics=None, activate=False, candidate=False, shadow_fraction=None,
+                     path=REGISTRY_PATH):
+    registry = read_registry(path)
+    registry["versions"][version] = {"created": time.strftime("%Y-%m-%dT%H:%M:%S"), "metrics": metrics or {}}
+    if activate:
+        _set_active(registry, version)
+    elif candidate:
+        registry["candidate"] = version
+    if shadow_fraction is not None:
+        registry["shadow_fraction"] = shadow_fraction
+    write_registry(registry, path)
+    return registry
+
+
+def _set_active(registry, version):
+    if registry.get("active") != version:
+        registry["previous"] = registry.get("active")
+    registry["active"] = version
+    if registry.get("candidate") == version:
+        registry["candidate"] = None
+
+
+def activate_version(version, path=REGISTRY_PATH):
+    registry = read_registry(path)
+    if version not in registry["versions"]:
+        raise ValueError(f"Unknown version {version}; run `list`")
+    _set_active(registry, version)
+    write_registry(registry, path)
+    return registry
+
+
+def rollback(path=REGISTRY_PATH):
+    # Re-activates the previous version; rolling back twice returns to where you started
+    registry = read_registry(path)
+    if not registry.get("previous"):
+        raise ValueError("No previous version to roll back to")
+    _set_active(registry, registry["previous"])
+    write_registry(registry, path)
+    return registry
+
+
+def import_unversioned(version=None, path=REGISTRY_PATH):
+    # Copies the flat models/ files into versions/<version> so an existing model joins the registry
+    version = version or new_version_id()
+    target = version_dir(version)
+    os.makedirs(target, exist_ok=True)
+    for name in os.listdir(MODELS_DIR):
+        src = os.path.join(MODELS_DIR, name)
+        if os.path.isfile(src) and name != os.path.basename(path) and name.startswith(("cattle_model", "classes", "calibration")):
+            shutil.copy2(src, os.path.join(target, name))
+    return register_version(version, activate=True, path=path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the versioned model registry the API hot-swaps from.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("list", help="show versions and which one is active / shadowing")
+    activate = commands.add_parser("activate", help="serve VERSION (the API swaps it in without a restart)")
+    activate.add_argument("version")
+    commands.add_parser("rollback", help="re-activate the previously active version")
+    candidate = commands.add_parser("candidate", help="shadow-score a fraction of traffic on VERSION")
+    candidate.add_argument("version")
+    candidate.add_argument("--fraction", type=float, default=0.05, help="share of batches also scored by VERSION")
+    commands.add_parser("clear-candidate", help="stop shadow scoring")
+    imp = commands.add_parser("import-unversioned", help="move the flat models/ files into a registry version")
+    imp.add_argument("--version", default=None)
+    args = parser.parse_args()
+
+    registry = read_registry()
+    if args.command == "list":
+        for version, info in sorted(registry["versions"].items()):
+            role = "active" if version == registry["active"] else "candidate" if version == registry["candidate"] else ""
+            print(f"{version:<20} {role:<10} {info.get('created', ''):<20} {json.dumps(info.get('metrics', {}))}")
+        if registry["candidate"]:
+            print(f"Shadow fraction: {registry['shadow_fraction']}")
+        return
+    if args.command == "import-unversioned":
+        registry = import_unversioned(args.version)
+        print(f"Imported the flat model as {registry['active']}")
+        return
+
+    if args.command in ("activate", "rollback"):
+        try:
+            registry = activate_version(args.version) if args.command == "activate" else rollback()
+        except ValueError as e:
+            sys.exit(str(e))
+    else:
+        if args.command == "candidate" and args.version not in registry["versions"]:
+            sys.exit(f"Unknown version {args.version}; run `list`")
+        if args.command == "candidate":
+            registry["candidate"] = args.version
+            registry["shadow_fraction"] = args.fraction
+        elif args.command == "clear-candidate":
+            registry["candidate"] = None
+        write_registry(registry)
+    print(f"Active: {registry['active']}, candidate: {registry['candidate']} ({registry['shadow_fraction']:.0%} shadowed)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+import os
+import json
+import logging
+import numpy as np
+
+logger = logging.getLogger("cattlesense.postprocess")
+
+UNKNOWN_LABEL = "Unknown"
+CONFIDENCE_DECIMALS = 2
+
+
+def apply_temperature(probs, temperature):
+    # Softmax(log(p) / T) for a whole (N, C) batch; T > 1 softens overconfident outputs
+    if temperature == 1.0:
+        return probs
+    logits = np.log(np.clip(probs, 1e-12, 1.0)) / temperature
+    logits -= logits.max(axis=1, keepdims=True)
+    out = np.exp(logits)
+    out /= out.sum(axis=1, keepdims=True)
+    return out
+
+
+def top_k(probs, k):
+    """(indices, confidences), both (N, k), best first.
+
+    argpartition picks the k largest per row in O(C); only those k get sorted.
+    """
+    k = min(k, probs.shape[1])
+    part = np.argpartition(probs, -k, axis=1)[:, -k:]
+    part_probs = np.take_along_axis(probs, part, axis=1)
+    order = np.argsort(-part_probs, axis=1)
+    return np.take_along_axis(part, order, axis=1), np.take_along_axis(part_probs, order, axis=1)
+
+
+def nll(probs, labels, temperature=1.0):
+    scaled = apply_temperature(probs, temperature)
+    return float(-np.mean(np.log(np.clip(scaled[np.arange(len(labels)), labels], 1e-12, 1.0))))
+
+
+def expected_calibration_error(probs, labels, bins=15):
+    conf = probs.max(axis=1)
+    correct = probs.argmax(axis=1) == labels
+    edges = np.linspace(0.0, 1.0, bins + 1)
+    which = np.clip(np.digitize(conf, edges[1:-1]), 0, bins - 1)
+    ece = 0.0
+    for b in range(bins):
+        mask = which == b
+        if mask.any():
+            ece += mask.mean() * abs(conf[mask].mean() - correct[mask].mean())
+    return float(ece)
+
+
+def fit_temperature(probs, labels, low=0.05, high=10.0, iterations=60):
+    """Temperature minimising validation NLL (golden-section search on log T)."""
+    probs = np.asarray(probs, dtype=np.float64)
+    labels = np.asarray(labels)
+    a, b = np.log(low), np.log(high)
+    ratio = (np.sqrt(5) - 1) / 2
+    c, d = b - ratio * (b - a), a + ratio * (b - a)
+    fc, fd = nll(probs, labels, np.exp(c)), nll(probs, labels, np.exp(d))
+    for _ in range(iterations):
+        if fc < fd:
+            b, d, fd = d, c, fc
+            c = b - ratio * (b - a)
+            fc = nll(probs, labels, np.exp(c))
+        else:
+            a, c, fc = c, d, fd
+            d = a + ratio * (b - a)
+            fd = nll(probs, labels, np.exp(d))
+    return float(np.exp((a + b) / 2))
+
+
+def save_calibration(probs, labels, path):
+    # Fits T on validation softmax outputs and writes it (plus before/after metrics) to path
+    probs = np.asarray(probs, dtype=np.float64)
+    labels = np.asarray(labels)
+    temperature = fit_temperature(probs, labels)
+    calibrated = apply_temperature(probs, temperature)
+    report = {
+        "temperature": round(temperature, 4),
+        "samples": int(len(labels)),
+        "nll_before": round(nll(probs, labels), 4),
+        "nll_after": round(nll(probs, labels, temperature), 4),
+        "ece_before": round(expected_calibration_error(probs, labels), 4),
+        "ece_after": round(expected_calibration_error(calibrated, labels), 4),
+    }
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def load_temperature(path):
+    if not os.path.exists(path):
+        return 1.0
+    try:
+        with open(path) as f:
+            return float(json.load(f)["temperature"])
+    except Exception:
+        logger.exception("Ignoring unreadable calibration file", extra={"calibration_path": path})
+        return 1.0
+
+
+class PostProcessor:
+    """Turns a (N, num_classes) softmax batch into top-k predictions in one pass.
+
+    arrays() gives compact (indices, confidences, rejected) arrays; format()
+    converts those once into the API's [{"breed", "confidence"}, ...] lists.
+    A row whose calibrated top-1 confidence is below reject_threshold is
+    answered with an "Unknown" entry first, followed by its candidates.
+    """
+
+    def __init__(self, class_names, top_k=3, temperature=1.0, reject_threshold=0.0):
+        self.class_names = np.array(list(class_names) + [UNKNOWN_LABEL], dtype=object)
+        self.top_k = top_k
+        self.temperature = temperature
+        self.reject_threshold = reject_threshold
+
+    def arrays(self, probs, k=None):
+        probs = apply_temperature(np.asarray(probs, dtype=np.float32), self.temperature)
+        indices, confidences = top_k(probs, k or self.top_k)
+        rejected = confidences[:, 0] < self.reject_threshold
+        return indices, confidences, rejected
+
+    def format(self, probs, k=None):
+        indices, confidences, rejected = self.arrays(probs, k)
+        # Out-of-range indices (classes.json shorter than the model output) map to Unknown
+        indices = np.where(indices < len(self.class_names) - 1, indices, len(self.class_names) - 1)
+        names = self.class_names[indices].tolist()
+        confs = np.round(confidences.astype(np.float64), CONFIDENCE_DECIMALS).tolist()
+        results = []
+        for row_names, row_confs, reject in zip(names, confs, rejected.tolist()):
+            row = [{"breed": n, "confidence": c} for n, c in zip(row_names, row_confs)]
+            if reject:
+                row.insert(0, {"breed": UNKNOWN_LABEL, "confidence": row_confs[0]})
+            results.append(row)
+        return results
@@ -1,4 +1,6 @@
 import os
+import sys
+import numpy as np
 import tensorflow as tf
 from tensorflow.keras.applications import MobileNetV2
 from tensorflow.keras.layers import Dense, GlobalAveragePooling2D, Dropout, BatchNormalization
@@ -6,26 +8,66 @@ from tensorflow.keras.models import Model
 from tensorflow.keras.preprocessing.image import ImageDataGenerator
 from tensorflow.keras.optimizers import Adam
 from tensorflow.keras.callbacks import ModelCheckpoint, ReduceLROnPlateau, EarlyStopping
+import argparse
 import json
 
+from data_pipeline import build_datasets, build_shard_datasets, list_dataset, ThroughputCallback
+from feature_cache import load_or_extract, train_head_on_features
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "models"))
+from postprocess import save_calibration
+from model_registry import new_version_id, version_dir, register_version, resolve_model_dir
+
 # Configuration
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DATA_DIR = os.path.join(BASE_DIR, "data", "cattle")
-MODELS_DIR = os.path.join(BASE_DIR, "models")
-MODEL_SAVE_PATH = os.path.join(MODELS_DIR, "cattle_model.keras")  # Changed to .keras
-CLASSES_SAVE_PATH = os.path.join(MODELS_DIR, "classes.json")
+# Each run writes a new models/versions/<version>/ directory (see model_registry.py)
+MODEL_FILENAME = "cattle_model.keras"
+CLASSES_FILENAME = "classes.json"
+CALIBRATION_FILENAME = "calibration.json"
 IMG_SIZE = (224, 224)
 BATCH_SIZE = 32
 TOTAL_EPOCHS = 25 
+CACHE_DIR = os.path.join(BASE_DIR, "data", "cache")
+SHARDS_DIR = os.path.join(BASE_DIR, "data", "shards")
 
-def train_model():
-    # Ensure dirs exist
-    if not os.path.exists(MODELS_DIR):
-        os.makedirs(MODELS_DIR)
+class SplitFileSequence(tf.keras.utils.Sequence):
+    """flow_from_directory() over a given file list.
 
-    print(f"TensorFlow Version: {tf.__version__}")
-    
-    # 1. Data Augmentation
+    flow_from_directory() can only split by position in the listing; this
+    takes the list_dataset() split instead and otherwise does the same work:
+    one PIL decode per image, ImageDataGenerator transforms, one-hot labels.
+    """
+
+    def __init__(self, datagen, paths, labels, num_classes, batch_size=BATCH_SIZE, shuffle=True):
+        super().__init__()
+        self.datagen = datagen
+        self.paths = paths
+        self.labels = np.asarray(labels)
+        self.num_classes = num_classes
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.samples = len(paths)
+        self.order = np.arange(self.samples)
+        self.on_epoch_end()
+
+    def __len__(self):
+        return -(-self.samples // self.batch_size)
+
+    def __getitem__(self, i):
+        idx = self.order[i * self.batch_size:(i + 1) * self.batch_size]
+        x = np.empty((len(idx), *IMG_SIZE, 3), dtype=np.float32)
+        for j, k in enumerate(idx):
+            img = tf.keras.utils.img_to_array(tf.keras.utils.load_img(self.paths[k], target_size=IMG_SIZE))
+            x[j] = self.datagen.standardize(self.datagen.random_transform(img))
+        return x, tf.keras.utils.to_categorical(self.labels[idx], self.num_classes)
+
+    def on_epoch_end(self):
+        if self.shuffle:
+            np.random.shuffle(self.order)
+
+def load_generators():
+    # Legacy single-threaded input path, kept for comparison (--pipeline generator)
     train_datagen = ImageDataGenerator(
         rescale=1./255,
         rotation_range=30,
@@ -36,49 +78,119 @@ def train_model():
         horizontal_flip=True,
         fill_mode='nearest',
         brightness_range=[0.8, 1.2],
-        validation_split=0.2
     )
 
     print("Loading Data Generators...")
-    train_generator = train_datagen.flow_from_directory(
+    class_names, (train_paths, train_labels), (val_paths, val_labels) = list_dataset(DATA_DIR, 0.2)
+    print(f"Found {len(train_paths)} training and {len(val_paths)} validation images "
+          f"belonging to {len(class_names)} classes.")
+    train_generator = SplitFileSequence(train_datagen, train_paths, train_labels, len(class_names))
+    validation_generator = SplitFileSequence(train_datagen, val_paths, val_labels, len(class_names))
+
+    classes = {i: name for i, name in enumerate(class_names)}
+    return train_generator, validation_generator, classes, train_generator.samples
+
+def load_datasets(cache=False):
+    # tf.data: parallel decode, batched augmentation, optional on-disk cache of resized images
+    train_ds, val_ds, class_names, n_train, n_val = build_datasets(
         DATA_DIR,
-        target_size=IMG_SIZE,
+        img_size=IMG_SIZE,
         batch_size=BATCH_SIZE,
-        class_mode='categorical',
-        subset='training'
+        validation_split=0.2,
+        cache_dir=CACHE_DIR if cache else None,
     )
+    classes = {i: name for i, name in enumerate(class_names)}
+    return train_ds, val_ds, classes, n_train
 
-    validation_generator = train_datagen.flow_from_directory(
-        DATA_DIR,
-        target_size=IMG_SIZE,
+def load_shards():
+    # Pre-resized TFRecord shards from build_shards.py: sequential reads, fixed split
+    train_ds, val_ds, class_names, n_train, n_val = build_shard_datasets(
+        SHARDS_DIR,
+        img_size=IMG_SIZE,
         batch_size=BATCH_SIZE,
-        class_mode='categorical',
-        subset='validation'
     )
+    classes = {i: name for i, name in enumerate(class_names)}
+    return train_ds, val_ds, classes, n_train
+
+def load_data(pipeline="tfdata", cache=False):
+    if pipeline == "generator":
+        return load_generators()
+    if pipeline == "shards":
+        return load_shards()
+    return load_datasets(cache)
+
+def calibrate_model(validation_data, model_dir, steps=None):
+    # Temperature scaling fitted on the validation split, for the saved (best) model;
+    # BreedClassifier reads calibration.json from the same directory
+    model = tf.keras.models.load_model(os.path.join(model_dir, MODEL_FILENAME))
+    probs, labels = [], []
+    for i, (x, y) in enumerate(validation_data):
+        if steps is not None and i >= steps:
+            break
+        probs.append(model.predict_on_batch(x))
+        labels.append(np.argmax(y, axis=1))
+    report = save_calibration(np.concatenate(probs), np.concatenate(labels), os.path.join(model_dir, CALIBRATION_FILENAME))
+    print(f"Calibration: T={report['temperature']}, ECE {report['ece_before']} -> {report['ece_after']}")
+    return report
+
+def best_val_accuracy(*histories):
+    # Phase 1 on cached features returns a history of the head only, still with val_accuracy
+    values = [v for h in histories if h is not None for v in getattr(h, "history", {}).get("val_accuracy", [])]
+    return round(float(max(values)), 4) if values else None
+
+def build_head_layers(num_classes):
+    # Classification head on top of the pooled MobileNetV2 features
+    return [
+        Dense(1280, activation='relu'),
+        BatchNormalization(),
+        Dropout(0.5),
+        Dense(num_classes, activation='softmax'),
+    ]
+
+def train_model(pipeline="tfdata", cache=False, head_from_features=False, feature_views=4, class_weights_path=None,
+                version=None, activate=False, shadow_fraction=None):
+    version = version or new_version_id()
+    out_dir = version_dir(version)
+    os.makedirs(out_dir, exist_ok=True)
+    model_save_path = os.path.join(out_dir, MODEL_FILENAME)
+    classes_save_path = os.path.join(out_dir, CLASSES_FILENAME)
+    print(f"Training model version {version} into {out_dir}")
 
-    # Save Class Mappings
-    class_indices = train_generator.class_indices
-    classes = {v: k for k, v in class_indices.items()}
-    with open(CLASSES_SAVE_PATH, 'w') as f:
+    print(f"TensorFlow Version: {tf.__version__}")
+    # 1. Data + Augmentation
+    train_generator, validation_generator, classes, n_train = load_data(pipeline, cache)
+
+    # Save Class Mappings (same sorted-folder order either way)
+    with open(classes_save_path, 'w') as f:
         json.dump(classes, f)
-    print(f"Saved {len(classes)} classes to {CLASSES_SAVE_PATH}")
+    print(f"Saved {len(classes)} classes to {classes_save_path}")
+    throughput = ThroughputCallback(n_train)
+
+    class_weight = None
+    if class_weights_path:
+        # "class_weight" from utils/data_inspector.py's report, keyed by class index
+        with open(class_weights_path) as f:
+            class_weight = {int(k): v for k, v in json.load(f)["class_weight"].items()}
+        if len(class_weight) != len(classes):
+            raise ValueError(f"{class_weights_path} has {len(class_weight)} classes, dataset has {len(classes)}")
+        print(f"Using class weights from {class_weights_path}")
 
     # 2. Model Architecture
     base_model = MobileNetV2(weights='imagenet', include_top=False, input_shape=(224, 224, 3))
     base_model.trainable = False
 
+    head_layers = build_head_layers(len(classes))
     x = base_model.output
     x = GlobalAveragePooling2D()(x)
-    x = Dense(1280, activation='relu')(x)
-    x = BatchNormalization()(x)
-    x = Dropout(0.5)(x)
-    predictions = Dense(len(classes), activation='softmax')(x)
+    for layer in head_layers:
+        x = layer(x)
+    predictions = x
 
     model = Model(inputs=base_model.input, outputs=predictions)
 
     # 3. Callbacks
     checkpoint = ModelCheckpoint(
-        MODEL_SAVE_PATH, 
+        model_save_path,
         monitor='val_accuracy', 
         save_best_only=True, 
         mode='max',
@@ -98,25 +210,39 @@ def train_model():
         verbose=1
     )
 
+    # Use slightly fewer steps than calculated len() to avoid "Ran out of data" 
+    # if one or two images were skipped during flow (though cleaning script helps).
+    # tf.data datasets just run to the end (ignore_errors() may drop a few files)
+    if pipeline == "generator":
+        steps_per_epoch = len(train_generator)
+        val_steps = len(validation_generator)
+    else:
+        steps_per_epoch = val_steps = None
+
     # 4. Phase 1: Training Classification Head
     print("\n--- Phase 1: Training Classification Head ---")
-    model.compile(optimizer=Adam(learning_rate=1e-3),
-                  loss='categorical_crossentropy',
-                  metrics=['accuracy'])
-
-    # Use slightly fewer steps than calculated len() to avoid "Ran out of data" 
-    # if one or two images were skipped during flow (though cleaning script helps)
-    steps_per_epoch = len(train_generator)
-    val_steps = len(validation_generator)
+    if head_from_features:
+        # Backbone is frozen here, so run it once and train the head on cached features
+        features = load_or_extract(base_model, DATA_DIR, views=feature_views)
+        head, history1 = train_head_on_features(features, build_head_layers(len(classes)), epochs=10,
+                                                class_weight=class_weight)
+        for layer, trained in zip(head_layers, head.layers[1:]):
+            layer.set_weights(trained.get_weights())
+        model.save(model_save_path)
+    else:
+        model.compile(optimizer=Adam(learning_rate=1e-3),
+                      loss='categorical_crossentropy',
+                      metrics=['accuracy'])
 
-    history1 = model.fit(
-        train_generator,
-        steps_per_epoch=steps_per_epoch,
-        validation_data=validation_generator,
-        validation_steps=val_steps,
-        epochs=10, 
-        callbacks=[checkpoint]
-    )
+        history1 = model.fit(
+            train_generator,
+            steps_per_epoch=steps_per_epoch,
+            validation_data=validation_generator,
+            validation_steps=val_steps,
+            epochs=10, 
+            class_weight=class_weight,
+            callbacks=[checkpoint, throughput]
+        )
 
     # 5. Phase 2: Fine Tuning
     print("\n--- Phase 2: Fine Tuning Top Layers ---")
@@ -135,11 +261,53 @@ def train_model():
         validation_data=validation_generator,
         validation_steps=val_steps,
         epochs=TOTAL_EPOCHS - 10,
-        callbacks=[checkpoint, reduce_lr, early_stop]
+        class_weight=class_weight,
+        callbacks=[checkpoint, reduce_lr, early_stop, throughput]
     )
 
     print("Training Complete.")
-    print(f"Best model saved to {MODEL_SAVE_PATH}")
+    print(f"Best model saved to {model_save_path}")
+
+    # 6. Confidence calibration
+    calibration = calibrate_model(validation_generator, out_dir, val_steps)
+
+    # 7. Register the version; the API picks up activation / shadowing without a restart
+    metrics = {"val_accuracy": best_val_accuracy(history1, history2), "ece": calibration["ece_after"]}
+    register_version(version, metrics, activate=activate, candidate=shadow_fraction is not None,
+                     shadow_fraction=shadow_fraction)
+    if activate:
+        print(f"Version {version} is now active")
+    elif shadow_fraction is not None:
+        print(f"Version {version} is shadow-scoring {shadow_fraction:.0%} of traffic")
+    else:
+        print(f"Registered {version}; serve it with: python models/model_registry.py activate {version}")
 
 if __name__ == "__main__":
-    train_model()
+    parser = argparse.ArgumentParser(description="Train the cattle breed classifier.")
+    parser.add_argument("--pipeline", choices=["tfdata", "shards", "generator"], default="tfdata",
+                        help="input pipeline (shards = build_shards.py output, generator = legacy ImageDataGenerator)")
+    parser.add_argument("--cache", action="store_true",
+                        help=f"cache resized 224x224 images under {CACHE_DIR}")
+    parser.add_argument("--head-from-features", action="store_true",
+                        help="phase 1: train the head on cached frozen-backbone features")
+    parser.add_argument("--feature-views", type=int, default=4,
+                        help="augmented views per image in the feature cache")
+    parser.add_argument("--class-weights", default=None, metavar="REPORT",
+                        help="weight the loss by the class_weight in a data_inspector.py report")
+    parser.add_argument("--calibrate-only", action="store_true",
+                        help=f"skip training; refit {CALIBRATION_FILENAME} for --version (default: the active one)")
+    parser.add_argument("--version", default=None, help="version id (default: a timestamp)")
+    promote = parser.add_mutually_exclusive_group()
+    promote.add_argument("--activate", action="store_true", help="serve the new version as soon as it is trained")
+    promote.add_argument("--shadow", type=float, default=None, metavar="FRACTION",
+                         help="register as the candidate and shadow-score this fraction of traffic")
+    args = parser.parse_args()
+    if args.calibrate_only:
+        model_dir = version_dir(args.version) if args.version else resolve_model_dir()[1]
+        _, validation_data, _, _ = load_data(args.pipeline, args.cache)
+        calibrate_model(validation_data, model_dir, len(validation_data) if args.pipeline == "generator" else None)
+        sys.exit(0)
+    train_model(pipeline=args.pipeline, cache=args.cache,
+                head_from_features=args.head_from_features, feature_views=args.feature_views,
+                class_weights_path=args.class_weights, version=args.version,
+                activate=args.activate, shadow_fraction=args.shadow)
@@ -1,29 +1,170 @@
 import os
+import csv
 import json
+import time
+import hashlib
+import argparse
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
 
-DATA_DIR = r"C:\Users\heman\Desktop\Vivek\CattleSense\ml_pipeline\data\cattle"
+# Configuration
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+DATA_DIR = os.path.join(BASE_DIR, "data", "cattle")
+REPORT_PATH = os.path.join(BASE_DIR, "data", "dataset_report.json")
+CACHE_PATH = os.path.join(BASE_DIR, "data", "inspector_cache.json")
+IMAGE_EXTS = ('.png', '.jpg', '.jpeg', '.bmp', '.gif', '.ppm', '.tif', '.tiff')
+CACHE_FORMAT = 1
 
-def inspect_data():
-    if not os.path.exists(DATA_DIR):
-        print(f"Error: Directory {DATA_DIR} does not exist.")
+# Histogram bucket lower bounds
+SHORT_SIDE_BINS = [0, 224, 480, 720, 1080]          # pixels
+ASPECT_BINS = [0, 0.75, 1.0, 1.34, 1.78]            # width / height
+FILE_SIZE_BINS = [0, 50, 200, 500, 2000]            # KB
+
+
+def _bucket(value, bins):
+    # "lo-hi" label of the bin value falls into, "lo+" for the last one
+    for lo, hi in zip(bins, bins[1:]):
+        if value < hi:
+            return f"{lo}-{hi}"
+    return f"{bins[-1]}+"
+
+
+def _dir_signature(entries):
+    # Changes when any file is added, removed, resized or touched
+    h = hashlib.sha256()
+    for name, size, mtime_ns in entries:
+        h.update(f"{name}:{size}:{mtime_ns};".encode())
+    return h.hexdigest()
+
+
+def profile_breed(args):
+    # Runs in a worker process. Only image headers are read; Image.open doesn't decode pixels.
+    breed_path, cached = args
+    entries = []
+    for entry in os.scandir(breed_path):
+        if entry.is_file() and entry.name.lower().endswith(IMAGE_EXTS):
+            st = entry.stat()
+            entries.append((entry.name, st.st_size, st.st_mtime_ns))
+    entries.sort()
+    signature = _dir_signature(entries)
+    if cached and cached.get("signature") == signature:
+        return cached, True
+
+    resolution, aspect, formats, modes, file_size = Counter(), Counter(), Counter(), Counter(), Counter()
+    unreadable = []
+    for name, size, _ in entries:
+        file_size[_bucket(size / 1024, FILE_SIZE_BINS)] += 1
+        try:
+            with Image.open(os.path.join(breed_path, name)) as img:
+                w, h = img.size
+                formats[img.format or "unknown"] += 1
+                modes[img.mode] += 1
+        except Exception:
+            unreadable.append(name)
+            continue
+        resolution[_bucket(min(w, h), SHORT_SIDE_BINS)] += 1
+        aspect[_bucket(w / h if h else 0, ASPECT_BINS)] += 1
+
+    profile = {
+        "signature": signature,
+        "count": len(entries),
+        "bytes": sum(size for _, size, _ in entries),
+        "short_side_px": dict(resolution),
+        "aspect_ratio": dict(aspect),
+        "format": dict(formats),
+        "mode": dict(modes),
+        "file_size_kb": dict(file_size),
+        "unreadable": unreadable,
+    }
+    return profile, False
+
+
+def class_balance(counts):
+    # Same formula as sklearn's class_weight="balanced": total / (n_classes * count)
+    total = sum(counts.values())
+    largest = max(counts.values()) if counts else 0
+    balance = {}
+    for breed, count in counts.items():
+        balance[breed] = {
+            "share": round(count / total, 4) if total else 0.0,
+            "imbalance_ratio": round(largest / count, 2) if count else None,
+            "class_weight": round(total / (len(counts) * count), 4) if count else 0.0,
+        }
+    return balance
+
+
+def inspect_data(data_dir=DATA_DIR, report_path=REPORT_PATH, csv_path=None, workers=None, use_cache=True):
+    if not os.path.exists(data_dir):
+        print(f"Error: Directory {data_dir} does not exist.")
         return
 
-    stats = {}
-    total_images = 0
-    
-    breeds = [d for d in os.listdir(DATA_DIR) if os.path.isdir(os.path.join(DATA_DIR, d))]
-    
+    started = time.perf_counter()
+    cache = {}
+    if use_cache and os.path.exists(CACHE_PATH):
+        with open(CACHE_PATH) as f:
+            cache = json.load(f)
+        if cache.get("format") != CACHE_FORMAT or cache.get("data_dir") != data_dir:
+            cache = {}
+    cached_breeds = cache.get("breeds", {})
+
+    # Sorted, like the class order in classes.json
+    breeds = sorted(entry.name for entry in os.scandir(data_dir) if entry.is_dir())
     print(f"Found {len(breeds)} breeds.")
-    
-    for breed in breeds:
-        breed_path = os.path.join(DATA_DIR, breed)
-        images = [f for f in os.listdir(breed_path) if f.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.gif'))]
-        count = len(images)
-        stats[breed] = count
-        total_images += count
-        
-    print(f"Total Images: {total_images}")
-    print(json.dumps(stats, indent=2))
+
+    profiles = {}
+    reused = 0
+    jobs = [(os.path.join(data_dir, breed), cached_breeds.get(breed)) for breed in breeds]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for breed, (profile, from_cache) in zip(breeds, pool.map(profile_breed, jobs)):
+            profiles[breed] = profile
+            reused += from_cache
+
+    with open(CACHE_PATH, 'w') as f:
+        json.dump({"format": CACHE_FORMAT, "data_dir": data_dir, "breeds": profiles}, f)
+
+    counts = {breed: p["count"] for breed, p in profiles.items()}
+    balance = class_balance(counts)
+    nonempty = [c for c in counts.values() if c]
+    report = {
+        "data_dir": data_dir,
+        "total_images": sum(counts.values()),
+        "num_classes": len(breeds),
+        "imbalance_ratio": round(max(nonempty) / min(nonempty), 2) if nonempty else None,
+        # Keyed by class index, ready for model.fit(class_weight=...) / train.py --class-weights
+        "class_weight": {str(i): balance[breed]["class_weight"] for i, breed in enumerate(breeds)},
+        "breeds": {
+            breed: {**{k: v for k, v in profiles[breed].items() if k != "signature"}, **balance[breed]}
+            for breed in breeds
+        },
+    }
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    if csv_path:
+        with open(csv_path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(["class_index", "breed", "count", "share", "imbalance_ratio", "class_weight",
+                             "megabytes", "unreadable", "below_224px"])
+            for i, breed in enumerate(breeds):
+                p = profiles[breed]
+                writer.writerow([i, breed, p["count"], balance[breed]["share"], balance[breed]["imbalance_ratio"],
+                                 balance[breed]["class_weight"], round(p["bytes"] / 2 ** 20, 1),
+                                 len(p["unreadable"]), p["short_side_px"].get(f"0-{SHORT_SIDE_BINS[1]}", 0)])
+
+    print(f"Total Images: {report['total_images']}")
+    print(f"Imbalance (largest / smallest class): {report['imbalance_ratio']}")
+    print(json.dumps(counts, indent=2))
+    print(f"Inspected in {time.perf_counter() - started:.1f}s ({reused}/{len(breeds)} breeds from cache)")
+    print(f"Report written to {report_path}" + (f" and {csv_path}" if csv_path else ""))
+    return report
 
 if __name__ == "__main__":
-    inspect_data()
+    parser = argparse.ArgumentParser(description="Per-breed image statistics and class-balance report.")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--out", default=REPORT_PATH, help="JSON report path")
+    parser.add_argument("--csv", default=None, help="also write a per-breed CSV here")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: all cores)")
+    parser.add_argument("--no-cache", action="store_true", help="re-read every directory")
+    args = parser.parse_args()
+    inspect_data(os.path.abspath(args.data_dir), args.out, args.csv, args.workers, not args.no_cache)